@@ -0,0 +1,300 @@
+import os
+import json
+import shutil
+import argparse
+from pathlib import Path
+import numpy as np
+import pandas as pd
+from loader import scan_merged_files
+from growth_rate import calculate_scores_matrix, load_value_matrix
+import metrics
+
+# 所有业务按时间对齐后的矩阵，存放在 data/_aligned/：
+#   times.npy   (T,)   int64 纳秒时间戳，规则网格
+#   values.npy  (T, N) float32 计数，缺失为 NaN
+#   flags.npy   (T, N) uint8 异常标记位，见 FLAGS
+#   counts.npy  (T+1, N) int32 各业务异常点数的前缀和，用于任意时间段的计数
+#   meta.json   业务名、网格间隔、源文件指纹等
+ALIGNED_DIR = "_aligned"
+ALIGNED_VERSION = 1
+
+# 异常标记位：iqr 与箱线图相同（四分位距 1.5 倍之外）；growth 与 growth_rate.detect_anomalies 相同
+FLAGS = {'iqr': 1, 'growth': 2}
+
+
+def aligned_dir_for(data_path="data"):
+    return Path(data_path) / ALIGNED_DIR
+
+
+def _sources(data_path):
+    """当前所有合并文件的指纹，用于判断对齐矩阵是否过期"""
+    return {Path(meta['path']).parent.name: {'size': meta['size'], 'mtime_ns': meta['mtime_ns']}
+            for meta in scan_merged_files(data_path)}
+
+
+def _read_meta(out_dir):
+    try:
+        with open(out_dir / 'meta.json', 'r', encoding='utf-8') as fin:
+            return json.load(fin)
+    except (OSError, ValueError):
+        return None
+
+
+def is_aligned_valid(data_path="data", freq='5min'):
+    meta = _read_meta(aligned_dir_for(data_path))
+    return (meta is not None and meta.get('version') == ALIGNED_VERSION and meta.get('freq') == freq
+            and meta.get('sources') == _sources(data_path))
+
+
+def compute_flags(values, iqr_factor=1.5, interval_minutes=30, base_interval=5, z_thresh=6.0):
+    """
+    按列计算异常标记
+
+    参数:
+    values: (T, N) 对齐后的矩阵，缺失为 NaN
+
+    返回:
+    (T, N) uint8 数组，各位含义见 FLAGS
+    """
+    flags = np.zeros(values.shape, dtype=np.uint8)
+    with np.errstate(invalid='ignore'):
+        q1, q3 = np.nanquantile(values, [0.25, 0.75], axis=0)
+        iqr = q3 - q1
+        flags[(values < q1 - iqr_factor * iqr) | (values > q3 + iqr_factor * iqr)] |= FLAGS['iqr']
+
+        _, _, score = calculate_scores_matrix(values, intervals=(interval_minutes,), base_interval=base_interval)
+        score = score[0]
+        threshold = np.nanmean(score, axis=0) + z_thresh * np.nanstd(score, axis=0)
+        flags[score > threshold] |= FLAGS['growth']
+    return flags
+
+
+def build_aligned(data_path="data", freq='5min', value_col='Count', **flag_options):
+    """
+    读取所有合并文件，对齐到同一时间网格后计算异常标记，写入 data/_aligned/
+
+    各业务通过 load_value_matrix 读取列式缓存并对齐；先写临时目录再整体替换，读者不会看到写了一半的文件。
+
+    参数:
+    flag_options: 传给 compute_flags 的参数
+
+    返回:
+    AlignedMatrix（数组为内存映射）
+    """
+    data_path = Path(data_path)
+    sources = _sources(data_path)
+    names = sorted(sources, key=lambda name: (int(name.split('.')[0]) if name.split('.')[0].isdigit() else 0, name))
+    if not names:
+        raise FileNotFoundError(f"{data_path} 下没有 *_merged.csv 文件")
+
+    with metrics.stage('aligned.build', series=len(names)) as s:
+        # 空文件（只有表头）对应整列 NaN
+        times, values, _ = load_value_matrix([data_path / name / f'{name}_merged.csv' for name in names],
+                                             value_col, freq=freq)
+        if len(times) == 0:
+            raise ValueError(f"{data_path} 下的合并文件都没有数据")
+        times = times.view('int64')
+        values = values.astype(np.float32)
+        flags = compute_flags(values, **flag_options)
+        counts = np.zeros((len(times) + 1, len(names)), dtype=np.int32)
+        np.cumsum(flags != 0, axis=0, out=counts[1:])
+        s.rows = values.size
+
+    out_dir = aligned_dir_for(data_path)
+    tmp_dir = out_dir.with_name(out_dir.name + f'.tmp{os.getpid()}')
+    try:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+        tmp_dir.mkdir()
+        for file, array in (('times.npy', times), ('values.npy', values), ('flags.npy', flags), ('counts.npy', counts)):
+            np.save(tmp_dir / file, array)
+        meta = {'version': ALIGNED_VERSION, 'freq': freq, 'names': names, 'flags': FLAGS,
+                'flag_options': flag_options, 'sources': sources}
+        with open(tmp_dir / 'meta.json', 'w', encoding='utf-8') as fout:
+            json.dump(meta, fout, ensure_ascii=False, indent=2)
+        shutil.rmtree(out_dir, ignore_errors=True)
+        os.replace(tmp_dir, out_dir)
+    except OSError as e:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+        print(f"写入对齐矩阵 {out_dir} 时出错: {e}")
+        return AlignedMatrix(times, values, flags, counts, names, freq)
+    return AlignedMatrix.open(out_dir)
+
+
+def load_aligned(data_path="data", freq='5min', rebuild=True):
+    """
+    读取对齐矩阵；源文件有变化（或网格间隔不同）时重建
+
+    参数:
+    rebuild: 为False时过期也直接读取已有文件，没有文件时返回 None
+    """
+    out_dir = aligned_dir_for(data_path)
+    valid = is_aligned_valid(data_path, freq)
+    metrics.count('aligned_cache', result='hit' if valid else 'miss')
+    if valid or (not rebuild and _read_meta(out_dir) is not None):
+        return AlignedMatrix.open(out_dir)
+    if not rebuild:
+        return None
+    return build_aligned(data_path, freq)
+
+
+class AlignedMatrix:
+    """
+    时间对齐的多业务矩阵及异常标记
+
+    时间轴升序，范围查询用二分查找；异常计数用前缀和，任意时间段 O(N)。
+    """
+
+    def __init__(self, times, values, flags, counts, names, freq='5min'):
+        self.times = times
+        self.values = values
+        self.flags = flags
+        self.counts = counts
+        self.names = list(names)
+        self.freq = freq
+        self.version = None
+
+    @classmethod
+    def open(cls, out_dir, mmap=True):
+        out_dir = Path(out_dir)
+        meta = _read_meta(out_dir)
+        mmap_mode = 'r' if mmap else None
+        arrays = [np.load(out_dir / file, mmap_mode=mmap_mode)
+                  for file in ('times.npy', 'values.npy', 'flags.npy', 'counts.npy')]
+        matrix = cls(*arrays, meta['names'], meta['freq'])
+        # 源文件指纹作为版本号，便于界面按版本缓存计算结果
+        matrix.version = json.dumps(meta['sources'], sort_keys=True)
+        return matrix
+
+    def __len__(self):
+        return len(self.times)
+
+    @property
+    def time_range(self):
+        return self.times[0].view('datetime64[ns]'), self.times[-1].view('datetime64[ns]')
+
+    def columns(self, names=None):
+        if names is None:
+            return np.arange(len(self.names))
+        return np.array([self.names.index(name) for name in names], dtype=int)
+
+    def index_range(self, start=None, end=None):
+        """[start, end) 对应的行号范围"""
+        lo = 0 if start is None else int(np.searchsorted(self.times, pd.Timestamp(start).value, side='left'))
+        hi = len(self.times) if end is None else int(np.searchsorted(self.times, pd.Timestamp(end).value, side='left'))
+        return lo, hi
+
+    def window(self, start=None, end=None, names=None):
+        """
+        截取时间段
+
+        返回:
+        (时间戳 datetime64[ns], 数值 (T', M), 标记 (T', M))；只选一部分业务时为副本，否则为视图
+        """
+        lo, hi = self.index_range(start, end)
+        times = self.times[lo:hi].view('datetime64[ns]')
+        if names is None:
+            return times, self.values[lo:hi], self.flags[lo:hi]
+        cols = self.columns(names)
+        return times, self.values[lo:hi, cols], self.flags[lo:hi, cols]
+
+    def anomaly_counts(self, start=None, end=None):
+        """各业务在时间段内的异常点数（前缀和相减）"""
+        lo, hi = self.index_range(start, end)
+        return pd.Series(self.counts[hi] - self.counts[lo], index=self.names)
+
+    def correlation(self, start=None, end=None, names=None, method='diff', min_periods=12):
+        """
+        业务间的皮尔逊相关系数
+
+        参数:
+        method: 'value' 直接用计数；'diff' 用相邻点的差分，去掉共同的日周期后更能反映同步波动
+        min_periods: 两个业务同时有数据的点数少于该值时结果为 NaN
+        """
+        _, values, _ = self.window(start, end, names)
+        values = np.asarray(values, dtype=np.float64)
+        if method == 'diff':
+            values = np.diff(values, axis=0)
+        elif method != 'value':
+            raise ValueError("method 参数必须是 'value' 或 'diff'")
+        labels = self.names if names is None else list(names)
+        return pd.DataFrame(values, columns=labels).corr(min_periods=min_periods)
+
+    def _dilated(self, lo, hi, cols, tolerance, mask=None):
+        """时间段内的异常标记，前后各扩展 tolerance 个点，用前缀和实现"""
+        flags = self.flags[lo:hi, cols]
+        hit = (flags & mask) != 0 if mask else flags != 0
+        if tolerance <= 0:
+            return hit
+        cs = np.zeros((len(hit) + 1, hit.shape[1]), dtype=np.int32)
+        np.cumsum(hit, axis=0, out=cs[1:])
+        idx = np.arange(len(hit))
+        right = np.minimum(idx + tolerance + 1, len(hit))
+        left = np.maximum(idx - tolerance, 0)
+        return (cs[right] - cs[left]) > 0
+
+    def cooccurrence(self, start=None, end=None, names=None, tolerance=0, flag=None):
+        """
+        异常共现次数矩阵
+
+        参数:
+        tolerance: 允许的时间差（网格点数），行业务的异常点前后 tolerance 个点内列业务也有异常即计为共现
+        flag: 只统计某一种标记（FLAGS 的键），默认任意标记
+
+        返回:
+        DataFrame，[i, j] 为业务 i 的异常点中与业务 j 共现的个数；对角线为业务 i 的异常点数
+        """
+        lo, hi = self.index_range(start, end)
+        cols = self.columns(names)
+        mask = FLAGS[flag] if flag else None
+        hit = self._dilated(lo, hi, cols, 0, mask).astype(np.float32)
+        near = self._dilated(lo, hi, cols, tolerance, mask).astype(np.float32)
+        matrix = (hit.T @ near).round().astype(np.int64)
+        np.fill_diagonal(matrix, hit.sum(axis=0).astype(np.int64))
+        labels = [self.names[j] for j in cols]
+        return pd.DataFrame(matrix, index=labels, columns=labels)
+
+    def coincident(self, name, start=None, end=None, tolerance=0, flag=None, names=None):
+        """
+        列出某业务每个异常点附近同时出现异常的其他业务
+
+        参数:
+        names: 只在这些业务中找同时异常的业务，默认全部
+
+        返回:
+        DataFrame，列为 ds、value、others（逗号分隔的业务名）、n_others
+        """
+        lo, hi = self.index_range(start, end)
+        target = self.names.index(name)
+        cols = self.columns(names)
+        mask = FLAGS[flag] if flag else None
+        rows = np.flatnonzero(self._dilated(lo, hi, [target], 0, mask)[:, 0])
+        near = self._dilated(lo, hi, cols, tolerance, mask)[rows]
+        near[:, cols == target] = False
+        others = [','.join(self.names[cols[j]] for j in np.flatnonzero(row)) for row in near]
+        return pd.DataFrame({
+            'ds': self.times[lo + rows].view('datetime64[ns]'),
+            'value': self.values[lo + rows, target],
+            'others': others,
+            'n_others': near.sum(axis=1),
+        })
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="生成/更新所有业务的时间对齐矩阵及异常标记")
+    parser.add_argument('--data', default='data', help="数据根目录")
+    parser.add_argument('--freq', default='5min', help="网格间隔")
+    parser.add_argument('--series', default=None, help="列出该业务各异常点附近同时异常的其他业务")
+    parser.add_argument('--start', default=None)
+    parser.add_argument('--end', default=None)
+    parser.add_argument('--tolerance', type=int, default=1, help="共现允许的时间差（网格点数）")
+    parser.add_argument('--force', action='store_true', help="即使源文件未变化也重建")
+    args = parser.parse_args()
+
+    matrix = build_aligned(args.data, args.freq) if args.force else load_aligned(args.data, args.freq)
+    first, last = matrix.time_range
+    print(f"对齐矩阵: {len(matrix.names)} 个业务 × {len(matrix)} 个时间点（{first} 至 {last}）")
+    print(matrix.anomaly_counts(args.start, args.end).to_string())
+    if args.series:
+        hits = matrix.coincident(args.series, args.start, args.end, args.tolerance)
+        print(f"\n{args.series} 的 {len(hits)} 个异常点中，{int((hits['n_others'] > 0).sum())} 个有其他业务同时异常:")
+        print(hits[hits['n_others'] > 0].to_string(index=False))
@@ -0,0 +1,82 @@
+import argparse
+import time
+import numpy as np
+import pandas as pd
+from scoring import add_residual_columns, detect_outliers
+
+
+# === 原逐行 apply 实现（仅作对照基准） ===
+def calc_error_rowwise(row):
+    if pd.isna(row['norm_y']):
+        return 0
+    if row['yhat_lower'] <= row['norm_y'] <= row['yhat_upper']:
+        return 0
+    return min(abs(row['norm_y'] - row['yhat_lower']), abs(row['norm_y'] - row['yhat_upper']))
+
+
+def detect_outliers_rowwise(df, method='zscore', z_thresh=9, iqr_factor=1.5, ratio_thresh=2.0):
+    if method == 'zscore':
+        mean_err = df['error'].mean()
+        std_err = df['error'].std()
+        outliers = df[df['error'] > (mean_err + z_thresh * std_err)]
+    elif method == 'iqr':
+        q1 = df['error'].quantile(0.25)
+        q3 = df['error'].quantile(0.75)
+        iqr = q3 - q1
+        outliers = df[df['error'] > q3 + iqr_factor * iqr]
+    else:
+        df['deviation_ratio'] = df.apply(
+            lambda row: 0 if pd.isna(row['norm_y']) or row['yhat_lower'] <= row['norm_y'] <= row['yhat_upper']
+            else abs(row['norm_y'] - row['yhat']) / (row['yhat_upper'] - row['yhat_lower'] + 1e-9),
+            axis=1
+        )
+        outliers = df[df['deviation_ratio'] > ratio_thresh]
+    return outliers
+
+
+def make_forecast_frame(n_rows, horizon=24 * 12, seed=0):
+    """构造与 Prophet 预测结果同结构的合成数据：末尾 horizon 行没有实际值"""
+    rng = np.random.default_rng(seed)
+    t = np.arange(n_rows + horizon)
+    yhat = 0.5 + 0.3 * np.sin(2 * np.pi * t / 288)
+    width = 0.05 + 0.02 * rng.random(len(t))
+    y = yhat + rng.normal(0, 0.04, len(t))
+    spikes = rng.choice(n_rows, size=max(1, n_rows // 500), replace=False)
+    y[spikes] += rng.uniform(0.3, 0.8, len(spikes))
+    y[n_rows:] = np.nan
+    return pd.DataFrame({
+        'ds': pd.date_range('2024-01-01', periods=len(t), freq='5min'),
+        'yhat': yhat,
+        'yhat_lower': yhat - width,
+        'yhat_upper': yhat + width,
+        'norm_y': y,
+    })
+
+
+def run_benchmark(n_rows, methods=('zscore', 'iqr', 'deviation_ratio')):
+    base = make_forecast_frame(n_rows)
+    print(f"数据行数: {len(base)}")
+
+    for method in methods:
+        legacy = base.copy()
+        start = time.perf_counter()
+        legacy['error'] = legacy.apply(calc_error_rowwise, axis=1)
+        legacy_out = detect_outliers_rowwise(legacy, method=method)
+        legacy_time = time.perf_counter() - start
+
+        fast = base.copy()
+        start = time.perf_counter()
+        add_residual_columns(fast)
+        fast_out = detect_outliers(fast, method=method)
+        fast_time = time.perf_counter() - start
+
+        same = legacy_out.index.equals(fast_out.index)
+        print(f"{method:>16}: apply {legacy_time:.3f}s | 向量化 {fast_time:.4f}s | "
+              f"加速 {legacy_time / max(fast_time, 1e-9):.0f}x | 异常点 {len(fast_out)} | 结果一致: {same}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="残差打分：逐行 apply 与向量化实现对比")
+    parser.add_argument('--rows', type=int, default=90 * 288, help="历史数据行数（默认约 90 天的 5 分钟数据）")
+    args = parser.parse_args()
+    run_benchmark(args.rows)
@@ -0,0 +1,140 @@
+import sys
+import time
+import shutil
+import argparse
+import tempfile
+import tracemalloc
+from pathlib import Path
+import numpy as np
+import pandas as pd
+from synthetic import generate_dataset
+
+STAGES = ['merge', 'load_and_preprocess', 'load_and_preprocess_cached', 'calculate_scores',
+          'changepoint', 'prophet']
+
+RESULT_COLUMNS = ['run_at', 'label', 'stage', 'series', 'rows', 'seconds', 'rows_per_sec',
+                  'peak_mb', 'traced', 'python', 'numpy', 'pandas']
+
+
+def measure(func, trace_memory=True):
+    """运行 func，返回 (结果, 耗时秒数, 峰值内存MB)；trace_memory 为False时峰值内存为 NaN"""
+    if trace_memory:
+        tracemalloc.start()
+    start = time.perf_counter()
+    try:
+        result = func()
+        seconds = time.perf_counter() - start
+        peak = tracemalloc.get_traced_memory()[1] / 1024 ** 2 if trace_memory else np.nan
+    finally:
+        if trace_memory:
+            tracemalloc.stop()
+    return result, seconds, peak
+
+
+def _stage_funcs(merged_path, model_dir, threshold):
+    """每个阶段的计算函数；数据准备（如读入 DataFrame）放在计时之外"""
+    from merge import merge_csvs_in_folder
+    import changepoint_demo
+    import growth_rate
+
+    folder = merged_path.parent
+    return {
+        'merge': (lambda: None, lambda _: merge_csvs_in_folder(folder, verbose=False)),
+        'load_and_preprocess': (lambda: None, lambda _: changepoint_demo.load_and_preprocess(merged_path)),
+        'load_and_preprocess_cached': (lambda: None, lambda _: changepoint_demo.load_and_preprocess(merged_path)),
+        'calculate_scores': (lambda: growth_rate.load_and_preprocess(merged_path),
+                             lambda df: growth_rate.calculate_scores(df)),
+        'changepoint': (lambda: changepoint_demo.load_and_preprocess(merged_path),
+                        lambda df: changepoint_demo.realtime_changepoint_detection(df, threshold)),
+        'prophet': (lambda: None, lambda _: _prophet_scoring(merged_path, model_dir)),
+    }
+
+
+def _prophet_scoring(path, model_dir):
+    from pystan_demo import forecast_and_score
+    from scoring import detect_outliers
+    _, _, merged = forecast_and_score(str(path), model_dir)
+    return detect_outliers(merged, method='deviation_ratio')
+
+
+def run_scale(n_rows, n_series, stages, workdir, label='', trace_memory=True, threshold=13.0,
+              prophet_max_rows=100_000):
+    """
+    在一个规模（每个业务 n_rows 行 × n_series 个业务）上运行所选阶段
+
+    返回:
+    结果 DataFrame，每个阶段一行（各业务耗时求和、峰值内存取最大）
+    """
+    data_dir = Path(workdir) / f'data_{n_rows}x{n_series}'
+    model_dir = Path(workdir) / f'models_{n_rows}x{n_series}'
+    print(f"生成合成数据: {n_series} 个业务 × {n_rows} 行 ...")
+    generate_dataset(data_dir, n_series, n_rows, merged=False)
+
+    totals = {stage: [0.0, 0.0, 0] for stage in stages}
+    for folder in sorted(p for p in data_dir.iterdir() if p.is_dir()):
+        merged_path = folder / f'{folder.name}_merged.csv'
+        funcs = _stage_funcs(merged_path, model_dir, threshold)
+        if 'merge' not in stages:
+            funcs['merge'][1](None)
+        for stage in stages:
+            if stage == 'prophet' and n_rows > prophet_max_rows:
+                continue
+            prepare, run = funcs[stage]
+            data = prepare()
+            _, seconds, peak = measure(lambda: run(data), trace_memory)
+            totals[stage][0] += seconds
+            totals[stage][1] = max(totals[stage][1], peak) if trace_memory else np.nan
+            totals[stage][2] += 1
+
+    run_at = pd.Timestamp.now().isoformat(timespec='seconds')
+    rows = []
+    for stage, (seconds, peak, count) in totals.items():
+        if count == 0:
+            print(f"{stage:>28}: 跳过（超过 prophet_max_rows={prophet_max_rows}）")
+            continue
+        total_rows = n_rows * count
+        rows.append({
+            'run_at': run_at, 'label': label, 'stage': stage, 'series': count, 'rows': total_rows,
+            'seconds': round(seconds, 4), 'rows_per_sec': round(total_rows / max(seconds, 1e-9)),
+            'peak_mb': round(peak, 2), 'traced': trace_memory,
+            'python': sys.version.split()[0], 'numpy': np.__version__, 'pandas': pd.__version__,
+        })
+        print(f"{stage:>28}: {seconds:8.3f} 秒 | {total_rows / max(seconds, 1e-9):12,.0f} 行/秒 | 峰值 {peak:8.1f} MB")
+    shutil.rmtree(data_dir, ignore_errors=True)
+    shutil.rmtree(model_dir, ignore_errors=True)
+    return pd.DataFrame(rows, columns=RESULT_COLUMNS)
+
+
+def run_benchmarks(rows_list, series_list, stages=STAGES, output='benchmark_results.csv', label='',
+                   trace_memory=True, threshold=13.0, prophet_max_rows=100_000):
+    """依次运行各规模的基准测试，结果追加写入 output（CSV）"""
+    results = []
+    with tempfile.TemporaryDirectory(prefix='anomaly_bench_') as workdir:
+        for n_series in series_list:
+            for n_rows in rows_list:
+                results.append(run_scale(n_rows, n_series, stages, workdir, label, trace_memory,
+                                         threshold, prophet_max_rows))
+    results = pd.concat(results, ignore_index=True)
+    output = Path(output)
+    results.to_csv(output, mode='a', header=not output.exists(), index=False)
+    print(f"结果已追加到 {output}")
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="各检测器与加载器的合成数据基准测试")
+    parser.add_argument('--rows', type=int, nargs='+', default=[10_000, 100_000],
+                        help="每个业务的行数，可给多个（例如 10000 1000000 10000000）")
+    parser.add_argument('--series', type=int, nargs='+', default=[1], help="业务数量，可给多个（例如 1 10 100）")
+    parser.add_argument('--stages', nargs='+', choices=STAGES, default=STAGES)
+    parser.add_argument('--output', default='benchmark_results.csv', help="结果文件（追加写入）")
+    parser.add_argument('--label', default='', help="本次运行的标签，例如分支名或提交号")
+    parser.add_argument('--threshold', type=float, default=13.0, help="FOCUS 报警阈值")
+    parser.add_argument('--prophet-max-rows', type=int, default=100_000,
+                        help="超过该行数的规模跳过 Prophet 阶段")
+    parser.add_argument('--no-memory', action='store_true',
+                        help="不用 tracemalloc 统计峰值内存（tracemalloc 会拖慢纯 Python 循环）")
+    args = parser.parse_args()
+
+    run_benchmarks(args.rows, args.series, args.stages, args.output, args.label,
+                   not args.no_memory, args.threshold, args.prophet_max_rows)
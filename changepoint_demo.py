@@ -1,64 +1,297 @@
 import os
+import time
+import argparse
+from collections import deque
+import numpy as np
 import pandas as pd
-import matplotlib.pyplot as plt
 from changepoint_online import Focus, Poisson
+from loader import load_merged
+from preprocess import normalize_column, apply_scaler, minmax_params
+import metrics
 
-def load_and_preprocess(csv_path):
-    df = pd.read_csv(csv_path)
+def load_and_preprocess(csv_path, fill=None, scaler=None, method='minmax', dtype=None):
+    # fill 为 'zero'/'nan' 等时先对齐到 5 分钟网格（见 loader.align_to_grid）
+    # scaler 为已保存的归一化参数（dict 或 JSON 路径），为None时按 method 重新计算，见 preprocess.fit_scaler
+    df = load_merged(csv_path, fill=fill)
     df.rename(columns={'Time': 'ds', 'Count': 'original_y'}, inplace=True)
-    df['ds'] = pd.to_datetime(df['ds'])
-    non_zero = df[df['original_y'] > 0]['original_y']
-    y_min, y_max = non_zero.min(), non_zero.max()
-    df['norm_y'] = df['original_y'].apply(lambda x: (x - y_min) / (y_max - y_min) if x > 0 else 0)
+    df.attrs['scaler'] = normalize_column(df, 'original_y', 'norm_y', params=scaler, method=method, dtype=dtype)
     return df
 
-def realtime_changepoint_detection(df, threshold=10.0):
-    detector = Focus(Poisson())
-    cps = []
-    stats = []
 
-    for idx, row in df.iterrows():
-        y = row['norm_y']
-        detector.update(y)
-        stat = detector.statistic()
-        stats.append(stat)
+def _reset_focus(detector):
+    """
+    原地清空 Focus 的状态，复用已有对象而不是每次报警都新建；返回重置后的检测器
 
-        if stat >= threshold:
-            info = detector.changepoint()
-            cps.append((row['ds'], info['changepoint'], stat))
-            detector = Focus(Poisson())  # 重新初始化
+    依赖 changepoint_online 的内部结构（cs/ql/qr）；版本不同、缺少这些内部类时退回到新建对象
+    """
+    try:
+        cs = Focus._CUSUM()
+        ql = Focus._Cost(ps=[detector.comp_func(0.0, 0, 0.0)])
+        qr = Focus._Cost(ps=[detector.comp_func(0.0, 0, 0.0)])
+    except (AttributeError, TypeError):
+        return Focus(detector.comp_func, detector.side)
+    detector.cs, detector.ql, detector.qr = cs, ql, qr
+    return detector
 
+
+class StreamingChangepointDetector:
+    """
+    流式 FOCUS 变点检测器
+
+    跨批次保持检测状态，可直接消费 NumPy 数组块或 (timestamp, count) 生成器；
+    统计量写入预分配的环形缓冲区，只保留最近 capacity 个点。
+
+    参数:
+    threshold: 统计量报警阈值
+    capacity: 环形缓冲区容量（点数），也是 reset='changepoint' 时最多回放的点数
+    scale: 可选 (y_min, y_max)，传入时对原始计数做非零 min-max 归一化后再检测
+    reset: 报警后的重置方式。'alarm'（默认，与原实现一致）从报警点之后重新开始；
+           'changepoint' 从检测到的变点位置重新开始，回放变点之后已缓存的数据，
+           变化后的新水平不必从零重新学习
+    cooldown: 报警后多少个点内不再报警（统计量照常计算）
+    """
+
+    def __init__(self, threshold=10.0, capacity=288 * 7, scale=None, reset='alarm', cooldown=0):
+        if reset not in ('alarm', 'changepoint'):
+            raise ValueError("reset 参数必须是 'alarm' 或 'changepoint'")
+        self.threshold = threshold
+        self.capacity = capacity
+        self.scale = scale
+        self.reset = reset
+        self.cooldown = cooldown
+        self.detector = Focus(Poisson())
+        self.times = np.zeros(capacity, dtype='int64')
+        self.stats = np.zeros(capacity, dtype=float)
+        self.n_seen = 0
+        self.changepoints = []
+        # 自上次重置以来的观测值，只在 reset='changepoint' 时使用
+        self.segment = deque(maxlen=capacity)
+        self.quiet = 0
+        self.n_updates = 0
+        self.update_seconds = 0.0
+
+    def __getstate__(self):
+        # Poisson() 返回的工厂函数是 lambda，无法 pickle；保存时去掉，恢复时重建
+        state = self.__dict__.copy()
+        focus_state = self.detector.__dict__.copy()
+        focus_state.pop('comp_func', None)
+        state['detector'] = focus_state
+        return state
+
+    def __setstate__(self, state):
+        focus = Focus.__new__(Focus)
+        focus.__dict__.update(state['detector'])
+        focus.comp_func = Poisson()
+        state['detector'] = focus
+        # 兼容旧版本保存的检查点
+        state.setdefault('reset', 'alarm')
+        state.setdefault('cooldown', 0)
+        state.setdefault('segment', deque(maxlen=state['capacity']))
+        state.setdefault('quiet', 0)
+        state.setdefault('n_updates', state['n_seen'])
+        state.setdefault('update_seconds', 0.0)
+        self.__dict__.update(state)
+
+    def _normalize(self, values):
+        if self.scale is None:
+            return values
+        return apply_scaler(values, minmax_params(*self.scale))
+
+    def update(self, timestamps, values):
+        """
+        输入一批数据，返回本批新检测到的变点列表 [(时间, 变点位置, 统计量), ...]
+
+        参数:
+        timestamps: datetime64 或 int64 纳秒时间戳数组
+        values: 与时间戳等长的观测值数组
+        """
+        start = time.perf_counter()
+        times = np.asarray(timestamps).astype('datetime64[ns]').astype('int64')
+        values = self._normalize(np.asarray(values, dtype=float))
+        threshold = self.threshold
+        detector = self.detector
+        replay = self.reset == 'changepoint'
+        segment = self.segment
+        quiet = self.quiet
+        batch_stats = np.empty(len(values), dtype=float)
+        found = []
+        replayed = 0
+
+        # 转为 Python 浮点列表逐点更新，避免 iterrows 的装箱开销
+        for i, y in enumerate(values.tolist()):
+            detector.update(y)
+            if replay:
+                segment.append(y)
+            stat = detector.statistic()
+            batch_stats[i] = stat
+            if quiet:
+                quiet -= 1
+            elif stat >= threshold:
+                info = detector.changepoint()
+                found.append((pd.Timestamp(times[i]), info['changepoint'], stat))
+                quiet = self.cooldown
+                detector = _reset_focus(detector)
+                if replay:
+                    detector, n = self._replay(detector, info, pd.Timestamp(times[i]), found)
+                    replayed += n
+
+        self.detector = detector
+        self.quiet = quiet
+        self.n_updates += len(values) + replayed
+        self.update_seconds += time.perf_counter() - start
+        self._write(times, batch_stats)
+        self.changepoints.extend(found)
+        return found
+
+    def _tail(self, info):
+        """
+        变点之后属于新水平的缓存值
+
+        changepoint 是相对上次重置的计数，之后的 stopping_time - changepoint 个点属于新水平。
+        新水平为空，或变点在缓存开头之前（回放全部数据会再次在同一处报警）时不回放。
+        """
+        n_tail = info['stopping_time'] - info['changepoint']
+        if n_tail <= 0 or n_tail >= len(self.segment):
+            return []
+        return list(self.segment)[-n_tail:]
+
+    def _replay(self, detector, info, ts, found):
+        """
+        把变点之后的缓存值重新送入新的 Focus
+
+        回放时同样检查阈值：缓存段内若还有第二个变点，在本次报警时间 ts 一并报出，
+        再从该变点继续回放。每次报警后待回放的点数严格减少，循环必然结束。
+        回放的点在报警之前，不受 cooldown 限制。
+
+        返回:
+        (新的 Focus, 回放的点数)
+        """
+        segment = self.segment
+        pending = deque(self._tail(info))
+        segment.clear()
+        replayed = 0
+        while pending:
+            v = pending.popleft()
+            detector.update(v)
+            segment.append(v)
+            replayed += 1
+            stat = detector.statistic()
+            if stat >= self.threshold:
+                info = detector.changepoint()
+                found.append((ts, info['changepoint'], stat))
+                detector = _reset_focus(detector)
+                pending.extendleft(reversed(self._tail(info)))
+                segment.clear()
+        return detector, replayed
+
+    def _write(self, times, stats):
+        # 只有最后 capacity 个点会留在缓冲区中
+        if len(stats) > self.capacity:
+            skip = len(stats) - self.capacity
+            times, stats = times[skip:], stats[skip:]
+            start = self.n_seen + skip
+        else:
+            start = self.n_seen
+        idx = (start + np.arange(len(stats))) % self.capacity
+        self.times[idx] = times
+        self.stats[idx] = stats
+        self.n_seen = start + len(stats)
+
+    def consume(self, stream, batch_size=1024):
+        """消费 (timestamp, count) 生成器，按 batch_size 攒批后更新，逐批产出新变点"""
+        times, values = [], []
+        for ts, count in stream:
+            times.append(np.datetime64(ts, 'ns'))
+            values.append(count)
+            if len(values) >= batch_size:
+                yield from self.update(np.array(times), np.array(values, dtype=float))
+                times, values = [], []
+        if values:
+            yield from self.update(np.array(times), np.array(values, dtype=float))
+
+    def cost(self):
+        """累计的每点开销：平均每个输入点触发的 Focus 更新次数（含回放）和耗时（微秒）"""
+        n = max(self.n_seen, 1)
+        return {'points': self.n_seen, 'updates': self.n_updates,
+                'updates_per_point': self.n_updates / n, 'us_per_point': self.update_seconds / n * 1e6}
+
+    def recent(self):
+        """按时间顺序返回缓冲区中的 (时间戳, 统计量)"""
+        size = min(self.n_seen, self.capacity)
+        idx = (self.n_seen - size + np.arange(size)) % self.capacity
+        return self.times[idx].astype('datetime64[ns]'), self.stats[idx]
+
+
+def realtime_changepoint_detection(df, threshold=10.0, reset='alarm', cooldown=0):
+    stream = StreamingChangepointDetector(threshold=threshold, capacity=max(len(df), 1),
+                                          reset=reset, cooldown=cooldown)
+    with metrics.stage('score', rows=len(df), detector='changepoint'):
+        cps = stream.update(df['ds'].values, df['norm_y'].values)
+    _, stats = stream.recent()
     df['statistic'] = stats
+    df.attrs['cost'] = stream.cost()
     return cps, df
 
-def plot_results(df, changepoints):
-    fig, axs = plt.subplots(2, 1, figsize=(14, 8), sharex=True)
+def plot_results(df, changepoints, threshold=13, save_path=None):
+    # save_path 不为None时保存到文件并关闭图形（不弹出窗口），用于批量生成报告
+    import matplotlib.pyplot as plt
 
-    # 绘制时间序列
-    axs[0].plot(df['ds'], df['norm_y'], label='Normalized Series')
-    for t, cp, stat in changepoints:
-        axs[0].axvline(t, color='red', linestyle='--', alpha=0.7)
-        axs[0].text(t, df['norm_y'].max()*0.9, f'{stat:.1f}', rotation=90, color='red')
-    axs[0].set_title("Time Series with Detected Changepoints")
-    axs[0].legend()
+    with metrics.stage('plot', rows=len(df), detector='changepoint'):
+        fig, axs = plt.subplots(2, 1, figsize=(14, 8), sharex=True)
 
-    # 绘制 statistic 曲线
-    axs[1].plot(df['ds'], df['statistic'], color='purple', label='Statistic')
-    axs[1].axhline(y=threshold, color='gray', linestyle='--', label='Threshold')
-    axs[1].set_title("Changepoint Statistic Over Time")
-    axs[1].legend()
+        # 绘制时间序列
+        axs[0].plot(df['ds'], df['norm_y'], label='Normalized Series')
+        for t, cp, stat in changepoints:
+            axs[0].axvline(t, color='red', linestyle='--', alpha=0.7)
+            axs[0].text(t, df['norm_y'].max()*0.9, f'{stat:.1f}', rotation=90, color='red')
+        axs[0].set_title("Time Series with Detected Changepoints")
+        axs[0].legend()
 
-    plt.xlabel("Time")
-    plt.tight_layout()
-    plt.show()
+        # 绘制 statistic 曲线
+        axs[1].plot(df['ds'], df['statistic'], color='purple', label='Statistic')
+        axs[1].axhline(y=threshold, color='gray', linestyle='--', label='Threshold')
+        axs[1].set_title("Changepoint Statistic Over Time")
+        axs[1].legend()
 
-if __name__ == "__main__":
-    path = 'data\\35.企业信使\\35.企业信使_merged.csv'
-    #path = 'data\\31.企网汇款\\31.企网汇款_merged.csv'
-    #path = 'data\\23.三方平台快捷支付\\23.三方平台快捷支付_merged.csv'
-    #path = 'data\\9.手机银行\\9.手机银行_merged.csv'
-    threshold = 13
+        plt.xlabel("Time")
+        plt.tight_layout()
+    if save_path:
+        fig.savefig(save_path)
+        plt.close(fig)
+    else:
+        plt.show()
+
+def detect_anomalies(path, threshold=13, reset='alarm', cooldown=0):
+    """批量检测入口：返回变点 DataFrame，列为 ds、value（原始值）、score（统计量）、changepoint"""
     df = load_and_preprocess(path)
-    cps, df_with_stat = realtime_changepoint_detection(df, threshold=threshold)
+    cps, _ = realtime_changepoint_detection(df, threshold=threshold, reset=reset, cooldown=cooldown)
+    times = np.array([t.to_datetime64() for t, _, _ in cps], dtype='datetime64[ns]')
+    pos = np.searchsorted(df['ds'].values, times)
+    return pd.DataFrame({
+        'ds': times,
+        'value': df['original_y'].values[pos],
+        'score': np.array([stat for _, _, stat in cps], dtype=float),
+        'changepoint': np.array([cp for _, cp, _ in cps], dtype='int64'),
+    })
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="FOCUS 在线变点检测")
+    parser.add_argument('path', nargs='?', default=os.path.join('data', '35.企业信使', '35.企业信使_merged.csv'))
+    #path = os.path.join('data', '31.企网汇款', '31.企网汇款_merged.csv')
+    #path = os.path.join('data', '23.三方平台快捷支付', '23.三方平台快捷支付_merged.csv')
+    #path = os.path.join('data', '9.手机银行', '9.手机银行_merged.csv')
+    parser.add_argument('--threshold', type=float, default=13)
+    parser.add_argument('--reset', choices=['alarm', 'changepoint'], default='alarm',
+                        help="报警后从报警点还是从变点位置重新开始检测")
+    parser.add_argument('--cooldown', type=int, default=0, help="报警后多少个点内不再报警")
+    parser.add_argument('--save', default=None, help="把图保存到该文件（PNG/SVG），不弹出窗口")
+    args = parser.parse_args()
+    threshold = args.threshold
+    df = load_and_preprocess(args.path)
+    cps, df_with_stat = realtime_changepoint_detection(df, threshold=threshold, reset=args.reset,
+                                                       cooldown=args.cooldown)
     print("Detected changepoints:", cps)
-    plot_results(df_with_stat, cps)
+    cost = df_with_stat.attrs['cost']
+    print(f"每点 Focus 更新 {cost['updates_per_point']:.3f} 次，耗时 {cost['us_per_point']:.1f} 微秒")
+    plot_results(df_with_stat, cps, threshold, args.save)
@@ -0,0 +1,105 @@
+import numpy as np
+
+
+def _as_float_x(x):
+    x = np.asarray(x)
+    if np.issubdtype(x.dtype, np.datetime64):
+        return x.astype('datetime64[ns]').astype('int64').astype(float)
+    return x.astype(float)
+
+
+def minmax_indices(x, y, n_out):
+    """
+    按横轴等宽分桶（相当于每个像素一桶），保留每桶的最小值和最大值点
+
+    突刺一定落在某个桶的极值上，因此不会被抹掉。
+
+    返回:
+    升序排列的下标数组，长度不超过 n_out（另加首尾两点）
+    """
+    y = np.asarray(y, dtype=float)
+    n = len(y)
+    if n <= n_out or n_out < 4:
+        return np.arange(n)
+
+    valid = np.flatnonzero(~np.isnan(y))
+    if len(valid) <= n_out:
+        return valid
+    xf = _as_float_x(x)[valid]
+    yv = y[valid]
+
+    n_buckets = n_out // 2
+    span = xf[-1] - xf[0]
+    if span <= 0:
+        buckets = np.arange(len(valid)) * n_buckets // len(valid)
+    else:
+        buckets = np.minimum(((xf - xf[0]) / span * n_buckets).astype(np.int64), n_buckets - 1)
+
+    # 横轴有序，因此每个桶是连续的一段，可以用 reduceat 分段求极值
+    starts = np.flatnonzero(np.r_[True, buckets[1:] != buckets[:-1]])
+    group = np.repeat(np.arange(len(starts)), np.diff(np.r_[starts, len(valid)]))
+    picked = [np.array([0, len(valid) - 1])]
+    for extreme in (np.minimum.reduceat(yv, starts), np.maximum.reduceat(yv, starts)):
+        hits = np.flatnonzero(yv == extreme[group])
+        first = np.r_[True, group[hits][1:] != group[hits][:-1]]
+        picked.append(hits[first])
+    picked = np.unique(np.concatenate(picked))
+    return valid[picked]
+
+
+def lttb_indices(x, y, n_out):
+    """
+    Largest-Triangle-Three-Buckets 降采样
+
+    每个桶内选出与前一个已选点、下一个桶均值构成三角形面积最大的点，
+    比等间隔抽样更能保留形状和尖峰。逐桶循环，每个桶内向量化计算。
+
+    返回:
+    升序排列的下标数组，长度为 n_out
+    """
+    y = np.asarray(y, dtype=float)
+    n = len(y)
+    if n <= n_out or n_out < 3:
+        return np.arange(n)
+
+    valid = np.flatnonzero(~np.isnan(y))
+    if len(valid) <= n_out:
+        return valid
+    xf = _as_float_x(x)[valid]
+    yv = y[valid]
+    m = len(valid)
+
+    # 首尾两点固定，中间 m-2 个点分为 n_out-2 个桶
+    edges = np.linspace(1, m - 1, n_out - 1).astype(np.int64)
+    picked = np.empty(n_out, dtype=np.int64)
+    picked[0] = 0
+    picked[-1] = m - 1
+    prev = 0
+    for i in range(n_out - 2):
+        lo, hi = edges[i], edges[i + 1]
+        if i + 2 < n_out - 1:
+            nlo, nhi = edges[i + 1], edges[i + 2]
+            avg_x, avg_y = xf[nlo:nhi].mean(), yv[nlo:nhi].mean()
+        else:
+            avg_x, avg_y = xf[-1], yv[-1]
+        area = np.abs((xf[prev] - avg_x) * (yv[lo:hi] - yv[prev])
+                      - (xf[prev] - xf[lo:hi]) * (avg_y - yv[prev]))
+        prev = lo + int(np.argmax(area))
+        picked[i + 1] = prev
+    return valid[picked]
+
+
+def downsample(x, y, n_out, method='minmax'):
+    """
+    对一条曲线降采样，返回 (x, y)
+
+    参数:
+    method: 'minmax' 每桶保留最小/最大值；'lttb' 使用 LTTB 算法
+    """
+    if method == 'minmax':
+        idx = minmax_indices(x, y, n_out)
+    elif method == 'lttb':
+        idx = lttb_indices(x, y, n_out)
+    else:
+        raise ValueError("method 参数必须是 'minmax' 或 'lttb'")
+    return np.asarray(x)[idx], np.asarray(y)[idx]
@@ -0,0 +1,155 @@
+import os
+import time
+import queue
+import signal
+import argparse
+import multiprocessing as mp
+from contextlib import contextmanager
+import pandas as pd
+
+try:
+    import resource
+except ImportError:  # Windows 没有 resource 模块，内存上限不生效
+    resource = None
+
+# 每个拟合进程内的线程数相关环境变量，避免多个进程争抢CPU。
+# BLAS 在 numpy 导入时就读取这些变量，所以要在子进程启动前设置好（见 _thread_env），
+# 并用 spawn 启动全新的解释器；fork 出的子进程会沿用父进程已初始化的 BLAS 线程池
+THREAD_ENV_VARS = ['STAN_NUM_THREADS', 'OMP_NUM_THREADS', 'OPENBLAS_NUM_THREADS', 'MKL_NUM_THREADS']
+
+
+@contextmanager
+def _thread_env(threads):
+    """临时设置线程数环境变量，期间启动的子进程继承这些值"""
+    saved = {var: os.environ.get(var) for var in THREAD_ENV_VARS}
+    os.environ.update({var: str(threads) for var in THREAD_ENV_VARS})
+    try:
+        yield
+    finally:
+        for var, value in saved.items():
+            if value is None:
+                os.environ.pop(var, None)
+            else:
+                os.environ[var] = value
+
+
+def _limit_resources(mem_limit_mb):
+    if hasattr(os, 'setpgrp'):
+        # 独立进程组，超时时连同 cmdstan 子进程一起结束
+        os.setpgrp()
+    if mem_limit_mb and resource is not None:
+        limit = int(mem_limit_mb) * 1024 * 1024
+        resource.setrlimit(resource.RLIMIT_AS, (limit, limit))
+
+
+def _fit_worker(path, model_dir, min_new_points, mem_limit_mb, results):
+    start = time.perf_counter()
+    try:
+        _limit_resources(mem_limit_mb)
+        # 子进程内才导入 Prophet，父进程只负责调度
+        from pystan_demo import load_and_preprocess, model_path_for, model_name_for
+        from model_registry import ModelRegistry
+
+        df, _, _ = load_and_preprocess(path)
+        registry = ModelRegistry(model_dir, min_new_points=min_new_points)
+        name = model_name_for(model_path_for(path, model_dir))
+        registry.get_model(df, name)
+        entry = registry.entries[name]
+        results.put((path, 'ok', time.perf_counter() - start, None, entry.get('warm_start'), entry.get('fit_seconds')))
+    except MemoryError:
+        results.put((path, 'failed', time.perf_counter() - start, f"超出内存上限 {mem_limit_mb}MB", None, None))
+    except Exception as e:
+        results.put((path, 'failed', time.perf_counter() - start, f"{type(e).__name__}: {e}", None, None))
+
+
+def _kill(proc):
+    if hasattr(os, 'killpg'):
+        try:
+            os.killpg(proc.pid, signal.SIGKILL)
+        except (ProcessLookupError, PermissionError):
+            proc.kill()
+    else:
+        proc.kill()
+    proc.join()
+
+
+def fit_models(paths, model_dir='models', workers=None, timeout=600, mem_limit_mb=None,
+               stan_threads=1, min_new_points=288):
+    """
+    并行拟合多个序列的 Prophet 模型
+
+    每个序列在独立进程中拟合（spawn 方式启动，线程数限制对 numpy 的 BLAS 和 cmdstan 都生效），
+    同时运行的进程数不超过 workers。
+    单个拟合超时会被强制结束，超出内存上限或抛出异常只记为该序列失败，不影响其他序列。
+
+    参数:
+    paths: 合并后的CSV文件路径列表
+    timeout: 单个拟合的超时秒数
+    mem_limit_mb: 单个拟合进程（含 cmdstan 子进程）的地址空间上限，仅 Unix 生效
+    stan_threads: 每个进程允许的 Stan/BLAS 线程数
+
+    返回:
+    DataFrame，每个序列一行：series、status（ok/failed/timeout/crashed）、seconds、error 等
+    """
+    workers = workers or os.cpu_count() or 1
+    ctx = mp.get_context('spawn')
+    results = ctx.Queue()
+    pending = list(paths)
+    running = {}
+    records = {}
+    total = len(pending)
+
+    def record(path, status, seconds, error=None, warm_start=None, fit_seconds=None):
+        records[path] = {'series': os.path.basename(os.path.dirname(path)), 'status': status,
+                         'seconds': round(seconds, 3), 'error': error,
+                         'warm_start': warm_start, 'fit_seconds': fit_seconds}
+        detail = f"，{error}" if error else ""
+        print(f"[{len(records)}/{total}] {records[path]['series']}: {status}，耗时 {seconds:.1f} 秒{detail}")
+
+    while pending or running:
+        while pending and len(running) < workers:
+            path = str(pending.pop(0))
+            proc = ctx.Process(target=_fit_worker, args=(path, model_dir, min_new_points, mem_limit_mb, results))
+            with _thread_env(stan_threads):
+                proc.start()
+            running[path] = (proc, time.perf_counter())
+
+        try:
+            path, status, seconds, error, warm_start, fit_seconds = results.get(timeout=0.2)
+            if path in running:
+                running.pop(path)[0].join()
+                record(path, status, seconds, error, warm_start, fit_seconds)
+        except queue.Empty:
+            pass
+
+        now = time.perf_counter()
+        for path, (proc, started) in list(running.items()):
+            if now - started > timeout:
+                _kill(proc)
+                running.pop(path)
+                record(path, 'timeout', now - started, f"超过 {timeout} 秒")
+            elif not proc.is_alive() and proc.exitcode != 0:
+                # 进程被系统杀死（例如 OOM）时不会有结果消息
+                running.pop(path)
+                record(path, 'crashed', now - started, f"退出码 {proc.exitcode}")
+
+    return pd.DataFrame(list(records.values()))
+
+
+if __name__ == "__main__":
+    from pipeline import find_series
+
+    parser = argparse.ArgumentParser(description="并行拟合所有业务的 Prophet 模型")
+    parser.add_argument('--data', default='data', help="数据根目录")
+    parser.add_argument('--model-dir', default='models')
+    parser.add_argument('--workers', type=int, default=None, help="并行进程数，默认CPU核数")
+    parser.add_argument('--timeout', type=float, default=600, help="单个拟合的超时秒数")
+    parser.add_argument('--mem-limit-mb', type=int, default=None, help="单个拟合进程的内存上限（MB）")
+    parser.add_argument('--stan-threads', type=int, default=1, help="每个进程的 Stan/BLAS 线程数")
+    parser.add_argument('--min-new-points', type=int, default=288, help="新增多少数据点后重新拟合模型")
+    args = parser.parse_args()
+
+    summary = fit_models(find_series(args.data), args.model_dir, args.workers, args.timeout,
+                         args.mem_limit_mb, args.stan_threads, args.min_new_points)
+    if not summary.empty:
+        print(summary.to_string(index=False))
@@ -1,37 +1,61 @@
+import os
+import argparse
+from collections import deque
 import pandas as pd
 import numpy as np
-import matplotlib.pyplot as plt
+from loader import load_merged, load_arrays, align_to_grid
+from preprocess import fit_scaler, apply_scaler, rolling_min_max
+import metrics
 
-# 设置中文字体（适用于Windows系统）
-plt.rcParams['font.family'] = 'SimHei'       # 黑体
-plt.rcParams['axes.unicode_minus'] = False   # 正常显示负号
 
+def _setup_matplotlib():
+    """首次绘图时才导入 matplotlib 并设置中文字体，批量检测不加载绘图库"""
+    import matplotlib.pyplot as plt
 
-def load_and_preprocess(csv_path):
-    df = pd.read_csv(csv_path)
+    # 设置中文字体（适用于Windows系统）
+    plt.rcParams['font.family'] = 'SimHei'       # 黑体
+    plt.rcParams['axes.unicode_minus'] = False   # 正常显示负号
+    return plt
+
+
+def load_and_preprocess(csv_path, fill='nan', freq='5min'):
+    # 对齐到 5 分钟网格：缺失的采集文件不会让按行数计算的窗口跨越错误的时间长度
+    df = load_merged(csv_path, fill=fill, freq=freq)
     df.rename(columns={'Time': 'ds', 'Count': 'value'}, inplace=True)
-    df['ds'] = pd.to_datetime(df['ds'])
     df.sort_values('ds', inplace=True)
     df.reset_index(drop=True, inplace=True)
     return df
 
-def calculate_scores(df, interval_minutes=30, base_interval=5):
+def calculate_scores(df, interval_minutes=30, base_interval=5, norm_window=None):
+    """
+    参数:
+    norm_window: 归一化窗口（点数）。None 时按全序列的最小/最大值归一化；
+                 为整数时按尾随窗口内的最小/最大值归一化，与 RollingGrowthScorer 的逐点输出一致
+    """
+    with metrics.stage('score', rows=len(df), detector='growth'):
+        return _calculate_scores(df, interval_minutes, base_interval, norm_window)
+
+
+def _calculate_scores(df, interval_minutes, base_interval, norm_window):
     values = df['value'].values
     n = len(values)
 
     window_size = interval_minutes // base_interval
 
-    # 增量计算
-    delta = (values - np.roll(values, window_size)).astype(float)
-    delta[:window_size] = np.nan
+    # 增量计算：直接错位相减，前 window_size 个点没有可比较的历史值
+    delta = np.full(n, np.nan)
+    if n > window_size:
+        delta[window_size:] = values[window_size:] - values[:n - window_size]
 
 
     df['delta_30min'] = delta
 
     # 当前值归一化，避免除0，加一个极小值
-    min_val = np.min(values)
-    max_val = np.max(values)
-    norm_value = (values - min_val) / (max_val - min_val + 1e-9)
+    if norm_window is None:
+        params = fit_scaler(values, 'minmax', nonzero=False, eps=1e-9)
+    else:
+        params = fit_scaler(values, 'rolling', nonzero=False, eps=1e-9, window=norm_window)
+    norm_value = apply_scaler(values, params)
     df['norm_value'] = norm_value
 
 
@@ -42,31 +66,189 @@ def calculate_scores(df, interval_minutes=30, base_interval=5):
 
     return df
 
-def plot_all(df):
-    fig, axs = plt.subplots(3, 1, figsize=(14, 12), sharex=True)
-
-    axs[0].plot(df['ds'], df['value'], label='原始数据')
-    axs[0].set_title('原始数据')
-    axs[0].legend()
-
-    axs[1].plot(df['ds'], df['delta_30min'], label='30分钟增量 (delta)', color='orange')
-    axs[1].legend()
 
+def calculate_scores_matrix(values, intervals=(10, 30, 60, 120), base_interval=5, norm_window=None):
+    """
+    多业务、多窗口一次性计算突增得分
+
+    参数:
+    values: (T, N) 二维数组，行必须是间隔为 base_interval 分钟的规则时间网格（见 load_value_matrix），
+            每列一个业务，缺失值为 NaN；行号之差即时间差，滞后才对应 intervals 中的时长
+    intervals: 增量窗口（分钟）列表
+    norm_window: 同 calculate_scores，None 时按每列全序列最小/最大值归一化
+
+    返回:
+    (delta, norm_value, score)：delta 和 score 形状为 (K, T, N)，K 为窗口数；norm_value 形状为 (T, N)。
+    某列在网格上没有缺口时，该列每个窗口的结果与对该列单独调用 calculate_scores 相同
+    """
+    values = np.asarray(values, dtype=float)
+    if values.ndim == 1:
+        values = values[:, None]
+    n = values.shape[0]
+    lags = np.asarray(intervals) // base_interval
+
+    # (K, T) 的滞后行号，一次花式索引取出所有窗口的滞后矩阵，再原地相减
+    lag_rows = np.arange(n)[None, :] - lags[:, None]
+    delta = values[np.clip(lag_rows, 0, None)]
+    np.subtract(values[None, :, :], delta, out=delta)
+    delta[lag_rows < 0] = np.nan
+
+    if norm_window is None:
+        min_val = np.nanmin(values, axis=0)
+        max_val = np.nanmax(values, axis=0)
+    else:
+        rolling = pd.DataFrame(values).rolling(norm_window, min_periods=1)
+        min_val = rolling.min().values
+        max_val = rolling.max().values
+    norm_value = (values - min_val) / (max_val - min_val + 1e-9)
 
-    axs[2].plot(df['ds'], df['score'], label='综合得分 (加权 z-score)', color='red')
-    axs[2].axhline(y=0, color='gray', linestyle='--')
-    axs[2].set_title('突增得分')
-    axs[2].legend()
+    score = norm_value[None, :, :] * delta
+    return delta, norm_value, score
+
+
+def load_value_matrix(paths, value_col='Count', time_col='Time', freq='5min'):
+    """
+    读取多个合并文件，对齐到同一个规则时间网格，得到 (T, N) 矩阵
+
+    网格覆盖所有文件的最早到最晚时间，间隔为 freq（应与 calculate_scores_matrix 的 base_interval 一致）。
+
+    返回:
+    (网格时间戳 datetime64[ns], 矩阵, 业务名列表)；某业务在某时刻没有数据（包括整个文件为空）时为 NaN
+    """
+    arrays = [load_arrays(path, time_col) for path in paths]
+    names = [os.path.basename(os.path.dirname(str(path))) for path in paths]
+    non_empty = [a for a in arrays if len(a[time_col])]
+    if not non_empty:
+        return np.array([], dtype='datetime64[ns]'), np.empty((0, len(arrays))), names
+    start = min(a[time_col][0] for a in non_empty)
+    end = max(a[time_col][-1] for a in non_empty)
+    times, matrix = None, None
+    for j, a in enumerate(arrays):
+        if not len(a[time_col]):
+            continue
+        grid_times, column, _ = align_to_grid(a[time_col], a[value_col], freq, fill='nan', start=start, end=end)
+        if matrix is None:
+            times = grid_times
+            matrix = np.full((len(times), len(arrays)), np.nan)
+        matrix[:, j] = column
+    return times, matrix, names
+
+
+class RollingGrowthScorer:
+    """
+    逐点计算突增得分的流式版本，每个点 O(1) 摊还时间
+
+    滞后值保存在长度为 window_size 的环形缓冲区中；归一化使用尾随 norm_window 个点的
+    最小/最大值，由单调队列维护。对历史数据逐点输入时，结果与
+    calculate_scores(df, interval_minutes, base_interval, norm_window) 一致。
+    """
+
+    def __init__(self, interval_minutes=30, base_interval=5, norm_window=288):
+        self.window_size = interval_minutes // base_interval
+        self.norm_window = norm_window
+        self.lagged = np.zeros(max(self.window_size, 1))
+        self.count = 0
+        self._min_q = deque()  # (序号, 值)，值单调递增
+        self._max_q = deque()  # (序号, 值)，值单调递减
+
+    def update(self, value):
+        """输入一个新值，返回 (delta, norm_value, score)"""
+        value = float(value)
+        i = self.count
+
+        # 增量：与 window_size 个点之前的值相减
+        if self.window_size == 0:
+            delta = 0.0
+        else:
+            slot = i % self.window_size
+            delta = value - self.lagged[slot] if i >= self.window_size else np.nan
+            self.lagged[slot] = value
+
+        # 滑动窗口最小/最大值（缺口 NaN 不进入队列，但仍占用窗口位置）
+        if value == value:
+            while self._min_q and self._min_q[-1][1] >= value:
+                self._min_q.pop()
+            self._min_q.append((i, value))
+            while self._max_q and self._max_q[-1][1] <= value:
+                self._max_q.pop()
+            self._max_q.append((i, value))
+        oldest = i - self.norm_window + 1
+        if self._min_q and self._min_q[0][0] < oldest:
+            self._min_q.popleft()
+        if self._max_q and self._max_q[0][0] < oldest:
+            self._max_q.popleft()
+        self.count = i + 1
+
+        if not self._min_q or value != value:
+            return delta, np.nan, np.nan
+        min_val = self._min_q[0][1]
+        max_val = self._max_q[0][1]
+        norm_value = (value - min_val) / (max_val - min_val + 1e-9)
+        return delta, norm_value, norm_value * delta
+
+    def update_many(self, values):
+        """依次输入多个值，返回 delta、norm_value、score 三个数组"""
+        out = np.empty((len(values), 3))
+        for k, value in enumerate(np.asarray(values, dtype=float).tolist()):
+            out[k] = self.update(value)
+        return out[:, 0], out[:, 1], out[:, 2]
+
+
+def plot_all(df, save_path=None):
+    # save_path 不为None时保存到文件并关闭图形（不弹出窗口），用于批量生成报告
+    plt = _setup_matplotlib()
+    with metrics.stage('plot', rows=len(df), detector='growth'):
+        fig, axs = plt.subplots(3, 1, figsize=(14, 12), sharex=True)
+
+        axs[0].plot(df['ds'], df['value'], label='原始数据')
+        axs[0].set_title('原始数据')
+        axs[0].legend()
+
+        axs[1].plot(df['ds'], df['delta_30min'], label='30分钟增量 (delta)', color='orange')
+        axs[1].legend()
+
+
+        axs[2].plot(df['ds'], df['score'], label='综合得分 (加权 z-score)', color='red')
+        axs[2].axhline(y=0, color='gray', linestyle='--')
+        axs[2].set_title('突增得分')
+        axs[2].legend()
+
+        plt.xlabel('时间')
+        plt.tight_layout()
+    if save_path:
+        fig.savefig(save_path)
+        plt.close(fig)
+    else:
+        plt.show()
+
+def detect_anomalies(path, interval_minutes=30, base_interval=5, z_thresh=6.0, norm_window=None):
+    """
+    批量检测入口：得分高于 均值 + z_thresh * 标准差 的点视为突增
+
+    返回:
+    DataFrame，列为 ds、value（原始值）、score
+    """
+    df = calculate_scores(load_and_preprocess(path), interval_minutes=interval_minutes,
+                          base_interval=base_interval, norm_window=norm_window)
+    score = df['score'].values
+    threshold = np.nanmean(score) + z_thresh * np.nanstd(score)
+    hits = df[score > threshold]
+    return pd.DataFrame({
+        'ds': hits['ds'].values,
+        'value': hits['value'].values,
+        'score': hits['score'].values,
+    })
 
-    plt.xlabel('时间')
-    plt.tight_layout()
-    plt.show()
 
 if __name__ == "__main__":
-    #path = 'data\\35.企业信使\\35.企业信使_merged.csv'
-    #path = 'data\\31.企网汇款\\31.企网汇款_merged.csv'
-    #path = 'data\\23.三方平台快捷支付\\23.三方平台快捷支付_merged.csv'
-    path = 'data\\9.手机银行\\9.手机银行_merged.csv'
-    df = load_and_preprocess(path)
-    df = calculate_scores(df, interval_minutes=30, base_interval=5)
-    plot_all(df)
+    parser = argparse.ArgumentParser(description="突增得分计算")
+    #path = os.path.join('data', '35.企业信使', '35.企业信使_merged.csv')
+    #path = os.path.join('data', '31.企网汇款', '31.企网汇款_merged.csv')
+    #path = os.path.join('data', '23.三方平台快捷支付', '23.三方平台快捷支付_merged.csv')
+    parser.add_argument('path', nargs='?', default=os.path.join('data', '9.手机银行', '9.手机银行_merged.csv'))
+    parser.add_argument('--interval', type=int, default=30, help="增量窗口（分钟）")
+    parser.add_argument('--save', default=None, help="把图保存到该文件（PNG/SVG），不弹出窗口")
+    args = parser.parse_args()
+    df = load_and_preprocess(args.path)
+    df = calculate_scores(df, interval_minutes=args.interval, base_interval=5)
+    plot_all(df, args.save)
@@ -0,0 +1,369 @@
+import os
+import json
+import shutil
+from pathlib import Path
+import numpy as np
+import pandas as pd
+import metrics
+
+CACHE_SUFFIX = ".npcache"
+CACHE_VERSION = 1
+
+
+def cache_dir_for(csv_path):
+    """合并文件对应的缓存目录，例如 9.手机银行_merged.csv -> 9.手机银行_merged.npcache/"""
+    csv_path = Path(csv_path)
+    return csv_path.with_name(csv_path.stem + CACHE_SUFFIX)
+
+
+def csv_fingerprint(csv_path):
+    stat = Path(csv_path).stat()
+    return {'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns}
+
+
+def _read_meta(cache_dir):
+    try:
+        with open(cache_dir / 'meta.json', 'r', encoding='utf-8') as fin:
+            return json.load(fin)
+    except (OSError, ValueError):
+        return None
+
+
+def is_cache_valid(csv_path):
+    meta = _read_meta(cache_dir_for(csv_path))
+    return (meta is not None and meta.get('version') == CACHE_VERSION
+            and meta.get('source') == csv_fingerprint(csv_path))
+
+
+def build_cache(csv_path, time_col='Time'):
+    """
+    解析CSV并写入列式二进制缓存
+
+    时间列保存为 int64 纳秒时间戳，数值列按 pandas 推断的类型各存为一个 .npy 文件。
+    存在非数值列时不写列文件，只在 meta.json 中记录这些列，之后直接读CSV而不再尝试建缓存。
+
+    返回:
+    解析好的 DataFrame
+    """
+    csv_path = Path(csv_path)
+    fingerprint = csv_fingerprint(csv_path)
+    with metrics.stage('load.read_csv') as s:
+        df = pd.read_csv(csv_path, encoding='utf-8-sig')
+        s.rows = len(df)
+    if time_col in df.columns:
+        with metrics.stage('load.to_datetime', rows=len(df)):
+            df[time_col] = pd.to_datetime(df[time_col])
+
+    columns = []
+    non_numeric = []
+    for i, col in enumerate(df.columns):
+        if col == time_col and time_col in df.columns:
+            kind = 'time'
+        elif pd.api.types.is_numeric_dtype(df[col]):
+            kind = 'value'
+        else:
+            non_numeric.append(col)
+            continue
+        columns.append({'name': col, 'file': f'col_{i}.npy', 'kind': kind})
+    if non_numeric:
+        # 只写 meta 记录非数值列，之后直接读CSV，不再每次尝试建缓存
+        print(f"{csv_path.name} 含非数值列 {non_numeric}，不建立列缓存")
+        columns = []
+
+    cache_dir = cache_dir_for(csv_path)
+    tmp_dir = cache_dir.with_name(cache_dir.name + f'.tmp{os.getpid()}')
+    try:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+        tmp_dir.mkdir()
+        for info in columns:
+            values = df[info['name']].values
+            if info['kind'] == 'time':
+                values = values.astype('datetime64[ns]').view('int64')
+            np.save(tmp_dir / info['file'], np.ascontiguousarray(values))
+        meta = {'version': CACHE_VERSION, 'source': fingerprint, 'rows': len(df), 'columns': columns,
+                'non_numeric': non_numeric}
+        with open(tmp_dir / 'meta.json', 'w', encoding='utf-8') as fout:
+            json.dump(meta, fout, ensure_ascii=False)
+        shutil.rmtree(cache_dir, ignore_errors=True)
+        os.replace(tmp_dir, cache_dir)
+    except OSError as e:
+        print(f"写入缓存 {cache_dir} 时出错: {e}")
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+    return df
+
+
+def _read_csv(csv_path, time_col='Time'):
+    df = pd.read_csv(csv_path, encoding='utf-8-sig')
+    if time_col in df.columns:
+        df[time_col] = pd.to_datetime(df[time_col])
+    return df
+
+
+def _frame_arrays(df, time_col='Time'):
+    arrays = {}
+    for col in df.columns:
+        values = df[col].values
+        if col == time_col:
+            values = values.astype('datetime64[ns]').view('int64')
+        arrays[col] = values
+    return arrays
+
+
+def load_arrays(csv_path, time_col='Time', mmap=True):
+    """
+    以 NumPy 数组形式读取合并文件，缓存失效时自动重建
+
+    参数:
+    mmap: True 为只读内存映射；'c' 为写时复制映射（可写，修改不会写回缓存文件）；False 时整体读入内存
+
+    返回:
+    {列名: 数组}；时间列为 int64 纳秒时间戳。含非数值列的文件没有列缓存，返回从CSV解析的数组
+    """
+    csv_path = Path(csv_path)
+    if not is_cache_valid(csv_path):
+        df = build_cache(csv_path, time_col)
+        if not is_cache_valid(csv_path) or _read_meta(cache_dir_for(csv_path)).get('non_numeric'):
+            return _frame_arrays(df, time_col)
+
+    cache_dir = cache_dir_for(csv_path)
+    meta = _read_meta(cache_dir)
+    if meta.get('non_numeric'):
+        return _frame_arrays(_read_csv(csv_path, time_col), time_col)
+    mmap_mode = 'r' if mmap is True else (mmap or None)
+    return {info['name']: np.load(cache_dir / info['file'], mmap_mode=mmap_mode) for info in meta['columns']}
+
+
+def load_merged(csv_path, time_col='Time', use_cache=True, fill=None, freq='5min'):
+    """
+    读取合并后的CSV文件，返回时间列已解析的 DataFrame
+
+    use_cache=True 时优先读取列式缓存，缓存按CSV的大小和修改时间失效。
+    fill 不为 None 时把数据对齐到 freq 间隔的规则网格并按 fill 填补缺口（见 align_to_grid），
+    结果另含 is_gap 列。
+    """
+    with metrics.stage('load') as s:
+        df = _load_merged(csv_path, time_col, use_cache)
+        if fill is not None and time_col in df.columns:
+            df = align_frame(df, time_col, freq, fill)
+        s.rows = len(df)
+    return df
+
+
+def _load_merged(csv_path, time_col, use_cache):
+    if not use_cache:
+        return _read_csv(csv_path, time_col)
+
+    if not is_cache_valid(csv_path):
+        metrics.count('loader_cache', result='miss')
+        return build_cache(csv_path, time_col)
+
+    if _read_meta(cache_dir_for(csv_path)).get('non_numeric'):
+        metrics.count('loader_cache', result='uncached')
+        return _read_csv(csv_path, time_col)
+
+    metrics.count('loader_cache', result='hit')
+    # 写时复制映射 + copy=False：DataFrame 直接引用映射的页，只有被修改的页才会复制
+    arrays = load_arrays(csv_path, time_col, mmap='c')
+    data = {}
+    for col, values in arrays.items():
+        if col == time_col:
+            data[col] = values.view('datetime64[ns]')
+        else:
+            data[col] = values
+    return pd.DataFrame(data, copy=False)
+
+
+def align_to_grid(times, values, freq='5min', fill='nan', agg='sum', start=None, end=None):
+    """
+    把时间戳对齐到固定间隔的规则网格，并填补缺失的时间点
+
+    参数:
+    times: 升序的 int64 纳秒时间戳或 datetime64 数组
+    values: 一维数组，或行与 times 对应的二维数组
+    freq: 网格间隔
+    fill: 缺口填充方式，'zero'、'nan'、'ffill'（沿用前值）或 'interpolate'（线性插值）
+    agg: 同一网格点有多条记录时的合并方式，'sum'、'mean' 或 'last'
+    start, end: 可选的网格起止时间，默认取数据首尾
+
+    返回:
+    (网格时间戳 datetime64[ns], 对齐后的 float64 数组, 缺口掩码)，缺口掩码为 True 表示该点原本没有数据
+    """
+    times = np.asarray(times)
+    if np.issubdtype(times.dtype, np.datetime64):
+        times = times.astype('datetime64[ns]').view('int64')
+    values = np.asarray(values, dtype=float)
+    step = pd.Timedelta(freq).value
+
+    if len(times) == 0:
+        return np.array([], dtype='datetime64[ns]'), values[:0], np.zeros(0, dtype=bool)
+
+    grid_start = (pd.Timestamp(start).value if start is not None else times[0]) // step * step
+    grid_end = (pd.Timestamp(end).value if end is not None else times[-1]) // step * step
+    n = int((grid_end - grid_start) // step) + 1
+
+    # 超出网格范围的记录丢弃
+    slots = (times - grid_start) // step
+    keep = (slots >= 0) & (slots < n)
+    slots, values = slots[keep], values[keep]
+
+    counts = np.bincount(slots, minlength=n)
+    observed = counts > 0
+    out = np.zeros((n,) + values.shape[1:])
+    if agg == 'last':
+        out[slots] = values
+    elif agg in ('sum', 'mean'):
+        np.add.at(out, slots, values)
+        if agg == 'mean':
+            out[observed] /= counts[observed].reshape((-1,) + (1,) * (values.ndim - 1))
+    else:
+        raise ValueError("agg 参数必须是 'sum'、'mean' 或 'last'")
+
+    gap = ~observed
+    if fill == 'zero':
+        out[gap] = 0.0
+    elif fill == 'nan':
+        out[gap] = np.nan
+    elif fill == 'ffill':
+        # 每个网格点取不晚于它的最近一个有数据的点；开头的缺口保持 NaN
+        last_seen = np.maximum.accumulate(np.where(observed, np.arange(n), -1))
+        out = np.where((last_seen >= 0).reshape((-1,) + (1,) * (values.ndim - 1)),
+                       out[np.maximum(last_seen, 0)], np.nan)
+    elif fill == 'interpolate':
+        grid = np.arange(n)
+        if out.ndim == 1:
+            out[gap] = np.interp(grid[gap], grid[observed], out[observed])
+        else:
+            for j in range(out.shape[1]):
+                out[gap, j] = np.interp(grid[gap], grid[observed], out[observed, j])
+    else:
+        raise ValueError("fill 参数必须是 'zero'、'nan'、'ffill' 或 'interpolate'")
+
+    grid_times = (grid_start + np.arange(n, dtype='int64') * step).view('datetime64[ns]')
+    return grid_times, out, gap
+
+
+def align_frame(df, time_col='Time', freq='5min', fill='nan', agg='sum'):
+    """
+    对 DataFrame 的所有数值列做网格对齐，另加一列 is_gap 标记补出的时间点
+
+    时间列需已解析且升序。
+    """
+    value_cols = [c for c in df.columns if c != time_col and pd.api.types.is_numeric_dtype(df[c])]
+    grid_times, values, gap = align_to_grid(df[time_col].values, df[value_cols].values, freq, fill, agg)
+    aligned = pd.DataFrame(values, columns=value_cols)
+    aligned.insert(0, time_col, grid_times)
+    aligned['is_gap'] = gap
+    return aligned
+
+
+INDEX_NAME = "_index.json"
+
+
+def count_lines(path, chunk_size=1 << 20):
+    """按块统计换行符数量，不解析内容；末行没有换行符时也计入"""
+    lines = 0
+    last = b'\n'
+    with open(path, 'rb') as fin:
+        while True:
+            chunk = fin.read(chunk_size)
+            if not chunk:
+                break
+            lines += chunk.count(b'\n')
+            last = chunk[-1:]
+    if last != b'\n':
+        lines += 1
+    return lines
+
+
+def read_first_last_lines(path, tail_bytes=4096):
+    """读取首行（表头）、第一条数据行和最后一条数据行"""
+    with open(path, 'rb') as fin:
+        header = fin.readline()
+        first = fin.readline()
+        fin.seek(0, os.SEEK_END)
+        size = fin.tell()
+        fin.seek(max(0, size - tail_bytes))
+        tail = fin.read().rstrip(b'\r\n').split(b'\n')
+    decode = lambda line: line.decode('utf-8-sig').strip()
+    return decode(header), decode(first), decode(tail[-1]) if tail else ''
+
+
+def describe_csv(csv_path, time_col='Time'):
+    """
+    不完整解析CSV，生成元数据：行数、列数、时间范围、文件大小和修改时间
+
+    列式缓存有效时直接使用缓存中的行数和时间戳，否则读取表头并快速统计行数。
+    """
+    csv_path = Path(csv_path)
+    fingerprint = csv_fingerprint(csv_path)
+    header, first, last = read_first_last_lines(csv_path)
+    columns = header.split(',') if header else []
+
+    if is_cache_valid(csv_path):
+        meta = _read_meta(cache_dir_for(csv_path))
+        rows = meta['rows']
+    else:
+        rows = max(count_lines(csv_path) - 1, 0)
+
+    time_min = time_max = None
+    if time_col in columns and rows > 0:
+        pos = columns.index(time_col)
+        time_min = first.split(',')[pos]
+        time_max = last.split(',')[pos]
+
+    return {
+        'path': str(csv_path),
+        'rows': rows,
+        'columns': len(columns),
+        'time_min': time_min,
+        'time_max': time_max,
+        'size': fingerprint['size'],
+        'mtime_ns': fingerprint['mtime_ns'],
+    }
+
+
+def scan_merged_files(data_path="data", index_name=INDEX_NAME):
+    """
+    扫描 data/*/*_merged.csv 并维护磁盘上的元数据索引
+
+    只有大小或修改时间变化的文件才会重新统计，其余直接复用索引。
+
+    返回:
+    元数据字典列表（见 describe_csv），顺序与文件路径一致
+    """
+    data_path = Path(data_path)
+    if not data_path.exists():
+        return []
+    index_path = data_path / index_name
+    try:
+        with open(index_path, 'r', encoding='utf-8') as fin:
+            index = json.load(fin)
+    except (OSError, ValueError):
+        index = {}
+
+    entries = {}
+    changed = False
+    for csv_path in sorted(data_path.glob("*/*_merged.csv")):
+        key = str(csv_path)
+        entry = index.get(key)
+        try:
+            fingerprint = csv_fingerprint(csv_path)
+            if entry is None or entry['size'] != fingerprint['size'] or entry['mtime_ns'] != fingerprint['mtime_ns']:
+                entry = describe_csv(csv_path)
+                changed = True
+        except Exception as e:
+            # 编码错误、行不完整等：跳过该文件，不写入索引，下次扫描时重试
+            print(f"读取 {csv_path} 时出错: {e}")
+            continue
+        entries[key] = entry
+
+    if changed or set(entries) != set(index):
+        try:
+            tmp_path = index_path.with_suffix('.tmp')
+            with open(tmp_path, 'w', encoding='utf-8') as fout:
+                json.dump(entries, fout, ensure_ascii=False, indent=2)
+            os.replace(tmp_path, index_path)
+        except OSError as e:
+            print(f"写入索引 {index_path} 时出错: {e}")
+
+    return list(entries.values())
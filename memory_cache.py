@@ -0,0 +1,118 @@
+import sys
+import threading
+from collections import OrderedDict
+import numpy as np
+import pandas as pd
+import metrics
+
+
+def estimate_size(obj):
+    """粗略估算对象占用的字节数，用于缓存容量控制"""
+    if isinstance(obj, pd.DataFrame):
+        return int(obj.memory_usage(index=True, deep=True).sum())
+    if isinstance(obj, (pd.Series, pd.Index)):
+        return int(obj.memory_usage(deep=True))
+    if isinstance(obj, np.ndarray):
+        return obj.nbytes
+    if isinstance(obj, dict):
+        return sum(estimate_size(k) + estimate_size(v) for k, v in obj.items())
+    if isinstance(obj, (list, tuple)):
+        return sum(estimate_size(v) for v in obj)
+    if hasattr(obj, 'data') and isinstance(getattr(obj, 'data'), tuple):
+        # plotly Figure：按各 trace 的 x/y 数组估算
+        size = 0
+        for trace in obj.data:
+            for attr in ('x', 'y'):
+                values = getattr(trace, attr, None)
+                if values is not None:
+                    size += np.asarray(values).nbytes
+        return size + 4096
+    return sys.getsizeof(obj)
+
+
+class LRUCache:
+    """
+    按字节预算淘汰的线程安全 LRU 缓存
+
+    参数:
+    max_bytes: 缓存总容量上限，超出时淘汰最久未使用的条目
+    max_items: 可选的条目数上限
+    """
+
+    def __init__(self, max_bytes=512 * 1024 * 1024, max_items=None):
+        self.max_bytes = max_bytes
+        self.max_items = max_items
+        self._data = OrderedDict()
+        self._lock = threading.RLock()
+        self.total_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __contains__(self, key):
+        with self._lock:
+            return key in self._data
+
+    def __len__(self):
+        return len(self._data)
+
+    def get(self, key, default=None):
+        with self._lock:
+            if key not in self._data:
+                self.misses += 1
+                metrics.count('lru_cache', result='miss')
+                return default
+            self._data.move_to_end(key)
+            self.hits += 1
+            metrics.count('lru_cache', result='hit')
+            return self._data[key][0]
+
+    def put(self, key, value, size=None):
+        size = estimate_size(value) if size is None else size
+        with self._lock:
+            if key in self._data:
+                self.total_bytes -= self._data.pop(key)[1]
+            if size > self.max_bytes:
+                # 单个对象超过总预算时不缓存
+                return value
+            self._data[key] = (value, size)
+            self.total_bytes += size
+            self._evict()
+        return value
+
+    def get_or_compute(self, key, compute):
+        """命中时直接返回缓存值，否则调用 compute() 计算并写入缓存"""
+        missing = object()
+        value = self.get(key, missing)
+        if value is missing:
+            value = self.put(key, compute())
+        return value
+
+    def invalidate(self, predicate):
+        """删除 predicate(key) 为真的所有条目，例如某个文件旧指纹下的全部缓存"""
+        with self._lock:
+            for key in [k for k in self._data if predicate(k)]:
+                self.total_bytes -= self._data.pop(key)[1]
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self.total_bytes = 0
+
+    def _evict(self):
+        while self._data and (self.total_bytes > self.max_bytes
+                              or (self.max_items is not None and len(self._data) > self.max_items)):
+            _, (_, size) = self._data.popitem(last=False)
+            self.total_bytes -= size
+            self.evictions += 1
+
+    def stats(self):
+        with self._lock:
+            return {
+                'items': len(self._data),
+                'bytes': self.total_bytes,
+                'max_bytes': self.max_bytes,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+            }
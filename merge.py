@@ -1,15 +1,130 @@
 import pandas as pd
+import numpy as np
 import os
+import json
+import tempfile
+import time
+import argparse
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
 from pathlib import Path
+import metrics
 
-def merge_csvs_in_folder(folder_path, output_filename=None):
+MANIFEST_SUFFIX = ".manifest.json"
+
+
+def list_source_csvs(folder_path):
+    """列出文件夹中待合并的CSV文件（排除已生成的 *_merged.csv），按文件名排序"""
+    return sorted(f for f in Path(folder_path).glob("*.csv") if not f.name.endswith("_merged.csv"))
+
+
+def read_source_csv(csv_file):
+    """读取单个CSV文件，并把 Time 列解析为时间类型"""
+    df = pd.read_csv(csv_file)
+    if 'Time' in df.columns:
+        df['Time'] = pd.to_datetime(df['Time'])
+    return df
+
+
+def file_signature(csv_file):
+    stat = Path(csv_file).stat()
+    return {'size': stat.st_size, 'mtime': stat.st_mtime}
+
+
+def file_manifest_entry(csv_file, df):
+    entry = file_signature(csv_file)
+    entry['rows'] = len(df)
+    entry['max_time'] = str(df['Time'].max()) if 'Time' in df.columns and len(df) else None
+    return entry
+
+
+def manifest_path_for(output_path):
+    output_path = Path(output_path)
+    return output_path.with_name(output_path.stem + MANIFEST_SUFFIX)
+
+
+def load_manifest(output_path):
+    path = manifest_path_for(output_path)
+    if not path.exists():
+        return None
+    try:
+        with open(path, 'r', encoding='utf-8') as fin:
+            return json.load(fin)
+    except (OSError, ValueError) as e:
+        print(f"读取清单 {path.name} 时出错: {e}")
+        return None
+
+
+def save_manifest(output_path, files, columns, total_rows, max_time):
+    """记录已合并文件（名称、大小、修改时间、行数、最大时间戳）及输出文件状态"""
+    manifest = {
+        'output': Path(output_path).name,
+        'columns': list(columns),
+        'rows': int(total_rows),
+        'max_time': str(max_time) if max_time is not None and not pd.isna(max_time) else None,
+        'output_signature': file_signature(output_path),
+        'files': files,
+    }
+    path = manifest_path_for(output_path)
+    tmp_path = path.with_suffix('.tmp')
+    with open(tmp_path, 'w', encoding='utf-8') as fout:
+        json.dump(manifest, fout, ensure_ascii=False, indent=2)
+    os.replace(tmp_path, path)
+    return manifest
+
+
+def read_csv_files(csv_files, read_workers=1, log=print):
+    """
+    读取一组CSV文件，read_workers > 1 时用线程池并行读取
+
+    返回:
+    (dataframes, files) 成功读取的数据框列表（保持文件名顺序）及对应的清单条目
+    """
+    def _read(csv_file):
+        try:
+            return csv_file, read_source_csv(csv_file), None
+        except Exception as e:
+            return csv_file, None, e
+
+    with metrics.stage('merge.read') as s:
+        if read_workers > 1 and len(csv_files) > 1:
+            with ThreadPoolExecutor(max_workers=read_workers) as pool:
+                results = list(pool.map(_read, csv_files))
+        else:
+            results = [_read(f) for f in csv_files]
+        s.rows = sum(len(df) for _, df, _ in results if df is not None)
+
+    dataframes = []
+    files = {}
+    for csv_file, df, error in results:
+        if error is not None:
+            print(f"读取 {csv_file.name} 时出错: {error}")
+            continue
+        log(f"读取 {csv_file.name}: {len(df)} 行")
+        dataframes.append(df)
+        files[csv_file.name] = file_manifest_entry(csv_file, df)
+    return dataframes, files
+
+
+def _quiet(*args, **kwargs):
+    pass
+
+
+def merge_csvs_in_folder(folder_path, output_filename=None, incremental=False, read_workers=1, verbose=True):
     """
     将指定文件夹下的所有CSV文件合并为一个CSV文件
     
     参数:
     folder_path: 要合并CSV文件的文件夹路径
     output_filename: 输出文件名，如果为None则使用文件夹名
+    incremental: 为True时只读取清单中未记录的新文件，增量更新输出文件
+    read_workers: 文件夹内并行读取CSV的线程数
+    verbose: 为False时只输出错误信息
+
+    返回:
+    合并后的 DataFrame；incremental 为True时返回 (new_rows, total_rows)，见 merge_incremental。
+    文件夹不存在或没有可读的CSV时返回 None
     """
+    log = print if verbose else _quiet
     folder_path = Path(folder_path)
     
     # 检查文件夹是否存在
@@ -17,26 +132,28 @@ def merge_csvs_in_folder(folder_path, output_filename=None):
         print(f"文件夹 {folder_path} 不存在")
         return
     
+    # 生成输出文件名
+    if output_filename is None:
+        folder_name = folder_path.name
+        output_filename = f"{folder_name}_merged.csv"
+    output_path = folder_path / output_filename
+
     # 获取文件夹中的所有CSV文件
-    csv_files = list(folder_path.glob("*.csv"))
+    csv_files = [f for f in list_source_csvs(folder_path) if f.name != output_filename]
     
     if not csv_files:
-        print(f"在文件夹 {folder_path} 中没有找到CSV文件")
+        log(f"在文件夹 {folder_path} 中没有找到CSV文件")
         return
+
+    if incremental:
+        return merge_incremental(folder_path, csv_files, output_path, read_workers, verbose)
     
-    print(f"找到 {len(csv_files)} 个CSV文件:")
+    log(f"找到 {len(csv_files)} 个CSV文件:")
     for file in csv_files:
-        print(f"  - {file.name}")
+        log(f"  - {file.name}")
     
-    # 读取并合并所有CSV文件
-    dataframes = []
-    for csv_file in sorted(csv_files):  # 按文件名排序
-        try:
-            df = pd.read_csv(csv_file)
-            print(f"读取 {csv_file.name}: {len(df)} 行")
-            dataframes.append(df)
-        except Exception as e:
-            print(f"读取 {csv_file.name} 时出错: {e}")
+    # 读取并合并所有CSV文件（按文件名排序）
+    dataframes, files = read_csv_files(csv_files, read_workers, log)
     
     if not dataframes:
         print("没有成功读取任何CSV文件")
@@ -48,38 +165,375 @@ def merge_csvs_in_folder(folder_path, output_filename=None):
     # 如果有Time列，按时间排序
     if 'Time' in merged_df.columns:
         merged_df['Time'] = pd.to_datetime(merged_df['Time'])
-        merged_df = merged_df.sort_values('Time').reset_index(drop=True)
-    
-    # 生成输出文件名
-    if output_filename is None:
-        folder_name = folder_path.name
-        output_filename = f"{folder_name}_merged.csv"
+        merged_df = merged_df.sort_values('Time', kind='mergesort').reset_index(drop=True)
     
     # 保存合并后的文件
-    output_path = folder_path / output_filename
-    merged_df.to_csv(output_path, index=False)
+    with metrics.stage('merge.write', rows=len(merged_df), mode='full'):
+        merged_df.to_csv(output_path, index=False)
+    metrics.count('merge', result='full')
+    max_time = merged_df['Time'].iloc[-1] if 'Time' in merged_df.columns and len(merged_df) else None
+    save_manifest(output_path, files, merged_df.columns, len(merged_df), max_time)
     
-    print(f"合并完成！")
-    print(f"输出文件: {output_path}")
-    print(f"总行数: {len(merged_df)}")
+    log(f"合并完成！")
+    log(f"输出文件: {output_path}")
+    log(f"总行数: {len(merged_df)}")
     
     return merged_df
 
+
+def merge_incremental(folder_path, csv_files, output_path, read_workers=1, verbose=True):
+    """
+    增量合并：只读取清单中没有记录的新文件
+
+    新数据的时间全部晚于已合并数据末尾时直接追加到输出文件；
+    时间有重叠时读取已合并数据做一次归并排序后重写。
+    已合并文件被修改/删除、输出文件被改动或列不一致时回退为全量合并。
+
+    返回:
+    (new_rows, total_rows)：new_rows 为本次从源文件读入的数据行（DataFrame），total_rows 为合并后输出文件的总行数。
+    追加或重写时 new_rows 只含新文件的行；回退为全量合并时所有源文件都重新读入，new_rows 为全部数据；
+    没有新数据时 new_rows 为空 DataFrame
+    """
+    log = print if verbose else _quiet
+
+    def full_merge():
+        merged = merge_csvs_in_folder(folder_path, output_path.name, read_workers=read_workers, verbose=verbose)
+        if merged is None:
+            return pd.DataFrame(), 0
+        return merged, len(merged)
+
+    manifest = load_manifest(output_path)
+    if manifest is None or not output_path.exists():
+        log("未找到合并清单或输出文件，执行全量合并")
+        return full_merge()
+
+    known = manifest['files']
+    current = {f.name: f for f in csv_files}
+    for name, entry in known.items():
+        if name not in current or file_signature(current[name]) != {'size': entry['size'], 'mtime': entry['mtime']}:
+            log(f"已合并文件 {name} 被修改或删除，执行全量合并")
+            return full_merge()
+    if file_signature(output_path) != manifest['output_signature']:
+        log(f"输出文件 {output_path.name} 在清单之外被修改，执行全量合并")
+        return full_merge()
+
+    new_files = [f for f in csv_files if f.name not in known]
+    if not new_files:
+        metrics.count('merge', result='unchanged')
+        log(f"{folder_path.name}: 没有新文件")
+        return pd.DataFrame(columns=manifest['columns']), manifest['rows']
+
+    log(f"发现 {len(new_files)} 个新CSV文件:")
+    dataframes, new_entries = read_csv_files(new_files, read_workers, log)
+    files = dict(known)
+    files.update(new_entries)
+    # 解析失败的文件也记入清单（0 行），否则之后每次增量合并都会重读并报错；
+    # 文件被修正后大小或修改时间变化，会按“已合并文件被修改”回退为全量合并
+    for f in new_files:
+        if f.name not in new_entries:
+            files[f.name] = dict(file_signature(f), rows=0, max_time=None, failed=True)
+    empty = pd.DataFrame(columns=manifest['columns'])
+
+    if not dataframes:
+        log("没有成功读取任何新CSV文件")
+        save_manifest(output_path, files, manifest['columns'], manifest['rows'], manifest['max_time'])
+        return empty, manifest['rows']
+
+    new_df = pd.concat(dataframes, ignore_index=True)
+    if len(new_df) == 0:
+        # 新文件都只有表头：只更新清单，输出文件不变
+        log("新文件没有数据行")
+        save_manifest(output_path, files, manifest['columns'], manifest['rows'], manifest['max_time'])
+        return empty, manifest['rows']
+    if sorted(new_df.columns) != sorted(manifest['columns']):
+        log("新文件的列与已合并数据不一致，执行全量合并")
+        return full_merge()
+    new_df = new_df[manifest['columns']]
+
+    has_time = 'Time' in new_df.columns
+    if has_time:
+        new_df = new_df.sort_values('Time', kind='mergesort').reset_index(drop=True)
+
+    tail_time = pd.Timestamp(manifest['max_time']) if manifest['max_time'] else None
+    if not has_time or tail_time is None or new_df['Time'].iloc[0] >= tail_time:
+        # 新数据全部在末尾之后：直接追加，无需重写
+        with metrics.stage('merge.write', rows=len(new_df), mode='append'):
+            new_df.to_csv(output_path, mode='a', header=False, index=False)
+        metrics.count('merge', result='append')
+        log(f"追加 {len(new_df)} 行到 {output_path.name}")
+    else:
+        # 时间重叠：归并排序后重写
+        existing = read_source_csv(output_path)
+        merged = pd.concat([existing, new_df], ignore_index=True)
+        merged = merged.sort_values('Time', kind='mergesort').reset_index(drop=True)
+        with metrics.stage('merge.write', rows=len(merged), mode='rewrite'):
+            merged.to_csv(output_path, index=False)
+        metrics.count('merge', result='rewrite')
+        log(f"新数据与已有数据时间重叠，归并排序后重写 {output_path.name}")
+
+    total_rows = manifest['rows'] + len(new_df)
+    max_time = max(new_df['Time'].iloc[-1], tail_time) if has_time and tail_time is not None else (
+        new_df['Time'].iloc[-1] if has_time else None)
+    save_manifest(output_path, files, manifest['columns'], total_rows, max_time)
+
+    log(f"增量合并完成！总行数: {total_rows}")
+    return new_df, total_rows
+
+def _flush_run(buffer, run_dir, run_id, columns):
+    """把缓冲区中的数据块按时间排序后写成一个有序段，每列一个 .npy 文件"""
+    block = {col: np.concatenate([chunk[col] for chunk in buffer]) for col in columns}
+    order = np.argsort(block['Time'], kind='stable')
+    for j, col in enumerate(columns):
+        np.save(run_dir / f'run{run_id}_col{j}.npy', block[col][order])
+    return len(order)
+
+
+def merge_csvs_external(folder_path, output_filename=None, memory_limit_mb=256, dtypes=None, verbose=True):
+    """
+    外部归并合并：内存占用受 memory_limit_mb 约束，适合数据量很大的文件夹
+
+    1. 按块读取每个CSV（显式指定列类型），攒满内存预算后按时间排序写成一个有序段；
+    2. 对所有有序段做分块 k 路归并，边归并边追加写入输出文件。
+
+    只支持 Time 列加数值列的文件。
+
+    参数:
+    memory_limit_mb: 内存预算（MB），决定读取块大小和归并时每段的读取块大小
+    dtypes: 数值列类型，例如 {'Count': 'int64'}；为None时一律按 float64 读取（后面的文件或行出现空值也能读），
+            第一个文件前1000行为整数的列写出时仍保持整数格式
+
+    返回:
+    输出文件总行数
+    """
+    log = print if verbose else _quiet
+    folder_path = Path(folder_path)
+    if not folder_path.exists():
+        print(f"文件夹 {folder_path} 不存在")
+        return
+    if output_filename is None:
+        output_filename = f"{folder_path.name}_merged.csv"
+    output_path = folder_path / output_filename
+    csv_files = [f for f in list_source_csvs(folder_path) if f.name != output_filename]
+    if not csv_files:
+        log(f"在文件夹 {folder_path} 中没有找到CSV文件")
+        return
+
+    sample = pd.read_csv(csv_files[0], nrows=1000)
+    if 'Time' not in sample.columns:
+        raise ValueError("外部归并合并需要 Time 列")
+    columns = list(sample.columns)
+    value_cols = [c for c in columns if c != 'Time']
+    int_cols = []
+    if dtypes is None:
+        for col in value_cols:
+            if not pd.api.types.is_numeric_dtype(sample[col]):
+                raise ValueError(f"列 {col} 不是数值类型，请使用普通合并")
+        # 只看了样本，整数列后面可能有空值，统一按 float64 读，写出时再还原整数格式
+        int_cols = [c for c in value_cols if pd.api.types.is_integer_dtype(sample[c])]
+        dtypes = {c: 'float64' for c in value_cols}
+    for col in value_cols:
+        if not pd.api.types.is_numeric_dtype(np.dtype(dtypes[col])):
+            raise ValueError(f"列 {col} 不是数值类型，请使用普通合并")
+
+    # 每行约占 8 字节/列；CSV 解析期间的临时对象按数倍预留
+    budget = int(memory_limit_mb * 1024 * 1024)
+    row_bytes = 8 * len(columns)
+    chunk_rows = max(budget // (row_bytes * 8), 1000)
+    log(f"外部归并合并 {len(csv_files)} 个文件，内存预算 {memory_limit_mb}MB，读取块 {chunk_rows} 行")
+
+    files = {}
+    with metrics.stage('merge.external') as s, \
+            tempfile.TemporaryDirectory(dir=folder_path, prefix='.merge_runs_') as tmp:
+        run_dir = Path(tmp)
+        run_lengths = []
+        buffer, buffered = [], 0
+
+        # 第一阶段：生成有序段
+        # 每个文件的数据块先单独缓冲，超出预算时写成只含该文件数据的暂定段；
+        # 文件中途读取失败时丢弃这些块和暂定段，不会有半个文件进入输出
+        for csv_file in csv_files:
+            rows, max_time = 0, None
+            pending, pending_rows = [], 0
+            first_run = len(run_lengths)
+            try:
+                for chunk in pd.read_csv(csv_file, usecols=columns, dtype=dtypes, chunksize=chunk_rows):
+                    times = pd.to_datetime(chunk['Time']).values.astype('datetime64[ns]').view('int64')
+                    block = {'Time': times}
+                    for col in value_cols:
+                        block[col] = chunk[col].values
+                    pending.append(block)
+                    pending_rows += len(chunk)
+                    rows += len(chunk)
+                    if len(times):
+                        max_time = times.max() if max_time is None else max(max_time, times.max())
+                    if buffered + pending_rows >= chunk_rows:
+                        # 先把前面文件的缓冲写成段，保证段的顺序与文件顺序一致（时间相同的行按文件顺序输出）
+                        if buffer:
+                            run_lengths.append(_flush_run(buffer, run_dir, len(run_lengths), columns))
+                            buffer, buffered = [], 0
+                            first_run = len(run_lengths)
+                        run_lengths.append(_flush_run(pending, run_dir, len(run_lengths), columns))
+                        pending, pending_rows = [], 0
+            except Exception as e:
+                print(f"读取 {csv_file.name} 时出错，跳过该文件: {e}")
+                del run_lengths[first_run:]
+                continue
+            buffer.extend(pending)
+            buffered += pending_rows
+            if buffered >= chunk_rows:
+                run_lengths.append(_flush_run(buffer, run_dir, len(run_lengths), columns))
+                buffer, buffered = [], 0
+            log(f"读取 {csv_file.name}: {rows} 行")
+            entry = file_signature(csv_file)
+            entry['rows'] = rows
+            entry['max_time'] = str(pd.Timestamp(max_time)) if max_time is not None else None
+            files[csv_file.name] = entry
+        if buffer:
+            run_lengths.append(_flush_run(buffer, run_dir, len(run_lengths), columns))
+            buffer = []
+
+        # 第二阶段：分块 k 路归并
+        runs = [[np.load(run_dir / f'run{r}_col{j}.npy', mmap_mode='r') for j in range(len(columns))]
+                for r in range(len(run_lengths))]
+        block_rows = max(budget // (row_bytes * 4 * (len(runs) + 1)), 1)
+        positions = [0] * len(runs)
+        total_rows = 0
+        last_time = None
+        header = True
+        log(f"共 {len(runs)} 个有序段，归并块 {block_rows} 行")
+        while True:
+            active = [r for r in range(len(runs)) if positions[r] < run_lengths[r]]
+            if not active:
+                break
+            # 各段当前块中最后一个时间戳的最小值即为本轮可以安全输出的上界；
+            # 块已到段尾的段不构成约束。块末尾延伸到与末尾时间相同的所有行，
+            # 使等于上界的行在同一轮输出，稳定排序后按段（即文件）顺序排列
+            blocks = {}
+            cutoff = None
+            for r in active:
+                end = min(positions[r] + block_rows, run_lengths[r])
+                if end < run_lengths[r]:
+                    end = int(np.searchsorted(runs[r][0], runs[r][0][end - 1], side='right'))
+                blocks[r] = end
+                if end < run_lengths[r]:
+                    tail = runs[r][0][end - 1]
+                    cutoff = tail if cutoff is None else min(cutoff, tail)
+
+            parts = []
+            for r in active:
+                times = runs[r][0][positions[r]:blocks[r]]
+                take = len(times) if cutoff is None else int(np.searchsorted(times, cutoff, side='right'))
+                if take:
+                    parts.append([np.asarray(col[positions[r]:positions[r] + take]) for col in runs[r]])
+                    positions[r] += take
+
+            merged = [np.concatenate([part[j] for part in parts]) for j in range(len(columns))]
+            order = np.argsort(merged[0], kind='stable')
+            out = pd.DataFrame({col: merged[j][order] for j, col in enumerate(columns)})
+            out['Time'] = out['Time'].values.view('datetime64[ns]')
+            for col in int_cols:
+                values = out[col].values
+                if np.all(np.isnan(values) | (values == np.round(values))):
+                    out[col] = out[col].astype('Int64')
+            # 固定时间格式：否则整块都是零点时 pandas 只写日期部分
+            out.to_csv(output_path, mode='w' if header else 'a', header=header, index=False,
+                       date_format='%Y-%m-%d %H:%M:%S')
+            header = False
+            total_rows += len(out)
+            last_time = out['Time'].iloc[-1]
+        if header:
+            pd.DataFrame(columns=columns).to_csv(output_path, index=False)
+        # 释放内存映射，临时目录才能被删除
+        runs = parts = times = None
+        s.rows = total_rows
+
+    save_manifest(output_path, files, columns, total_rows, last_time)
+    log(f"合并完成！")
+    log(f"输出文件: {output_path}")
+    log(f"总行数: {total_rows}")
+    return total_rows
+
+
+def _merge_folder_task(folder, incremental, read_workers, memory_limit_mb=None):
+    start = time.perf_counter()
+    try:
+        if memory_limit_mb:
+            result = merge_csvs_external(folder, memory_limit_mb=memory_limit_mb, verbose=False)
+            rows = result or 0
+        else:
+            result = merge_csvs_in_folder(folder, incremental=incremental, read_workers=read_workers, verbose=False)
+            if result is None:
+                rows = 0
+            else:
+                rows = result[1] if incremental else len(result)
+        return folder.name, rows, time.perf_counter() - start, None
+    except Exception as e:
+        return folder.name, 0, time.perf_counter() - start, e
+
+
+def merge_all_folders(base_path="data", workers=None, read_workers=4, incremental=False, memory_limit_mb=None):
+    """
+    用进程池并行合并data文件夹下所有子文件夹的CSV文件
+
+    参数:
+    base_path: 数据根目录，每个子文件夹对应一个业务
+    workers: 进程数，None 时使用CPU核数
+    read_workers: 每个文件夹内并行读取CSV的线程数
+    incremental: 是否使用增量合并
+    memory_limit_mb: 设置时每个文件夹使用外部归并合并，单个进程的内存预算（MB）；外部归并总是全量合并，
+                     不能与 incremental 同时使用
+
+    返回:
+    每个文件夹的 {'name', 'rows', 'seconds', 'error'} 列表，按耗时降序
+    """
+    if memory_limit_mb and incremental:
+        raise ValueError("外部归并合并（memory_limit_mb）不支持增量模式")
+    base_path = Path(base_path)
+    folders = sorted(p for p in base_path.iterdir() if p.is_dir())
+    if not folders:
+        print(f"在 {base_path} 下没有找到子文件夹")
+        return []
+
+    workers = workers or os.cpu_count() or 1
+    print(f"共 {len(folders)} 个文件夹，进程数: {workers}，每个文件夹读取线程数: {read_workers}")
+    start = time.perf_counter()
+    results = []
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = [pool.submit(_merge_folder_task, folder, incremental, read_workers, memory_limit_mb) for folder in folders]
+        for i, future in enumerate(as_completed(futures), 1):
+            name, rows, seconds, error = future.result()
+            results.append({'name': name, 'rows': rows, 'seconds': seconds, 'error': error})
+            status = f"出错: {error}" if error else f"{rows} 行"
+            print(f"[{i}/{len(folders)}] {name}: {status}，耗时 {seconds:.2f} 秒")
+
+    results.sort(key=lambda r: r['seconds'], reverse=True)
+    failed = sum(1 for r in results if r['error'])
+    print(f"全部完成，总耗时 {time.perf_counter() - start:.2f} 秒，失败 {failed} 个")
+    return results
+
+
 # 使用示例
 if __name__ == "__main__":
-    # 合并单个文件夹
-    folder_to_merge = "data/7.工银信使"
-    merged_data = merge_csvs_in_folder(folder_to_merge)
-    
-    # 如果要合并所有子文件夹，可以使用以下代码
-    def merge_all_folders(base_path="data"):
-        """合并data文件夹下所有子文件夹的CSV文件"""
-        base_path = Path(base_path)
-        
-        for subfolder in base_path.iterdir():
-            if subfolder.is_dir():
-                print(f"\n正在处理文件夹: {subfolder.name}")
-                merge_csvs_in_folder(subfolder)
-    
-    #合并所有文件夹
-    #merge_all_folders()
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="合并业务文件夹下的CSV文件")
+    parser.add_argument('folders', nargs='*', help="要合并的文件夹；不指定时合并 --base 下所有子文件夹")
+    parser.add_argument('--base', default='data', help="数据根目录")
+    parser.add_argument('--workers', type=int, default=None, help="并行进程数，默认CPU核数")
+    parser.add_argument('--read-workers', type=int, default=4, help="每个文件夹内并行读取CSV的线程数")
+    parser.add_argument('--incremental', action='store_true', help="只读取新增文件，增量更新")
+    parser.add_argument('--memory-limit-mb', type=int, default=None,
+                        help="使用外部归并合并，并限制每个进程的内存（MB）")
+    args = parser.parse_args()
+    if args.memory_limit_mb and args.incremental:
+        parser.error("--memory-limit-mb（外部归并合并）总是全量合并，不能与 --incremental 同时使用")
+
+    if args.folders:
+        # 合并指定文件夹，例如: python merge.py data/7.工银信使
+        for folder in args.folders:
+            if args.memory_limit_mb:
+                merge_csvs_external(folder, memory_limit_mb=args.memory_limit_mb)
+            else:
+                merge_csvs_in_folder(folder, incremental=args.incremental, read_workers=args.read_workers)
+    else:
+        # 合并所有文件夹
+        merge_all_folders(args.base, workers=args.workers, read_workers=args.read_workers,
+                          incremental=args.incremental, memory_limit_mb=args.memory_limit_mb)
@@ -0,0 +1,222 @@
+import os
+import sys
+import json
+import time
+import atexit
+import argparse
+import threading
+import tracemalloc
+from collections import defaultdict
+
+# 可选的分阶段耗时与计数统计
+#
+# 默认关闭，关闭时 stage() 返回共享的空上下文、count() 直接返回，几乎没有开销。
+# 通过环境变量开启：
+#   ANOMALY_METRICS=metrics.jsonl   每个阶段结束时追加一行 JSON
+#   ANOMALY_METRICS=metrics.prom    进程退出时写 Prometheus 文本格式（node_exporter textfile）；
+#                                   每个进程各自覆盖写，多进程批处理请用 JSON 日志
+#   ANOMALY_METRICS=1               等同于 metrics.jsonl
+#   ANOMALY_METRICS_MEMORY=1        另用 tracemalloc 统计各阶段的分配峰值（会拖慢纯 Python 循环）
+
+_target = os.environ.get('ANOMALY_METRICS', '')
+_ENABLED = _target not in ('', '0')
+_OUTPUT = ('metrics.jsonl' if _target == '1' else _target) if _ENABLED else None
+_TRACE_MEMORY = _ENABLED and os.environ.get('ANOMALY_METRICS_MEMORY', '') not in ('', '0')
+
+_lock = threading.Lock()
+_local = threading.local()
+# (stage, 标签) -> [调用次数, 总耗时, 总行数, 最大分配峰值]
+_stages = defaultdict(lambda: [0, 0.0, 0, 0])
+# (计数器名, 标签) -> 次数
+_counters = defaultdict(int)
+
+
+def enabled():
+    return _ENABLED
+
+
+class _NullStage:
+    """关闭统计时使用的空上下文，允许照常设置 rows"""
+    rows = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+    def __setattr__(self, name, value):
+        pass
+
+
+_NULL_STAGE = _NullStage()
+
+
+class Stage:
+    def __init__(self, name, rows=None, labels=None):
+        self.name = name
+        self.rows = rows
+        self.labels = labels or {}
+        self.peak = 0
+
+    def __enter__(self):
+        stack = getattr(_local, 'stack', None)
+        if stack is None:
+            stack = _local.stack = []
+        if _TRACE_MEMORY:
+            if not tracemalloc.is_tracing():
+                tracemalloc.start()
+            if stack:
+                # 嵌套阶段：先把到目前为止的峰值记到外层，再重置峰值
+                stack[-1].peak = max(stack[-1].peak, tracemalloc.get_traced_memory()[1])
+            tracemalloc.reset_peak()
+        stack.append(self)
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        seconds = time.perf_counter() - self.start
+        stack = _local.stack
+        stack.pop()
+        if _TRACE_MEMORY:
+            self.peak = max(self.peak, tracemalloc.get_traced_memory()[1])
+            if stack:
+                stack[-1].peak = max(stack[-1].peak, self.peak)
+            tracemalloc.reset_peak()
+        _record(self, seconds, failed=exc_type is not None)
+        return False
+
+
+def stage(name, rows=None, **labels):
+    """
+    统计一个阶段的耗时，用法:
+
+        with metrics.stage('load', series=name) as s:
+            df = ...
+            s.rows = len(df)
+    """
+    if not _ENABLED:
+        return _NULL_STAGE
+    return Stage(name, rows, labels)
+
+
+def count(name, n=1, **labels):
+    """累加计数器，例如缓存命中/未命中: count('loader_cache', result='hit')"""
+    if not _ENABLED:
+        return
+    with _lock:
+        _counters[(name, tuple(sorted(labels.items())))] += n
+    if not _OUTPUT.endswith('.prom'):
+        _write_json({'type': 'counter', 'name': name, 'n': n, **labels})
+
+
+def _record(stage_obj, seconds, failed):
+    rows = stage_obj.rows
+    key = (stage_obj.name, tuple(sorted(stage_obj.labels.items())))
+    with _lock:
+        entry = _stages[key]
+        entry[0] += 1
+        entry[1] += seconds
+        entry[2] += rows or 0
+        entry[3] = max(entry[3], stage_obj.peak)
+    if _OUTPUT.endswith('.prom'):
+        return
+    record = {'type': 'stage', 'stage': stage_obj.name, 'seconds': round(seconds, 6), 'rows': rows,
+              'rows_per_sec': round(rows / seconds) if rows and seconds > 0 else None}
+    if _TRACE_MEMORY:
+        record['peak_mb'] = round(stage_obj.peak / 1024 ** 2, 3)
+    if failed:
+        record['failed'] = True
+    record.update(stage_obj.labels)
+    _write_json(record)
+
+
+def _write_json(record):
+    record = {'ts': round(time.time(), 3), 'pid': os.getpid(), 'script': os.path.basename(sys.argv[0]), **record}
+    line = json.dumps(record, ensure_ascii=False, default=str) + '\n'
+    with _lock:
+        with open(_OUTPUT, 'a', encoding='utf-8') as fout:
+            fout.write(line)
+
+
+def _prom_labels(labels):
+    if not labels:
+        return ''
+    escape = lambda v: str(v).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+    return '{' + ','.join(f'{k}="{escape(v)}"' for k, v in labels) + '}'
+
+
+def prometheus_text():
+    """把累计的阶段统计和计数器格式化为 Prometheus 文本格式"""
+    lines = []
+    with _lock:
+        stages = dict(_stages)
+        counters = dict(_counters)
+    metrics = [
+        ('anomaly_stage_calls_total', 'counter', '阶段调用次数', 0),
+        ('anomaly_stage_seconds_total', 'counter', '阶段累计耗时（秒）', 1),
+        ('anomaly_stage_rows_total', 'counter', '阶段累计处理行数', 2),
+    ]
+    if _TRACE_MEMORY:
+        metrics.append(('anomaly_stage_peak_bytes', 'gauge', '阶段内存分配峰值（字节）', 3))
+    for metric, kind, help_text, idx in metrics:
+        lines.append(f'# HELP {metric} {help_text}')
+        lines.append(f'# TYPE {metric} {kind}')
+        for (name, labels), entry in sorted(stages.items()):
+            lines.append(f'{metric}{_prom_labels((("stage", name),) + labels)} {entry[idx]}')
+    if counters:
+        lines.append('# HELP anomaly_events_total 缓存命中/未命中等事件计数')
+        lines.append('# TYPE anomaly_events_total counter')
+        for (name, labels), n in sorted(counters.items()):
+            lines.append(f'anomaly_events_total{_prom_labels((("event", name),) + labels)} {n}')
+    return '\n'.join(lines) + '\n'
+
+
+def write_prometheus(path):
+    """原子写出 Prometheus 文本文件"""
+    tmp_path = f'{path}.tmp{os.getpid()}'
+    with open(tmp_path, 'w', encoding='utf-8') as fout:
+        fout.write(prometheus_text())
+    os.replace(tmp_path, path)
+
+
+if _ENABLED and _OUTPUT.endswith('.prom'):
+    atexit.register(write_prometheus, _OUTPUT)
+
+
+def summarize(path):
+    """汇总 JSON 日志：每个阶段的调用次数、总耗时、总行数、行/秒和最大内存峰值"""
+    import pandas as pd
+
+    with open(path, 'r', encoding='utf-8') as fin:
+        records = [json.loads(line) for line in fin if line.strip()]
+    stages = pd.DataFrame([r for r in records if r.get('type') == 'stage'])
+    counters = pd.DataFrame([r for r in records if r.get('type') == 'counter'])
+    summary = pd.DataFrame()
+    if not stages.empty:
+        if 'peak_mb' not in stages.columns:
+            stages['peak_mb'] = float('nan')
+        standard = {'ts', 'pid', 'script', 'type', 'seconds', 'rows', 'rows_per_sec', 'peak_mb', 'failed'}
+        keys = ['stage'] + [c for c in stages.columns if c not in standard and c != 'stage']
+        stages[keys] = stages[keys].fillna('')
+        summary = stages.groupby(keys).agg(calls=('seconds', 'size'), seconds=('seconds', 'sum'),
+                                              rows=('rows', 'sum'), peak_mb=('peak_mb', 'max'))
+        summary['rows_per_sec'] = (summary['rows'] / summary['seconds']).round()
+        summary = summary.sort_values('seconds', ascending=False)
+    if not counters.empty:
+        label_cols = [c for c in counters.columns if c not in ('ts', 'pid', 'script', 'type', 'n')]
+        counters = counters.fillna('').groupby(label_cols)['n'].sum().reset_index()
+    return summary, counters
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="汇总 ANOMALY_METRICS 写出的 JSON 日志")
+    parser.add_argument('path', nargs='?', default='metrics.jsonl')
+    args = parser.parse_args()
+
+    summary, counters = summarize(args.path)
+    print("各阶段耗时:")
+    print(summary.to_string())
+    if not counters.empty:
+        print("\n计数器:")
+        print(counters.to_string(index=False))
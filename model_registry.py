@@ -0,0 +1,339 @@
+import os
+import json
+import time
+import hashlib
+from statistics import NormalDist
+import numpy as np
+import pandas as pd
+import metrics
+
+# pystan_demo.py 中使用的 Prophet 超参数
+DEFAULT_PARAMS = {
+    'changepoint_prior_scale': 0.8,
+    'changepoint_range': 0.9,
+    'seasonality_mode': 'additive',
+}
+
+REGISTRY_NAME = "registry.json"
+
+
+def data_fingerprint(df, y_col='norm_y'):
+    """对时间戳和数值的原始字节做哈希，用于判断训练数据是否变化"""
+    digest = hashlib.sha1()
+    digest.update(df['ds'].values.astype('datetime64[ns]').view('int64').tobytes())
+    digest.update(df[y_col].values.astype(float).tobytes())
+    return digest.hexdigest()
+
+
+def stan_init(model):
+    """取出已训练模型的参数，作为下一次拟合的 Stan 初始值（热启动）"""
+    res = {}
+    for pname in ['k', 'm', 'sigma_obs']:
+        res[pname] = float(model.params[pname][0][0])
+    for pname in ['delta', 'beta']:
+        res[pname] = model.params[pname][0]
+    return res
+
+
+def predict_frame(model, future, interval='sampling', uncertainty_samples=None):
+    """
+    对 future 中的时间点预测
+
+    参数:
+    interval: 'sampling' 使用 Prophet 的抽样区间，uncertainty_samples 为抽样次数（默认沿用模型设置 1000）；
+              'analytic' 跳过抽样，用观测噪声 sigma_obs 按正态分布直接给出 interval_width 区间
+              （80% 区间即 yhat ± 1.2816·sigma）。历史区间内 Prophet 的趋势不确定性为 0，
+              两者基本一致；外推到未来时 analytic 区间不含趋势不确定性，会偏窄
+    """
+    if interval not in ('sampling', 'analytic'):
+        raise ValueError("interval 参数必须是 'sampling' 或 'analytic'")
+    saved = model.uncertainty_samples
+    if interval == 'analytic':
+        model.uncertainty_samples = 0
+    elif uncertainty_samples is not None:
+        if uncertainty_samples <= 0:
+            raise ValueError("sampling 区间需要 uncertainty_samples > 0，不抽样请使用 interval='analytic'")
+        model.uncertainty_samples = uncertainty_samples
+    try:
+        forecast = model.predict(future)
+    finally:
+        model.uncertainty_samples = saved
+
+    if interval == 'analytic':
+        z = NormalDist().inv_cdf(0.5 + model.interval_width / 2)
+        sigma = float(np.mean(model.params['sigma_obs'])) * model.y_scale
+        forecast['yhat_lower'] = forecast['yhat'] - z * sigma
+        forecast['yhat_upper'] = forecast['yhat'] + z * sigma
+    return forecast
+
+
+def _pid_alive(pid):
+    """判断本机进程是否存在；Windows 上 os.kill 会结束进程，无法探测，一律视为存在"""
+    if os.name == 'nt':
+        return True
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+class RegistryLock:
+    """
+    基于独占创建锁文件的跨平台进程锁
+
+    锁文件中写入持锁进程的 PID；持锁进程已不存在（例如拟合进程被杀死）时立即接管，
+    无法判断时（旧格式的空锁文件、Windows）等待 timeout 秒后强制接管。
+    """
+
+    def __init__(self, path, timeout=60, poll=0.05):
+        self.path = path
+        self.timeout = timeout
+        self.poll = poll
+
+    def _holder(self):
+        try:
+            with open(self.path, 'r') as fin:
+                return int(fin.read().strip())
+        except (OSError, ValueError):
+            return None
+
+    def _remove(self):
+        try:
+            os.remove(self.path)
+        except FileNotFoundError:
+            pass
+
+    def __enter__(self):
+        deadline = time.monotonic() + self.timeout
+        while True:
+            try:
+                fd = os.open(self.path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+                os.write(fd, str(os.getpid()).encode())
+                os.close(fd)
+                return self
+            except FileExistsError:
+                holder = self._holder()
+                if holder is not None and holder != os.getpid() and not _pid_alive(holder):
+                    # 再读一次，确认锁文件没有在此期间被其他进程重新创建
+                    if self._holder() == holder:
+                        print(f"持锁进程 {holder} 已不存在，移除遗留锁文件 {self.path}")
+                        self._remove()
+                    continue
+                if time.monotonic() > deadline:
+                    print(f"等待注册表锁超时，移除遗留锁文件 {self.path}")
+                    self._remove()
+                    deadline = time.monotonic() + self.timeout
+                time.sleep(self.poll)
+
+    def __exit__(self, exc_type, exc, tb):
+        self._remove()
+
+
+class ModelRegistry:
+    """
+    Prophet 模型注册表
+
+    记录每个模型的训练区间、训练数据指纹和超参数（models/registry.json）。
+    新数据不足 min_new_points 时直接复用已保存模型；达到阈值后用旧模型参数
+    热启动重新拟合；超参数变化时冷启动重新拟合。预测结果按模型版本缓存。
+
+    参数:
+    model_dir: 模型目录
+    min_new_points: 触发重新拟合所需的新数据点数，默认一天的 5 分钟数据
+    """
+
+    def __init__(self, model_dir='models', min_new_points=288):
+        self.model_dir = model_dir
+        self.min_new_points = min_new_points
+        os.makedirs(model_dir, exist_ok=True)
+        self.path = os.path.join(model_dir, REGISTRY_NAME)
+        self.entries = self._load()
+        self._models = {}
+
+    def _load(self):
+        try:
+            with open(self.path, 'r', encoding='utf-8') as fin:
+                return json.load(fin)
+        except (OSError, ValueError):
+            return {}
+
+    def _save(self, name):
+        """
+        只写回 name 这一条记录：加锁后重新读取注册表再合并，
+        多个进程同时拟合不同模型时不会互相覆盖
+        """
+        with RegistryLock(self.path + '.lock'):
+            entries = self._load()
+            entries[name] = self.entries[name]
+            tmp_path = self.path + f'.tmp{os.getpid()}'
+            with open(tmp_path, 'w', encoding='utf-8') as fout:
+                json.dump(entries, fout, ensure_ascii=False, indent=2)
+            os.replace(tmp_path, self.path)
+        self.entries = entries
+
+    def model_path(self, name):
+        return os.path.join(self.model_dir, f'{name}_model.json')
+
+    def forecast_path(self, name):
+        return os.path.join(self.model_dir, f'{name}_forecast.pkl')
+
+    def components_path(self, name):
+        return os.path.join(self.model_dir, f'{name}_components.pkl')
+
+    def _read_model(self, name):
+        if name not in self._models:
+            # Prophet/Stan 导入较慢，只在真正需要模型时加载
+            from prophet.serialize import model_from_json
+
+            with open(self.model_path(name), 'r') as fin:
+                self._models[name] = model_from_json(fin.read())
+        return self._models[name]
+
+    def _register_legacy(self, name, params):
+        """为注册表之前保存的模型文件补登记，训练区间取自模型自带的 history"""
+        model = self._read_model(name)
+        history = model.history
+        self.entries[name] = {
+            'train_start': str(history['ds'].min()),
+            'train_end': str(history['ds'].max()),
+            'rows': len(history),
+            'fingerprint': None,
+            'params': params,
+            'fitted_at': None,
+            'fit_seconds': None,
+            'warm_start': False,
+        }
+        self._save(name)
+
+    def refit_reason(self, df, name, params, y_col='norm_y'):
+        """返回需要重新拟合的原因（'cold'/'warm'）及说明，无需拟合时返回 (None, 说明)"""
+        entry = self.entries.get(name)
+        if entry is None or not os.path.exists(self.model_path(name)):
+            return 'cold', "没有已保存模型"
+        if entry['params'] != params:
+            return 'cold', "超参数已变化"
+        train_end = pd.Timestamp(entry['train_end'])
+        trained = df[df['ds'] <= train_end]
+        if entry['fingerprint'] is not None and data_fingerprint(trained, y_col) != entry['fingerprint']:
+            return 'warm', "训练区间内的数据已变化"
+        new_points = int((df['ds'] > train_end).sum())
+        if new_points >= self.min_new_points:
+            return 'warm', f"新增 {new_points} 个数据点"
+        return None, f"新增 {new_points} 个数据点，未达到 {self.min_new_points}"
+
+    def get_model(self, df, name, params=None, y_col='norm_y'):
+        """
+        获取模型：按需复用、热启动或冷启动拟合
+
+        参数:
+        df: 含 ds 和 y_col 列的训练数据
+        name: 模型名称（通常为业务名）
+        params: Prophet 超参数，默认 DEFAULT_PARAMS
+        """
+        params = dict(DEFAULT_PARAMS if params is None else params)
+        if name not in self.entries and os.path.exists(self.model_path(name)):
+            self._register_legacy(name, params)
+
+        mode, reason = self.refit_reason(df, name, params, y_col)
+        metrics.count('model_registry', result=mode or 'reuse')
+        if mode is None:
+            print(f"📦 加载已保存模型（{reason}）...")
+            return self._read_model(name)
+
+        init = None
+        if mode == 'warm':
+            init = stan_init(self._read_model(name))
+            print(f"🔧 热启动重新训练模型（{reason}）...")
+        else:
+            print(f"🔧 训练新模型（{reason}）...")
+
+        from prophet import Prophet
+        from prophet.serialize import model_to_json
+
+        start = time.perf_counter()
+        model = Prophet(**params)
+        fit_kwargs = {'init': init} if init is not None else {}
+        with metrics.stage('fit', rows=len(df), mode=mode):
+            model.fit(df[['ds', y_col]].rename(columns={y_col: 'y'}), **fit_kwargs)
+        fit_seconds = time.perf_counter() - start
+
+        with open(self.model_path(name), 'w') as fout:
+            fout.write(model_to_json(model))
+        self._models[name] = model
+        self.entries[name] = {
+            'train_start': str(df['ds'].min()),
+            'train_end': str(df['ds'].max()),
+            'rows': len(df),
+            'fingerprint': data_fingerprint(df, y_col),
+            'params': params,
+            'fitted_at': pd.Timestamp.now().isoformat(timespec='seconds'),
+            'fit_seconds': round(fit_seconds, 3),
+            'warm_start': init is not None,
+        }
+        self._save(name)
+        print(f"✅ 模型保存至 {self.model_path(name)}（耗时 {fit_seconds:.1f} 秒）")
+        return model
+
+    def _model_version(self, name):
+        entry = self.entries[name]
+        return {'train_end': entry['train_end'], 'fingerprint': entry['fingerprint'], 'fitted_at': entry['fitted_at']}
+
+    def get_forecast(self, model, name, periods=24 * 12, freq='5min', interval='sampling', uncertainty_samples=None):
+        """预测结果按 (模型版本, periods, freq, 区间方式) 缓存，模型未重新拟合时直接读取"""
+        entry = self.entries[name]
+        key = dict(self._model_version(name), periods=periods, freq=freq)
+        if interval != 'sampling' or uncertainty_samples is not None:
+            key.update(interval=interval, uncertainty_samples=uncertainty_samples)
+        path = self.forecast_path(name)
+        if entry.get('forecast') == key and os.path.exists(path):
+            metrics.count('forecast_cache', result='hit')
+            return pd.read_pickle(path)
+
+        metrics.count('forecast_cache', result='miss')
+        future = model.make_future_dataframe(periods=periods, freq=freq)
+        with metrics.stage('predict', rows=len(future)):
+            forecast = predict_frame(model, future, interval, uncertainty_samples)
+        forecast.to_pickle(path)
+        entry['forecast'] = key
+        self._save(name)
+        return forecast
+
+    def predict_points(self, model, name, ds, interval='analytic', uncertainty_samples=None):
+        """
+        只预测给定的时间点
+
+        趋势、季节项和区间按时间戳缓存在 <name>_components.pkl 中（随模型版本失效），
+        已经预测过的时间点直接读取，只有新时间点才调用 Prophet。
+
+        返回:
+        与 model.predict 同结构的 DataFrame，按 ds 升序
+        """
+        entry = self.entries[name]
+        key = dict(self._model_version(name), interval=interval, uncertainty_samples=uncertainty_samples)
+        path = self.components_path(name)
+        wanted = np.unique(pd.to_datetime(pd.Series(ds)).values.astype('datetime64[ns]'))
+
+        cached = None
+        if entry.get('components') == key and os.path.exists(path):
+            cached = pd.read_pickle(path)
+            known = cached['ds'].values.astype('datetime64[ns]')
+            missing = wanted[~np.isin(wanted, known)]
+        else:
+            missing = wanted
+        metrics.count('components_cache', n=len(wanted) - len(missing), result='hit')
+        metrics.count('components_cache', n=len(missing), result='miss')
+
+        if len(missing):
+            with metrics.stage('predict', rows=len(missing), mode='points'):
+                new = predict_frame(model, pd.DataFrame({'ds': missing}), interval, uncertainty_samples)
+            cached = new if cached is None else pd.concat([cached, new], ignore_index=True)
+            cached = cached.sort_values('ds', kind='mergesort').reset_index(drop=True)
+            cached.to_pickle(path)
+            entry['components'] = key
+            self._save(name)
+
+        rows = np.isin(cached['ds'].values.astype('datetime64[ns]'), wanted)
+        return cached[rows].reset_index(drop=True)
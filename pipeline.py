@@ -0,0 +1,129 @@
+import os
+import time
+import argparse
+import importlib
+from pathlib import Path
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import pandas as pd
+
+# 检测器名称 -> 提供 detect_anomalies(path, **params) 的模块
+DETECTORS = {
+    'changepoint': 'changepoint_demo',
+    'growth': 'growth_rate',
+    'prophet': 'pystan_demo',
+}
+
+RESULT_COLUMNS = ['series', 'detector', 'ds', 'value', 'score']
+
+
+def find_series(data_path="data"):
+    """列出 data/*/*_merged.csv，每个文件对应一个业务"""
+    return sorted(Path(data_path).glob("*/*_merged.csv"))
+
+
+def run_detector(detector, path, params=None):
+    """
+    在单个序列上运行检测器
+
+    返回:
+    (业务名, 异常 DataFrame 或 None, 耗时秒数, 错误信息或 None)
+    """
+    series = Path(path).parent.name
+    start = time.perf_counter()
+    try:
+        # 在工作进程内按需导入，只加载所选检测器的依赖
+        module = importlib.import_module(DETECTORS[detector])
+        result = module.detect_anomalies(str(path), **(params or {}))
+        result.insert(0, 'series', series)
+        result.insert(1, 'detector', detector)
+        return series, result, time.perf_counter() - start, None
+    except Exception as e:
+        return series, None, time.perf_counter() - start, f"{type(e).__name__}: {e}"
+
+
+def write_table(df, output_path):
+    output_path = Path(output_path)
+    output_path.parent.mkdir(parents=True, exist_ok=True)
+    if output_path.suffix == '.parquet':
+        df.to_parquet(output_path, index=False)
+    else:
+        df.to_csv(output_path, index=False)
+
+
+def run_batch(detector, data_path="data", output="anomalies.csv", workers=None, params=None):
+    """
+    对 data 下所有业务并行运行同一检测器，结果写入一个文件
+
+    参数:
+    detector: DETECTORS 中的检测器名称
+    output: 输出文件，后缀为 .parquet 时写 Parquet，否则写 CSV；
+            同目录下另写 <output>_timings.csv 记录每个序列的耗时
+    workers: 进程数，None 时使用CPU核数
+    params: 传给 detect_anomalies 的参数字典
+
+    返回:
+    (异常 DataFrame, 耗时 DataFrame)
+    """
+    if detector not in DETECTORS:
+        raise ValueError(f"detector 参数必须是 {list(DETECTORS)} 之一")
+
+    paths = find_series(data_path)
+    if not paths:
+        print(f"在 {data_path} 下没有找到 *_merged.csv 文件")
+        return pd.DataFrame(columns=RESULT_COLUMNS), pd.DataFrame()
+
+    workers = workers or os.cpu_count() or 1
+    print(f"检测器: {detector}，序列数: {len(paths)}，进程数: {workers}")
+    start = time.perf_counter()
+    results = []
+    timings = []
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = [pool.submit(run_detector, detector, path, params) for path in paths]
+        for i, future in enumerate(as_completed(futures), 1):
+            series, result, seconds, error = future.result()
+            count = 0 if result is None else len(result)
+            timings.append({'series': series, 'detector': detector, 'seconds': seconds,
+                            'anomalies': count, 'error': error})
+            if result is not None and count:
+                results.append(result)
+            status = f"出错: {error}" if error else f"{count} 个异常"
+            print(f"[{i}/{len(paths)}] {series}: {status}，耗时 {seconds:.2f} 秒")
+
+    anomalies = pd.concat(results, ignore_index=True) if results else pd.DataFrame(columns=RESULT_COLUMNS)
+    anomalies = anomalies.sort_values(['series', 'ds'], kind='mergesort').reset_index(drop=True)
+    timings = pd.DataFrame(timings).sort_values('seconds', ascending=False).reset_index(drop=True)
+
+    output = Path(output)
+    write_table(anomalies, output)
+    timings.to_csv(output.with_name(output.stem + '_timings.csv'), index=False)
+    failed = timings['error'].notna().sum()
+    print(f"全部完成，总耗时 {time.perf_counter() - start:.2f} 秒，异常 {len(anomalies)} 个，失败 {failed} 个")
+    print(f"输出文件: {output}")
+    return anomalies, timings
+
+
+def parse_params(items):
+    """把 ['threshold=13', 'method=iqr'] 解析为参数字典，数值自动转换"""
+    params = {}
+    for item in items or []:
+        key, _, value = item.partition('=')
+        for cast in (int, float):
+            try:
+                value = cast(value)
+                break
+            except ValueError:
+                continue
+        params[key] = value
+    return params
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="对所有业务批量运行异常检测")
+    parser.add_argument('detector', choices=list(DETECTORS))
+    parser.add_argument('--data', default='data', help="数据根目录")
+    parser.add_argument('--output', default='anomalies.csv', help="输出文件（.csv 或 .parquet）")
+    parser.add_argument('--workers', type=int, default=None, help="并行进程数，默认CPU核数")
+    parser.add_argument('--param', action='append', metavar='KEY=VALUE',
+                        help="检测器参数，可重复，例如 --param threshold=13")
+    args = parser.parse_args()
+    run_batch(args.detector, args.data, args.output, args.workers, parse_params(args.param))
@@ -0,0 +1,130 @@
+import json
+from pathlib import Path
+import numpy as np
+import pandas as pd
+
+SCALERS = ('minmax', 'robust', 'rolling')
+
+
+def rolling_min_max(values, window):
+    """尾随窗口（含当前点）内的最小值和最大值，窗口未满时使用已有数据"""
+    series = pd.Series(values, dtype=float)
+    rolling = series.rolling(window, min_periods=1)
+    return rolling.min().values, rolling.max().values
+
+
+def fit_scaler(values, method='minmax', nonzero=True, eps=0.0, q_low=0.05, q_high=0.95, window=288):
+    """
+    根据数据计算归一化参数
+
+    参数:
+    method: 'minmax'（最小/最大值）、'robust'（q_low/q_high 分位数，不受个别尖峰影响）
+            或 'rolling'（尾随 window 个点内的最小/最大值，参数只记录窗口，边界在归一化时逐点计算）
+    nonzero: 为True时只用大于0的值计算边界，且 0 值（及缺失值）归一化后为 0；
+             计数为 0 表示没有采集到数据，不参与缩放
+    eps: 分母附加的极小值；为 0 且上下界相等时原样返回数据
+
+    返回:
+    可 JSON 序列化的参数字典，传给 apply_scaler 或 save_scaler
+    """
+    if method not in SCALERS:
+        raise ValueError(f"method 参数必须是 {SCALERS} 之一")
+    params = {'method': method, 'nonzero': bool(nonzero), 'eps': float(eps)}
+    if method == 'rolling':
+        params['window'] = int(window)
+        return params
+
+    values = np.asarray(values, dtype=float)
+    sample = values[values > 0] if nonzero else values[~np.isnan(values)]
+    if len(sample) == 0:
+        low = high = np.nan
+    elif method == 'minmax':
+        low, high = sample.min(), sample.max()
+    else:
+        low, high = np.quantile(sample, [q_low, q_high])
+        params.update(q_low=q_low, q_high=q_high)
+    params.update(low=float(low), high=float(high))
+    return params
+
+
+def minmax_params(low, high, nonzero=True, eps=0.0):
+    """由已知的上下界构造 minmax 参数，例如 StreamingChangepointDetector 的 scale"""
+    return {'method': 'minmax', 'nonzero': nonzero, 'eps': float(eps), 'low': float(low), 'high': float(high)}
+
+
+def apply_scaler(values, params, out=None, dtype=None):
+    """
+    按参数归一化，整段数组运算
+
+    参数:
+    out: 可选的输出数组（可以就是 values 本身，实现原地归一化）
+    dtype: 未给 out 时输出数组的类型，默认 float64；float32 可减半内存
+
+    返回:
+    归一化后的数组
+    """
+    values = np.asarray(values)
+    if out is None:
+        out = np.empty(values.shape, dtype=dtype or np.float64)
+    zero_mask = ~(values > 0) if params['nonzero'] else None
+
+    if params['method'] == 'rolling':
+        source = np.where(values > 0, values, np.nan) if params['nonzero'] else values
+        low, high = rolling_min_max(source, params['window'])
+        low = low.copy()
+        span = high - low + params['eps']
+        # 窗口内上下界相等的点归一化为 0
+        flat = span == 0
+        if flat.any():
+            span[flat] = 1.0
+            low[flat] = values[flat]
+    else:
+        low, high = params['low'], params['high']
+        span = high - low + params['eps']
+        if span == 0 or np.isnan(span):
+            # 上下界相等（或没有有效数据）时原样返回
+            out[...] = values
+            return out
+
+    np.subtract(values, low, out=out, casting='unsafe')
+    np.divide(out, span, out=out, casting='unsafe')
+    if zero_mask is not None:
+        out[zero_mask] = 0
+    return out
+
+
+def save_scaler(params, path):
+    """把归一化参数保存为 JSON，之后用 load_scaler 读取复用"""
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    with open(path, 'w', encoding='utf-8') as fout:
+        json.dump(params, fout, ensure_ascii=False, indent=2)
+
+
+def load_scaler(path):
+    with open(path, 'r', encoding='utf-8') as fin:
+        return json.load(fin)
+
+
+def normalize_column(df, src='original_y', dst='norm_y', params=None, method='minmax', dtype=None, **options):
+    """
+    在 DataFrame 上添加归一化列
+
+    参数:
+    params: 已有的归一化参数（dict 或 JSON 文件路径），为None时用 method/options 从 df[src] 计算
+    dtype: 结果列类型，例如 np.float32；dst 与 src 相同时原地覆盖
+
+    返回:
+    使用的参数字典
+    """
+    values = df[src].values
+    if params is None:
+        params = fit_scaler(values, method, **options)
+    elif not isinstance(params, dict):
+        params = load_scaler(params)
+    if dst == src and values.dtype.kind == 'f' and values.flags.writeable and dtype is None:
+        apply_scaler(values, params, out=values)
+        df[dst] = values
+    else:
+        df[dst] = apply_scaler(values, params, dtype=dtype)
+    return params
@@ -1,124 +1,182 @@
 import os
+import argparse
 import pandas as pd
 import numpy as np
-from prophet import Prophet
-from prophet.serialize import model_to_json, model_from_json
-import matplotlib.pyplot as plt
+from scoring import add_residual_columns, detect_outliers
+from loader import load_merged
+from preprocess import normalize_column, save_scaler
+from model_registry import ModelRegistry
+import metrics
 
 # === 函数定义 ===
-def load_and_preprocess(path):
-    df = pd.read_csv(path)
+def load_and_preprocess(path, fill=None, scaler=None, method='minmax', dtype=None):
+    # fill 为 'zero'/'nan' 等时先对齐到 5 分钟网格（见 loader.align_to_grid）
+    df = load_merged(path, fill=fill)
     df.rename(columns={'Time': 'ds', 'Count': 'original_y'}, inplace=True)
-    df['ds'] = pd.to_datetime(df['ds'])
 
-    # 归一化
-    non_zero = df[df['original_y'] > 0]['original_y']
-    y_min, y_max = non_zero.min(), non_zero.max()
+    # 归一化：默认非零 min-max；scaler 为已保存的参数（dict 或 JSON 路径）时直接复用
+    params = normalize_column(df, 'original_y', 'norm_y', params=scaler, method=method, dtype=dtype)
+    df.attrs['scaler'] = params
+    return df, params.get('low'), params.get('high')
 
-    if y_max != y_min:
-        df['norm_y'] = df['original_y'].apply(lambda x: (x - y_min) / (y_max - y_min) if x > 0 else 0)
-    else:
-        df['norm_y'] = df['original_y']
-
-    return df, y_min, y_max
-
-
-def get_model(df, model_path):
-    if os.path.exists(model_path):
-        print("📦 加载已保存模型...")
-        with open(model_path, 'r') as fin:
-            model = model_from_json(fin.read())
-    else:
-        print("🔧 训练新模型...")
-        model = Prophet(
-            changepoint_prior_scale=0.8,
-            changepoint_range=0.9,
-            seasonality_mode='additive'
-        )
-        model.fit(df.rename(columns={'norm_y': 'y'}))
-        with open(model_path, 'w') as fout:
-            fout.write(model_to_json(model))
-        print(f"✅ 模型保存至 {model_path}")
-    return model
-
-
-def calc_error(row):
-    if pd.isna(row['norm_y']):
-        return 0
-    if row['yhat_lower'] <= row['norm_y'] <= row['yhat_upper']:
-        return 0
-    return min(abs(row['norm_y'] - row['yhat_lower']), abs(row['norm_y'] - row['yhat_upper']))
-
-
-def detect_outliers(df, method='zscore', z_thresh=9, iqr_factor=1.5, ratio_thresh=2.0):
-    if method == 'zscore':
-        mean_err = df['error'].mean()
-        std_err = df['error'].std()
-        outliers = df[df['error'] > (mean_err + z_thresh * std_err)]
-
-    elif method == 'iqr':
-        q1 = df['error'].quantile(0.25)
-        q3 = df['error'].quantile(0.75)
-        iqr = q3 - q1
-        threshold = q3 + iqr_factor * iqr
-        outliers = df[df['error'] > threshold]
-
-    elif method == 'deviation_ratio':
-        if 'deviation_ratio' not in df.columns:
-            df['deviation_ratio'] = df.apply(
-                lambda row: 0 if pd.isna(row['norm_y']) or row['yhat_lower'] <= row['norm_y'] <= row['yhat_upper']
-                else abs(row['norm_y'] - row['yhat']) / (row['yhat_upper'] - row['yhat_lower'] + 1e-9),
-                axis=1
-            )
-        outliers = df[df['deviation_ratio'] > ratio_thresh]
-
-    else:
-        raise ValueError("method 参数必须是 'zscore'、'iqr' 或 'deviation_ratio'")
 
-    return outliers
+def get_model(df, model_path, min_new_points=288):
+    """
+    通过模型注册表获取模型：新数据不足 min_new_points 时复用已保存模型，
+    否则用旧模型参数热启动重新拟合
+    """
+    registry = ModelRegistry(os.path.dirname(model_path) or '.', min_new_points=min_new_points)
+    return registry.get_model(df, model_name_for(model_path))
 
 
-def plot_forecast(model, forecast, outliers):
-    fig1 = model.plot(forecast)
-    plt.scatter(outliers['ds'], outliers['norm_y'], color='red', label='Anomaly', s=15, zorder=5)
-    plt.legend()
-    plt.title('Forecast with Detected Outliers')
+def model_name_for(model_path):
+    return os.path.basename(model_path)[:-len('_model.json')]
 
-    fig2 = model.plot_components(forecast)
-    plt.show()
 
+def plot_forecast(model, forecast, outliers, save_path=None):
+    # save_path 不为None时保存到文件（分量图保存为 <文件名>_components）并关闭图形，用于批量生成报告
+    import matplotlib.pyplot as plt
 
-# === 配置 ===
-#path = 'data\\35.企业信使\\35.企业信使_merged.csv'
-#path = 'data\\31.企网汇款\\31.企网汇款_merged.csv'
-#path = 'data\\23.三方平台快捷支付\\23.三方平台快捷支付_merged.csv'
-path = 'data\\9.手机银行\\9.手机银行_merged.csv'
-model_dir = 'models'
-os.makedirs(model_dir, exist_ok=True)
+    with metrics.stage('plot', rows=len(forecast), detector='prophet'):
+        fig1 = model.plot(forecast)
+        plt.scatter(outliers['ds'], outliers['norm_y'], color='red', label='Anomaly', s=15, zorder=5)
+        plt.legend()
+        plt.title('Forecast with Detected Outliers')
 
-df, y_min, y_max = load_and_preprocess(path)
-
-# 生成模型路径
-csv_filename = os.path.basename(path).replace('merged', '')
-model_filename = os.path.splitext(csv_filename)[0] + '_model.json'
-model_path = os.path.join(model_dir, model_filename)
-
-# 获取模型并预测
-model = get_model(df, model_path)
-future = model.make_future_dataframe(periods=24 * 12, freq='5min')
-forecast = model.predict(future)
-
-# 合并预测结果与原始数据
-merged = pd.merge(forecast, df[['ds', 'norm_y']], on='ds', how='left')
-merged['error'] = merged.apply(calc_error, axis=1)
-cumulative_error = merged['error'].sum()
+        fig2 = model.plot_components(forecast)
+    if save_path:
+        root, ext = os.path.splitext(save_path)
+        fig1.savefig(save_path)
+        fig2.savefig(f'{root}_components{ext}')
+        plt.close(fig1)
+        plt.close(fig2)
+    else:
+        plt.show()
+
+
+def model_path_for(path, model_dir='models'):
+    # 9.手机银行_merged.csv -> models/9.手机银行__model.json（沿用已有模型文件的命名）
+    csv_filename = os.path.basename(path).replace('merged', '')
+    model_filename = os.path.splitext(csv_filename)[0] + '_model.json'
+    return os.path.join(model_dir, model_filename)
+
+
+def _load_with_scaler(path, scaler_method, scaler_file):
+    # scaler_file 存在时复用其中的归一化参数，不存在时按 scaler_method 计算后写入该文件
+    reuse = scaler_file is not None and os.path.exists(scaler_file)
+    df, _, _ = load_and_preprocess(path, scaler=scaler_file if reuse else None, method=scaler_method)
+    if scaler_file is not None and not reuse:
+        save_scaler(df.attrs['scaler'], scaler_file)
+    return df
+
+
+def forecast_and_score(path, model_dir='models', periods=24 * 12, min_new_points=288,
+                       scaler_method='minmax', scaler_file=None, interval='sampling', uncertainty_samples=None):
+    """
+    加载数据、获取模型并预测，返回 (model, forecast, merged)，merged 已含 error/deviation_ratio 列
+
+    interval/uncertainty_samples 见 model_registry.predict_frame
+    """
+    df = _load_with_scaler(path, scaler_method, scaler_file)
+
+    # 获取模型并预测（模型未重新拟合时直接复用缓存的预测结果）
+    registry = ModelRegistry(model_dir, min_new_points=min_new_points)
+    name = model_name_for(model_path_for(path, model_dir))
+    model = registry.get_model(df, name)
+    forecast = registry.get_forecast(model, name, periods=periods, freq='5min',
+                                     interval=interval, uncertainty_samples=uncertainty_samples)
+
+    # 合并预测结果与原始数据
+    merged = pd.merge(forecast, df[['ds', 'norm_y', 'original_y']], on='ds', how='left')
+    with metrics.stage('score', rows=len(merged), detector='prophet'):
+        add_residual_columns(merged)
+    return model, forecast, merged
+
+
+def score_recent(path, model_dir='models', window=24 * 12, min_new_points=288, scaler_method='minmax',
+                 scaler_file=None, interval='analytic', uncertainty_samples=None):
+    """
+    只对最近 window 个数据点预测并打分，返回 (model, forecast, merged)
+
+    不再对全部历史加未来一天做预测：预测结果按时间戳缓存（见 ModelRegistry.predict_points），
+    周期性运行时只有上次之后新到的点需要调用 Prophet；默认用 analytic 区间，不做抽样。
+    zscore/iqr 方法的阈值只按这 window 个点的误差计算；deviation_ratio 为逐点判断，与全量结果一致。
+    """
+    df = _load_with_scaler(path, scaler_method, scaler_file)
+    registry = ModelRegistry(model_dir, min_new_points=min_new_points)
+    name = model_name_for(model_path_for(path, model_dir))
+    model = registry.get_model(df, name)
+
+    recent = df.iloc[-window:] if window else df
+    forecast = registry.predict_points(model, name, recent['ds'], interval, uncertainty_samples)
+    merged = pd.merge(forecast, recent[['ds', 'norm_y', 'original_y']], on='ds', how='left')
+    with metrics.stage('score', rows=len(merged), detector='prophet'):
+        add_residual_columns(merged)
+    return model, forecast, merged
+
+
+def detect_anomalies(path, model_dir='models', method='deviation_ratio', window=None, interval=None,
+                     uncertainty_samples=None, **thresholds):
+    """
+    批量检测入口：返回异常点 DataFrame，列为 ds、value（原始值）、score
+
+    score 在 deviation_ratio 方法下为偏离比，其余方法为区间误差。
+    window 不为None时只对最近 window 个点打分（见 score_recent）。
+    interval 为None时与命令行一致：设置 window 时用 analytic，否则用 sampling。
+    """
+    if interval is None:
+        interval = 'analytic' if window else 'sampling'
+    if window:
+        _, _, merged = score_recent(path, model_dir, window, interval=interval,
+                                    uncertainty_samples=uncertainty_samples)
+    else:
+        _, _, merged = forecast_and_score(path, model_dir, interval=interval,
+                                          uncertainty_samples=uncertainty_samples)
+    outliers = detect_outliers(merged, method=method, **thresholds)
+    score_col = 'deviation_ratio' if method == 'deviation_ratio' else 'error'
+    return pd.DataFrame({
+        'ds': outliers['ds'].values,
+        'value': outliers['original_y'].values,
+        'score': outliers[score_col].values,
+    })
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Prophet 预测区间异常检测")
+    #path = os.path.join('data', '35.企业信使', '35.企业信使_merged.csv')
+    #path = os.path.join('data', '31.企网汇款', '31.企网汇款_merged.csv')
+    #path = os.path.join('data', '23.三方平台快捷支付', '23.三方平台快捷支付_merged.csv')
+    parser.add_argument('path', nargs='?', default=os.path.join('data', '9.手机银行', '9.手机银行_merged.csv'))
+    parser.add_argument('--model-dir', default='models')
+    parser.add_argument('--method', default='deviation_ratio', choices=['zscore', 'iqr', 'deviation_ratio'])
+    parser.add_argument('--min-new-points', type=int, default=288, help="新增多少数据点后重新拟合模型")
+    parser.add_argument('--scaler', default='minmax', choices=['minmax', 'robust', 'rolling'], help="归一化方式")
+    parser.add_argument('--scaler-file', default=None, help="归一化参数文件，存在时复用，不存在时保存")
+    parser.add_argument('--window', type=int, default=None,
+                        help="只对最近多少个点打分（按时间戳缓存预测结果），默认预测全部历史")
+    parser.add_argument('--interval', default=None, choices=['sampling', 'analytic'],
+                        help="预测区间计算方式，默认全量预测用 sampling、--window 时用 analytic")
+    parser.add_argument('--uncertainty-samples', type=int, default=None, help="sampling 区间的抽样次数")
+    parser.add_argument('--save', default=None, help="把图保存到该文件（PNG/SVG），不弹出窗口")
+    args = parser.parse_args()
+
+    if args.window:
+        model, forecast, merged = score_recent(args.path, args.model_dir, args.window, args.min_new_points,
+                                               args.scaler, args.scaler_file, args.interval or 'analytic',
+                                               args.uncertainty_samples)
+    else:
+        model, forecast, merged = forecast_and_score(args.path, args.model_dir, min_new_points=args.min_new_points,
+                                                     scaler_method=args.scaler, scaler_file=args.scaler_file,
+                                                     interval=args.interval or 'sampling',
+                                                     uncertainty_samples=args.uncertainty_samples)
+    cumulative_error = merged['error'].sum()
 
-# 输出误差信息
-print(f"🎯 累计误差：{cumulative_error:.2f}")
-print(merged[['ds', 'norm_y', 'yhat', 'yhat_lower', 'yhat_upper', 'error']].tail())
+    # 输出误差信息
+    print(f"🎯 累计误差：{cumulative_error:.2f}")
+    print(merged[['ds', 'norm_y', 'yhat', 'yhat_lower', 'yhat_upper', 'error']].tail())
 
-# 检测异常
-outliers = detect_outliers(merged, method='deviation_ratio')  # 可改为 'iqr' 或 'deviation_ratio'
+    # 检测异常
+    outliers = detect_outliers(merged, method=args.method)
 
-# 可视化
-plot_forecast(model, forecast, outliers)
+    # 可视化
+    plot_forecast(model, forecast, outliers, args.save)
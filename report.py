@@ -0,0 +1,186 @@
+import os
+import time
+import html
+import argparse
+import warnings
+from pathlib import Path
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import numpy as np
+import pandas as pd
+from loader import load_merged
+from pipeline import DETECTORS, find_series, run_batch, parse_params
+import metrics
+
+# 每个工作进程只创建一次图形，所有窗口、所有业务复用同一个 Figure/Axes
+_figure = None
+_axes = None
+
+
+def _init_worker(figsize=(12, 4), dpi=100):
+    """工作进程初始化：使用无界面的 Agg 后端，设置中文字体并创建可复用的图形"""
+    global _figure, _axes
+    import matplotlib
+    matplotlib.use('Agg')
+    import matplotlib.pyplot as plt
+
+    plt.rcParams['font.sans-serif'] = ['SimHei', 'Microsoft YaHei', 'DejaVu Sans']
+    plt.rcParams['axes.unicode_minus'] = False
+    # 没有中文字体的服务器上每张图都会警告缺字，批量渲染时忽略
+    warnings.filterwarnings('ignore', message='Glyph .* missing from font')
+    _figure = plt.figure(figsize=figsize, dpi=dpi)
+    _axes = _figure.add_subplot(111)
+
+
+def anomaly_windows(times, half_window):
+    """
+    把异常时间点聚成绘图窗口：相邻异常间隔不超过 2*half_window 的画在同一张图中
+
+    参数:
+    times: 升序 datetime64[ns] 数组
+    half_window: 异常点前后各保留的时长（pd.Timedelta）
+
+    返回:
+    [(窗口开始, 窗口结束, 起始下标, 结束下标), ...]，下标为 times 中属于该窗口的异常范围
+    """
+    if len(times) == 0:
+        return []
+    half = np.timedelta64(pd.Timedelta(half_window).value, 'ns')
+    breaks = np.flatnonzero(np.diff(times) > 2 * half) + 1
+    starts = np.r_[0, breaks]
+    ends = np.r_[breaks, len(times)]
+    return [(times[s] - half, times[e - 1] + half, s, e) for s, e in zip(starts, ends)]
+
+
+def render_series(series, path, anomalies, out_dir, half_window='6h', fmt='png'):
+    """
+    只渲染每个异常附近的窗口，不画整条序列
+
+    参数:
+    anomalies: 该业务的异常 DataFrame（pipeline 输出格式：detector、ds、value、score）
+
+    返回:
+    (业务名, 图片路径列表, 耗时秒数, 错误信息或 None)
+    """
+    start = time.perf_counter()
+    if _figure is None:
+        _init_worker()
+    try:
+        df = load_merged(path)
+        times = df['Time'].values.astype('datetime64[ns]')
+        values = df['Count'].values
+        anomalies = anomalies.assign(ds=pd.to_datetime(anomalies['ds']).values.astype('datetime64[ns]'))
+        anomalies = anomalies.sort_values('ds', kind='mergesort').reset_index(drop=True)
+        a_times = anomalies['ds'].values
+
+        series_dir = Path(out_dir) / series
+        series_dir.mkdir(parents=True, exist_ok=True)
+        files = []
+        with metrics.stage('plot', rows=len(anomalies), detector='report'):
+            for w_start, w_end, s, e in anomaly_windows(a_times, half_window):
+                lo = np.searchsorted(times, w_start, side='left')
+                hi = np.searchsorted(times, w_end, side='right')
+                _axes.cla()
+                _axes.plot(times[lo:hi], values[lo:hi], color='steelblue', linewidth=1, label='Count')
+                window = anomalies.iloc[s:e]
+                for detector, group in window.groupby('detector', sort=False):
+                    if detector == 'changepoint':
+                        for t in group['ds'].values:
+                            _axes.axvline(t, color='red', linestyle='--', alpha=0.7)
+                    else:
+                        pos = np.clip(np.searchsorted(times, group['ds'].values), 0, len(times) - 1)
+                        _axes.scatter(group['ds'].values, values[pos], color='red', s=18, zorder=5,
+                                      label=f'{detector} 异常')
+                first = pd.Timestamp(a_times[s])
+                _axes.set_title(f'{series}  {first:%Y-%m-%d %H:%M}（{e - s} 个异常）')
+                _axes.legend(loc='upper left')
+                _figure.autofmt_xdate()
+                _figure.tight_layout()
+                file = series_dir / f'{series}_{first:%Y%m%d_%H%M}.{fmt}'
+                _figure.savefig(file, format=fmt)
+                files.append(str(file))
+        return series, files, time.perf_counter() - start, None
+    except Exception as e:
+        return series, [], time.perf_counter() - start, f"{type(e).__name__}: {e}"
+
+
+def read_anomalies(path):
+    path = Path(path)
+    df = pd.read_parquet(path) if path.suffix == '.parquet' else pd.read_csv(path)
+    df['ds'] = pd.to_datetime(df['ds'])
+    return df
+
+
+def write_index(out_dir, results):
+    """生成 index.html，按业务列出所有窗口图"""
+    out_dir = Path(out_dir)
+    parts = ['<html><head><meta charset="utf-8"><title>异常报告</title></head><body>',
+             f'<h1>异常报告（{pd.Timestamp.now():%Y-%m-%d %H:%M}）</h1>']
+    for series, files in sorted(results.items()):
+        parts.append(f'<h2>{html.escape(series)}（{len(files)} 张）</h2>')
+        for file in files:
+            rel = Path(file).relative_to(out_dir).as_posix()
+            parts.append(f'<img src="{html.escape(rel)}" style="max-width:100%"><br>')
+    parts.append('</body></html>')
+    index = out_dir / 'index.html'
+    index.write_text('\n'.join(parts), encoding='utf-8')
+    return index
+
+
+def build_report(anomalies, data_path="data", out_dir="report", workers=None, half_window='6h', fmt='png'):
+    """
+    为所有业务并行渲染异常窗口图
+
+    参数:
+    anomalies: pipeline 输出的异常 DataFrame（series、detector、ds、value、score）
+    half_window: 每个异常前后保留的时长
+    fmt: 'png' 或 'svg'
+
+    返回:
+    {业务名: 图片路径列表}
+    """
+    paths = {p.parent.name: p for p in find_series(data_path)}
+    groups = {series: group for series, group in anomalies.groupby('series') if series in paths}
+    missing = set(anomalies['series']) - set(groups)
+    if missing:
+        print(f"找不到以下业务的数据文件，跳过: {sorted(missing)}")
+    if not groups:
+        print("没有需要渲染的异常")
+        return {}
+
+    workers = workers or os.cpu_count() or 1
+    start = time.perf_counter()
+    results = {}
+    with ProcessPoolExecutor(max_workers=min(workers, len(groups)), initializer=_init_worker) as pool:
+        futures = [pool.submit(render_series, series, str(paths[series]), group, out_dir, half_window, fmt)
+                   for series, group in groups.items()]
+        for i, future in enumerate(as_completed(futures), 1):
+            series, files, seconds, error = future.result()
+            status = f"出错: {error}" if error else f"{len(files)} 张图"
+            print(f"[{i}/{len(groups)}] {series}: {status}，耗时 {seconds:.2f} 秒")
+            results[series] = files
+
+    index = write_index(out_dir, results)
+    total = sum(len(files) for files in results.values())
+    print(f"报告完成，共 {total} 张图，总耗时 {time.perf_counter() - start:.2f} 秒：{index}")
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="批量生成异常窗口图报告（无界面）")
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument('--anomalies', help="pipeline.py 输出的异常文件（.csv 或 .parquet）")
+    source.add_argument('--detector', choices=list(DETECTORS), help="先运行该检测器再生成报告")
+    parser.add_argument('--data', default='data', help="数据根目录")
+    parser.add_argument('--output', default='report', help="报告目录")
+    parser.add_argument('--workers', type=int, default=None, help="并行进程数，默认CPU核数")
+    parser.add_argument('--window', default='6h', help="每个异常前后保留的时长，例如 6h、1D")
+    parser.add_argument('--format', default='png', choices=['png', 'svg'])
+    parser.add_argument('--param', action='append', metavar='KEY=VALUE', help="检测器参数，可重复")
+    args = parser.parse_args()
+
+    if args.detector:
+        anomalies, _ = run_batch(args.detector, args.data, os.path.join(args.output, 'anomalies.csv'),
+                                 args.workers, parse_params(args.param))
+    else:
+        anomalies = read_anomalies(args.anomalies)
+    build_report(anomalies, args.data, args.output, args.workers, args.window, args.format)
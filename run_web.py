@@ -1,15 +1,16 @@
 import subprocess
 import sys
+import importlib.util
 
 def install_requirements():
     """安装必要的包"""
-    packages = ['streamlit', 'pandas', 'matplotlib', 'seaborn', 'numpy','plotly']
+    packages = ['streamlit', 'pandas', 'numpy', 'plotly']
     
     for package in packages:
-        try:
-            __import__(package)
+        # 只查找模块是否存在，不实际导入
+        if importlib.util.find_spec(package) is not None:
             print(f"✓ {package} 已安装")
-        except ImportError:
+        else:
             print(f"正在安装 {package}...")
             subprocess.check_call([sys.executable, '-m', 'pip', 'install', package])
 
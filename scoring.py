@@ -0,0 +1,79 @@
+import numpy as np
+import pandas as pd
+
+
+def residual_arrays(y, yhat, yhat_lower, yhat_upper):
+    """
+    批量计算区间误差和偏离比
+
+    参数:
+    y: 实际值（可含 NaN）
+    yhat, yhat_lower, yhat_upper: Prophet 预测值及区间上下界
+
+    返回:
+    (error, deviation_ratio) 两个 float64 数组；落在区间内或实际值缺失时均为 0
+    """
+    y = np.asarray(y, dtype=float)
+    yhat = np.asarray(yhat, dtype=float)
+    lower = np.asarray(yhat_lower, dtype=float)
+    upper = np.asarray(yhat_upper, dtype=float)
+
+    # NaN 参与比较结果为 False，因此需要单独标记
+    outside = ~np.isnan(y) & ~((lower <= y) & (y <= upper))
+
+    error = np.zeros(len(y))
+    error[outside] = np.minimum(np.abs(y[outside] - lower[outside]), np.abs(y[outside] - upper[outside]))
+
+    ratio = np.zeros(len(y))
+    ratio[outside] = np.abs(y[outside] - yhat[outside]) / (upper[outside] - lower[outside] + 1e-9)
+
+    return error, ratio
+
+
+def add_residual_columns(df, y_col='norm_y'):
+    """在预测结果表上一次性添加 error 和 deviation_ratio 两列"""
+    error, ratio = residual_arrays(df[y_col].values, df['yhat'].values,
+                                   df['yhat_lower'].values, df['yhat_upper'].values)
+    df['error'] = error
+    df['deviation_ratio'] = ratio
+    return df
+
+
+def zscore_threshold(error, z_thresh=9):
+    # 与 pandas 的 mean/std 保持一致：忽略 NaN，样本标准差
+    return np.nanmean(error) + z_thresh * np.nanstd(error, ddof=1)
+
+
+def iqr_threshold(error, iqr_factor=1.5):
+    q1, q3 = np.nanquantile(error, [0.25, 0.75])
+    return q3 + iqr_factor * (q3 - q1)
+
+
+def outlier_mask(values, method='zscore', z_thresh=9, iqr_factor=1.5, ratio_thresh=2.0):
+    """
+    根据检测方法返回异常点布尔掩码
+
+    参数:
+    values: zscore/iqr 方法传入 error 数组，deviation_ratio 方法传入偏离比数组
+    """
+    values = np.asarray(values, dtype=float)
+    if method == 'zscore':
+        return values > zscore_threshold(values, z_thresh)
+    if method == 'iqr':
+        return values > iqr_threshold(values, iqr_factor)
+    if method == 'deviation_ratio':
+        return values > ratio_thresh
+    raise ValueError("method 参数必须是 'zscore'、'iqr' 或 'deviation_ratio'")
+
+
+def detect_outliers(df, method='zscore', z_thresh=9, iqr_factor=1.5, ratio_thresh=2.0):
+    """与原 detect_outliers 行为一致的向量化版本，返回异常行"""
+    if method == 'deviation_ratio':
+        if 'deviation_ratio' not in df.columns:
+            _, df['deviation_ratio'] = residual_arrays(df['norm_y'].values, df['yhat'].values,
+                                                       df['yhat_lower'].values, df['yhat_upper'].values)
+        values = df['deviation_ratio'].values
+    else:
+        values = df['error'].values
+    mask = outlier_mask(values, method, z_thresh=z_thresh, iqr_factor=iqr_factor, ratio_thresh=ratio_thresh)
+    return df[mask]
@@ -0,0 +1,186 @@
+import argparse
+import numpy as np
+import pandas as pd
+from changepoint_online import Focus, Poisson
+from scoring import residual_arrays
+
+
+def _counts_above(values, thresholds, labels=None):
+    """
+    一次排序后用二分查找统计每个阈值之上的点数
+
+    labels 为布尔标注数组时，同时返回每个阈值下命中的真实异常数（true positive）
+    """
+    values = np.asarray(values, dtype=float)
+    thresholds = np.asarray(thresholds, dtype=float)
+    order = np.argsort(values, kind='stable')
+    sorted_values = values[order]
+    idx = np.searchsorted(sorted_values, thresholds, side='right')
+    above = len(values) - idx
+    if labels is None:
+        return above, None
+    sorted_labels = np.asarray(labels, dtype=bool)[order]
+    prefix = np.r_[0, np.cumsum(sorted_labels)]
+    true_pos = prefix[-1] - prefix[idx]
+    return above, true_pos
+
+
+def _with_metrics(table, labels):
+    if labels is None:
+        return table
+    positives = int(np.sum(labels))
+    table['precision'] = np.where(table['n_outliers'] > 0, table['true_pos'] / table['n_outliers'].clip(lower=1), np.nan)
+    table['recall'] = table['true_pos'] / positives if positives else np.nan
+    table['f1'] = 2 * table['precision'] * table['recall'] / (table['precision'] + table['recall'])
+    return table
+
+
+def sweep_outlier_thresholds(error, ratio, z_grid=(3, 5, 7, 9, 11), iqr_grid=(1.5, 3.0, 5.0),
+                             ratio_grid=(1.0, 1.5, 2.0, 3.0), labels=None):
+    """
+    在已算好的残差数组上评估 detect_outliers 三种方法的整组阈值
+
+    参数:
+    error, ratio: residual_arrays 返回的区间误差和偏离比
+    z_grid, iqr_grid, ratio_grid: 各方法的候选参数（z_thresh、iqr_factor、ratio_thresh）
+    labels: 可选的真实异常布尔数组，提供时另算 precision/recall/f1
+
+    返回:
+    DataFrame：method、param、threshold、n_outliers（及 true_pos/precision/recall/f1）
+    """
+    error = np.asarray(error, dtype=float)
+    mean, std = np.nanmean(error), np.nanstd(error, ddof=1)
+    q1, q3 = np.nanquantile(error, [0.25, 0.75])
+
+    tables = []
+    for method, grid, values, thresholds in [
+        ('zscore', z_grid, error, mean + np.asarray(z_grid, dtype=float) * std),
+        ('iqr', iqr_grid, error, q3 + np.asarray(iqr_grid, dtype=float) * (q3 - q1)),
+        ('deviation_ratio', ratio_grid, ratio, np.asarray(ratio_grid, dtype=float)),
+    ]:
+        if len(grid) == 0:
+            continue
+        above, true_pos = _counts_above(values, thresholds, labels)
+        table = pd.DataFrame({'method': method, 'param': np.asarray(grid, dtype=float),
+                              'threshold': thresholds, 'n_outliers': above})
+        if true_pos is not None:
+            table['true_pos'] = true_pos
+        tables.append(table)
+    return _with_metrics(pd.concat(tables, ignore_index=True), labels)
+
+
+class ChangepointSweep:
+    """
+    FOCUS 阈值扫描
+
+    报警后检测器会重置，所以统计量曲线依赖阈值本身，无法只算一条曲线。
+    这里按重置位置缓存各段的统计量曲线：每段只计算到超过网格中最大阈值为止，
+    网格中任意阈值在该段内的首次越界位置都可以在缓存数组上直接查找。
+    不同阈值落在相同重置位置时共享同一段计算。
+    """
+
+    def __init__(self, values):
+        self.values = np.asarray(values, dtype=float).tolist()
+        self._segments = {}
+        self.points_computed = 0
+
+    def segment(self, start, stop_at):
+        """从 start 开始（新检测器）的统计量曲线，超过 stop_at 的第一个点后停止"""
+        cached = self._segments.get(start)
+        if cached is not None and (cached[1] >= stop_at or start + len(cached[0]) >= len(self.values)):
+            return cached[0]
+        detector = Focus(Poisson())
+        stats = []
+        for y in self.values[start:]:
+            detector.update(y)
+            stat = detector.statistic()
+            stats.append(stat)
+            if stat >= stop_at:
+                break
+        self.points_computed += len(stats)
+        stats = np.array(stats)
+        self._segments[start] = (stats, stop_at)
+        return stats
+
+    def alarms(self, threshold, stop_at=None):
+        """返回给定阈值下的报警位置和统计量，与 realtime_changepoint_detection 的结果一致"""
+        stop_at = threshold if stop_at is None else stop_at
+        positions, stats = [], []
+        start, n = 0, len(self.values)
+        while start < n:
+            seg = self.segment(start, stop_at)
+            hits = np.flatnonzero(seg >= threshold)
+            if len(hits) == 0:
+                break
+            positions.append(start + hits[0])
+            stats.append(seg[hits[0]])
+            start = start + hits[0] + 1
+        return np.array(positions, dtype=np.int64), np.array(stats)
+
+    def evaluate(self, thresholds, labels=None, tolerance=288):
+        """
+        评估整组阈值
+
+        参数:
+        labels: 可选的真实变点位置（行号）数组；报警在真实变点之后 tolerance 个点内视为命中
+
+        返回:
+        DataFrame：threshold、n_alarms（及 true_pos/precision/recall/f1）
+        """
+        thresholds = np.sort(np.asarray(thresholds, dtype=float))[::-1]
+        stop_at = thresholds[0]
+        rows = []
+        for threshold in thresholds:
+            positions, _ = self.alarms(threshold, stop_at)
+            row = {'threshold': threshold, 'n_alarms': len(positions)}
+            if labels is not None:
+                labels = np.sort(np.asarray(labels, dtype=np.int64))
+                # 每个报警找最近的、不晚于它的真实变点
+                idx = np.searchsorted(labels, positions, side='right') - 1
+                matched = (idx >= 0) & (positions - labels[np.maximum(idx, 0)] <= tolerance)
+                found = np.unique(idx[matched])
+                row['true_pos'] = int(matched.sum())
+                row['precision'] = matched.mean() if len(positions) else np.nan
+                row['recall'] = len(found) / len(labels) if len(labels) else np.nan
+            rows.append(row)
+        table = pd.DataFrame(rows).sort_values('threshold').reset_index(drop=True)
+        if labels is not None:
+            table['f1'] = 2 * table['precision'] * table['recall'] / (table['precision'] + table['recall'])
+        return table
+
+
+def sweep_series(path, cp_thresholds=(5, 8, 10, 13, 16, 20), model_dir='models', **outlier_grids):
+    """
+    对单个业务做一次完整扫描：变点阈值网格 + Prophet 异常检测参数网格
+
+    预测和残差只计算一次（模型与预测结果由模型注册表缓存）。
+    """
+    from changepoint_demo import load_and_preprocess
+    from pystan_demo import forecast_and_score
+
+    df = load_and_preprocess(path)
+    cp_table = ChangepointSweep(df['norm_y'].values).evaluate(cp_thresholds)
+
+    _, _, merged = forecast_and_score(path, model_dir)
+    error, ratio = residual_arrays(merged['norm_y'].values, merged['yhat'].values,
+                                   merged['yhat_lower'].values, merged['yhat_upper'].values)
+    outlier_table = sweep_outlier_thresholds(error, ratio, **outlier_grids)
+    return cp_table, outlier_table
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="变点阈值与 Prophet 异常检测参数扫描")
+    parser.add_argument('path', help="合并后的CSV文件")
+    parser.add_argument('--cp-thresholds', type=float, nargs='+', default=[5, 8, 10, 13, 16, 20])
+    parser.add_argument('--z', type=float, nargs='+', default=[3, 5, 7, 9, 11])
+    parser.add_argument('--iqr', type=float, nargs='+', default=[1.5, 3.0, 5.0])
+    parser.add_argument('--ratio', type=float, nargs='+', default=[1.0, 1.5, 2.0, 3.0])
+    parser.add_argument('--model-dir', default='models')
+    args = parser.parse_args()
+
+    cp_table, outlier_table = sweep_series(args.path, args.cp_thresholds, args.model_dir,
+                                           z_grid=args.z, iqr_grid=args.iqr, ratio_grid=args.ratio)
+    print("变点阈值扫描:")
+    print(cp_table.to_string(index=False))
+    print("\nProphet 异常检测参数扫描:")
+    print(outlier_table.to_string(index=False))
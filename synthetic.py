@@ -0,0 +1,99 @@
+import argparse
+from pathlib import Path
+import numpy as np
+import pandas as pd
+
+POINTS_PER_DAY = 288
+
+
+def generate_series(n_rows, start='2022-01-01', freq='5min', seed=0, base=200.0, daily_amp=0.6,
+                    weekly_amp=0.2, spike_rate=1e-3, n_shifts=3, gap_rate=1e-3, gap_length=36):
+    """
+    生成一条 5 分钟粒度的合成计数序列
+
+    包含日/周季节性、泊松噪声、随机突增、若干水平漂移，以及整段缺失的采集间隔（行被删除，
+    与真实数据中缺失的采集文件一致）。
+
+    参数:
+    n_rows: 删除缺失段之前的网格点数
+    spike_rate: 每个点出现突增的概率
+    n_shifts: 水平漂移次数
+    gap_rate: 每个点开始一段缺失的概率，每段缺失 gap_length 个点
+
+    返回:
+    (df, truth) df 含 Time、Count 列；truth 为真实突增/漂移时间的字典
+    """
+    rng = np.random.default_rng(seed)
+    t = np.arange(n_rows)
+    day = 2 * np.pi * t / POINTS_PER_DAY
+    week = 2 * np.pi * t / (POINTS_PER_DAY * 7)
+    level = base * (1 + daily_amp * np.sin(day - np.pi / 2) + weekly_amp * np.sin(week))
+    level = np.clip(level, 1.0, None)
+
+    shifts = np.sort(rng.choice(n_rows, size=min(n_shifts, n_rows), replace=False))
+    factors = rng.uniform(0.4, 2.5, size=len(shifts))
+    multiplier = np.ones(n_rows)
+    for pos, factor in zip(shifts, factors):
+        multiplier[pos:] *= factor
+    counts = rng.poisson(level * multiplier).astype(np.int64)
+
+    spikes = np.flatnonzero(rng.random(n_rows) < spike_rate)
+    counts[spikes] += (level[spikes] * rng.uniform(2, 6, size=len(spikes))).astype(np.int64)
+
+    keep = np.ones(n_rows, dtype=bool)
+    for pos in np.flatnonzero(rng.random(n_rows) < gap_rate):
+        keep[pos:pos + gap_length] = False
+
+    times = pd.date_range(start, periods=n_rows, freq=freq)
+    df = pd.DataFrame({'Time': times[keep], 'Count': counts[keep]})
+    truth = {'spikes': times[spikes[keep[spikes]]], 'shifts': times[shifts]}
+    return df, truth
+
+
+def write_source_files(df, folder, n_files=10):
+    """把序列按时间切成 n_files 个源CSV文件写入 folder，模拟待合并的采集文件"""
+    folder = Path(folder)
+    folder.mkdir(parents=True, exist_ok=True)
+    width = len(str(n_files))
+    for i, chunk in enumerate(np.array_split(np.arange(len(df)), n_files)):
+        if len(chunk) == 0:
+            continue
+        part = df.iloc[chunk[0]:chunk[-1] + 1]
+        part.to_csv(folder / f'{folder.name}_{i:0{width}d}.csv', index=False, date_format='%Y-%m-%d %H:%M:%S')
+    return folder
+
+
+def generate_dataset(root, n_series=1, n_rows=100_000, n_files=10, seed=0, merged=True):
+    """
+    在 root 下生成 n_series 个业务文件夹（data/<业务>/ 结构）
+
+    参数:
+    merged: 为True时同时写出 <业务>_merged.csv，可直接用于检测器；否则只写源文件
+
+    返回:
+    {业务名: truth} 字典
+    """
+    root = Path(root)
+    truths = {}
+    for k in range(n_series):
+        name = f'{k + 1}.synthetic'
+        df, truth = generate_series(n_rows, seed=seed + k, base=50.0 * (k % 10 + 1))
+        folder = write_source_files(df, root / name, n_files)
+        if merged:
+            df.to_csv(folder / f'{name}_merged.csv', index=False, date_format='%Y-%m-%d %H:%M:%S')
+        truths[name] = truth
+    return truths
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="生成 5 分钟粒度的合成业务数据")
+    parser.add_argument('root', help="输出根目录，例如 data_synthetic")
+    parser.add_argument('--series', type=int, default=1, help="业务数量")
+    parser.add_argument('--rows', type=int, default=365 * POINTS_PER_DAY, help="每个业务的行数")
+    parser.add_argument('--files', type=int, default=10, help="每个业务切分成的源文件数")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--no-merged', action='store_true', help="只写源文件，不写 *_merged.csv")
+    args = parser.parse_args()
+
+    generate_dataset(args.root, args.series, args.rows, args.files, args.seed, merged=not args.no_merged)
+    print(f"已在 {args.root} 下生成 {args.series} 个业务，每个 {args.rows} 行")
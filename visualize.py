@@ -1,37 +1,47 @@
 import pandas as pd
-import matplotlib.pyplot as plt
-import seaborn as sns
 from pathlib import Path
 import numpy as np
-from datetime import datetime
 import warnings
 import streamlit as st
-import matplotlib.font_manager as fm
 import re
-import plotly.express as px
-import plotly.graph_objects as go
-from plotly.subplots import make_subplots
+import os
+from loader import load_merged, scan_merged_files
+from memory_cache import LRUCache
+from downsample import downsample
+from aligned import load_aligned, FLAGS
+import metrics
 warnings.filterwarnings('ignore')
 
-# 设置中文字体
-plt.rcParams['font.sans-serif'] = ['SimHei', 'Microsoft YaHei', 'DejaVu Sans']
-plt.rcParams['axes.unicode_minus'] = False
-
 def extract_number_from_filename(filename):
     match = re.match(r'^(\d+)', filename)
     if match:
         return int(match.group(1))
     return 0
 
-def create_time_series_plot(df, time_col, numeric_cols, title):
+def create_time_series_plot(df, time_col, numeric_cols, title, max_points=None, method='minmax'):
     if not time_col or len(df) <= 1 or len(numeric_cols) == 0:
         return None
+    with metrics.stage('plot', rows=len(df) * len(numeric_cols), detector='visualize'):
+        return _time_series_figure(df, time_col, numeric_cols, title, max_points, method)
+
+
+def _time_series_figure(df, time_col, numeric_cols, title, max_points, method):
+    import plotly.graph_objects as go
+
     fig = go.Figure()
+    x = df[time_col].values
     for col in numeric_cols:
+        y = df[col].values
+        # 点数超出预算时先在服务端降采样，保留每个桶内的尖峰
+        sampled = max_points is not None and len(y) > max_points
+        if sampled:
+            xs, ys = downsample(x, y, max_points, method)
+        else:
+            xs, ys = x, y
         fig.add_trace(go.Scatter(
-            x=df[time_col],
-            y=df[col],
-            mode='lines+markers',
+            x=xs,
+            y=ys,
+            mode='lines' if sampled else 'lines+markers',
             name=col,
             line=dict(width=2),
             marker=dict(size=4),
@@ -50,6 +60,8 @@ def create_time_series_plot(df, time_col, numeric_cols, title):
 def create_box_plot(df, numeric_cols, title):
     if len(numeric_cols) == 0:
         return None
+    import plotly.graph_objects as go
+
     fig = go.Figure()
     for col in numeric_cols[:5]:
         fig.add_trace(go.Box(
@@ -66,24 +78,228 @@ def create_box_plot(df, numeric_cols, title):
     return fig
 
 def get_available_files(data_path="data"):
-    data_path = Path(data_path)
-    merged_files = list(data_path.glob("*/*_merged.csv"))
+    # 从磁盘元数据索引读取行数/列数，只有变化过的文件才会重新统计
     file_info = []
-    for file in merged_files:
-        try:
-            df = pd.read_csv(file, encoding='utf-8-sig')
-            file_info.append({
-                'path': file,
-                'name': file.parent.name,
-                'rows': len(df),
-                'columns': len(df.columns),
-                'sort_key': extract_number_from_filename(file.parent.name)
-            })
-        except Exception as e:
-            print(f"读取 {file} 时出错: {e}")
+    for meta in scan_merged_files(data_path):
+        file = Path(meta['path'])
+        file_info.append({
+            'path': file,
+            'name': file.parent.name,
+            'rows': meta['rows'],
+            'columns': meta['columns'],
+            'size': meta['size'],
+            'mtime_ns': meta['mtime_ns'],
+            'time_min': meta['time_min'],
+            'time_max': meta['time_max'],
+            'sort_key': extract_number_from_filename(file.parent.name)
+        })
     file_info.sort(key=lambda x: x['sort_key'])
     return file_info
 
+# 数据与图表缓存的内存上限（MB），所有会话共享
+CACHE_MAX_MB = int(os.environ.get('VISUALIZE_CACHE_MB', '512'))
+
+
+@st.cache_resource
+def get_cache():
+    return LRUCache(max_bytes=CACHE_MAX_MB * 1024 * 1024)
+
+
+def file_fingerprint(info):
+    return (str(info['path']), info['size'], info['mtime_ns'])
+
+
+def load_frame(cache, fp, path):
+    """读取并解析数据文件，返回 (df, 时间列, 数值列)，按文件指纹缓存"""
+    def _load():
+        df = load_merged(path)
+        time_col = None
+        for col in df.columns:
+            if 'time' in col.lower() or 'date' in col.lower():
+                time_col = col
+                break
+        if time_col:
+            df[time_col] = pd.to_datetime(df[time_col])
+            df = df.sort_values(time_col, kind='mergesort').reset_index(drop=True)
+        numeric_cols = list(df.select_dtypes(include=[np.number]).columns)
+        return df, time_col, numeric_cols
+    return cache.get_or_compute(('frame', fp), _load)
+
+
+def slice_time_range(df, time_col, start, end):
+    """截取 [start, end) 时间范围（时间列已排序，用二分查找代替逐行比较）"""
+    times = df[time_col].values
+    lo = np.searchsorted(times, np.datetime64(start), side='left')
+    hi = np.searchsorted(times, np.datetime64(end), side='left')
+    return df.iloc[lo:hi]
+
+
+def filter_by_date(cache, fp, df, time_col, start_date, end_date):
+    """按日期范围截取数据，包含结束日期当天"""
+    return cache.get_or_compute(
+        ('slice', fp, start_date, end_date),
+        lambda: slice_time_range(df, time_col, start_date, np.datetime64(end_date) + np.timedelta64(1, 'D'))
+    )
+
+
+def column_stats(cache, fp, df, numeric_cols):
+    """一次性计算所有数值列的统计量及 IQR 异常值个数"""
+    def _stats():
+        values = df[numeric_cols]
+        q1 = values.quantile(0.25)
+        q3 = values.quantile(0.75)
+        iqr = q3 - q1
+        outliers = ((values < q1 - 1.5 * iqr) | (values > q3 + 1.5 * iqr)).sum()
+        return {
+            'mean': values.mean(),
+            'std': values.std(),
+            'min': values.min(),
+            'max': values.max(),
+            'missing': values.isnull().sum(),
+            'outliers': outliers,
+            'total_missing': int(df.isnull().sum().sum()),
+        }
+    return cache.get_or_compute(('stats', fp), _stats)
+
+
+def create_histogram(df, col, bins):
+    import plotly.graph_objects as go
+
+    fig = go.Figure(data=[go.Histogram(
+        x=df[col].dropna(),
+        nbinsx=bins,
+        name=col,
+        hovertemplate=f'<b>{col}</b><br>区间: %{{x}}<br>频次: %{{y}}<extra></extra>'
+    )])
+    fig.update_layout(
+        title=f'{col} 分布直方图',
+        xaxis_title=col,
+        yaxis_title='频次',
+        height=500
+    )
+    return fig
+
+def create_heatmap(matrix, title, colorscale='Blues', zmid=None):
+    import plotly.graph_objects as go
+
+    fig = go.Figure(data=[go.Heatmap(
+        z=matrix.values,
+        x=list(matrix.columns),
+        y=list(matrix.index),
+        colorscale=colorscale,
+        zmid=zmid,
+        hovertemplate='%{y} / %{x}: %{z}<extra></extra>'
+    )])
+    fig.update_layout(title=title, height=max(400, 22 * len(matrix) + 150), yaxis=dict(autorange='reversed'))
+    return fig
+
+
+def create_aligned_plot(times, values, flags, names, title, max_points):
+    """多业务叠加趋势图：各业务在所选时间段内按最小/最大值缩放到 [0, 1]，异常点用标记显示"""
+    import plotly.graph_objects as go
+
+    values = np.asarray(values, dtype=np.float64)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        low = np.nanmin(values, axis=0)
+        span = np.nanmax(values, axis=0) - low
+        scaled = (values - low) / np.where(span > 0, span, 1.0)
+    df = pd.DataFrame(scaled, columns=names)
+    df.insert(0, '时间', times)
+    fig = _time_series_figure(df, '时间', names, title, max_points, 'minmax')
+    for j, name in enumerate(names):
+        rows = np.flatnonzero(np.asarray(flags[:, j]) != 0)
+        fig.add_trace(go.Scatter(
+            x=times[rows], y=scaled[rows, j], mode='markers', name=f'{name} 异常',
+            marker=dict(size=7, symbol='x', color='red'),
+            hovertemplate=f'<b>{name} 异常</b><br>时间: %{{x}}<extra></extra>'
+        ))
+    fig.update_layout(yaxis_title='归一化数值')
+    return fig
+
+
+def cross_series_view(cache, data_path="data"):
+    """跨业务关联：基于 data/_aligned/ 的对齐矩阵查看异常共现和相关性"""
+    st.subheader("🔗 跨业务异常关联")
+    with st.spinner("正在加载对齐矩阵（源文件有变化时会重建）..."):
+        try:
+            matrix = load_aligned(data_path)
+        except (FileNotFoundError, ValueError) as e:
+            st.error(f"❌ {e}")
+            return
+    version = matrix.version
+    first, last = (pd.Timestamp(t) for t in matrix.time_range)
+    st.caption(f"{len(matrix.names)} 个业务 × {len(matrix)} 个时间点（{matrix.freq} 网格），"
+               f"{first:%Y-%m-%d %H:%M} 至 {last:%Y-%m-%d %H:%M}")
+
+    start_date, end_date = st.date_input(
+        "选择日期范围:",
+        value=(first.date(), last.date()),
+        min_value=first.date(),
+        max_value=last.date(),
+        key='aligned_dates'
+    )
+    start, end = np.datetime64(start_date), np.datetime64(end_date) + np.timedelta64(1, 'D')
+    selected = st.multiselect("参与比较的业务:", options=matrix.names, default=matrix.names)
+    if len(selected) < 2:
+        st.warning("⚠️ 请至少选择两个业务")
+        return
+
+    opt1, opt2, opt3, opt4 = st.columns(4)
+    with opt1:
+        default_focus = '9.手机银行' if '9.手机银行' in selected else selected[0]
+        focus = st.selectbox("关注业务:", options=selected, index=selected.index(default_focus))
+    with opt2:
+        tolerance = st.number_input("允许时间差（网格点数）:", min_value=0, max_value=288, value=1)
+    with opt3:
+        flag = st.selectbox("异常类型:", options=[None] + list(FLAGS),
+                            format_func=lambda f: {None: '任意', 'iqr': 'IQR 离群', 'growth': '突增'}[f])
+    with opt4:
+        corr_method = st.selectbox("相关性依据:", options=['diff', 'value'],
+                                   format_func=lambda m: {'diff': '相邻差分', 'value': '原始计数'}[m])
+
+    names = tuple(selected)
+    key = (version, start_date, end_date, names)
+    hits = cache.get_or_compute(('coincident',) + key + (focus, tolerance, flag),
+                                lambda: matrix.coincident(focus, start, end, tolerance, flag, list(names)))
+    n_shared = int((hits['n_others'] > 0).sum())
+    col1, col2, col3 = st.columns(3)
+    with col1:
+        st.metric(f"{focus} 异常点", len(hits))
+    with col2:
+        st.metric("有其他业务同时异常", n_shared)
+    with col3:
+        st.metric("同时异常比例", f"{n_shared / len(hits):.1%}" if len(hits) else "-")
+
+    co = cache.get_or_compute(('cooccurrence',) + key + (tolerance, flag),
+                              lambda: matrix.cooccurrence(start, end, list(names), tolerance, flag))
+    st.plotly_chart(create_heatmap(co, '异常共现次数（行业务的异常点中列业务同时异常的个数）'),
+                    use_container_width=True)
+
+    partners = co.loc[focus].drop(focus).sort_values(ascending=False)
+    partners = partners[partners > 0]
+    if len(partners):
+        st.markdown(f"**与 {focus} 同时异常最多的业务**")
+        st.dataframe(pd.DataFrame({'共现次数': partners, f'占 {focus} 异常比例': (partners / max(len(hits), 1)).round(3)}))
+        st.markdown(f"**{focus} 与其他业务同时异常的时间点**")
+        st.dataframe(hits[hits['n_others'] > 0].rename(columns={'ds': '时间', 'value': '数值', 'others': '同时异常的业务',
+                                                                  'n_others': '业务数'}), hide_index=True)
+
+    corr = cache.get_or_compute(('correlation',) + key + (corr_method,),
+                                lambda: matrix.correlation(start, end, list(names), corr_method))
+    st.plotly_chart(create_heatmap(corr.round(3), '业务间相关系数', colorscale='RdBu', zmid=0),
+                    use_container_width=True)
+
+    shown = [focus] + [name for name in partners.index[:4]]
+    max_points = st.number_input("每条曲线最多点数:", min_value=500, max_value=50000, value=2000, step=500,
+                                 key='aligned_max_points')
+    fig = cache.get_or_compute(
+        ('aligned_fig',) + key + (tuple(shown), max_points),
+        lambda: create_aligned_plot(*matrix.window(start, end, shown), shown,
+                                    f'{focus} 与同时异常最多的业务', max_points)
+    )
+    st.plotly_chart(fig, use_container_width=True)
+
+
 def main():
     st.set_page_config(page_title="数据可视化分析", layout="wide")
     st.title("📊 数据可视化分析工具")
@@ -92,6 +308,11 @@ def main():
     if "analyze_clicked" not in st.session_state:
         st.session_state.analyze_clicked = False
 
+    view = st.sidebar.radio("视图", options=["单个业务", "跨业务关联"])
+    if view == "跨业务关联":
+        cross_series_view(get_cache())
+        return
+
     available_files = get_available_files()
     if not available_files:
         st.error("❌ 未找到任何merged.csv文件")
@@ -114,7 +335,9 @@ def main():
         with col2:
             st.metric("数据列数", selected_file['columns'])
         with col3:
-            st.metric("文件大小", f"{selected_file['path'].stat().st_size // 1024}KB")
+            st.metric("文件大小", f"{selected_file['size'] // 1024}KB")
+        if selected_file['time_min']:
+            st.caption(f"时间范围: {selected_file['time_min']} 至 {selected_file['time_max']}")
 
         # 🔍 分析按钮逻辑
         if st.button("🔍 开始分析", type="primary"):
@@ -124,45 +347,64 @@ def main():
         if st.session_state.analyze_clicked:
             with st.spinner("正在读取数据..."):
                 try:
-                    df = pd.read_csv(selected_file['path'], encoding='utf-8-sig')
-
-                    time_col = None
-                    for col in df.columns:
-                        if 'time' in col.lower() or 'date' in col.lower():
-                            time_col = col
-                            break
-
-                    if time_col:
-                        df[time_col] = pd.to_datetime(df[time_col])
-                        df = df.sort_values(time_col)
-
-                    numeric_cols = df.select_dtypes(include=[np.number]).columns
+                    cache = get_cache()
+                    fp = file_fingerprint(selected_file)
+                    df, time_col, numeric_cols = load_frame(cache, fp, selected_file['path'])
+                    stats = column_stats(cache, fp, df, numeric_cols) if numeric_cols else None
 
                     tab1, tab2, tab3, tab4 = st.tabs(["📈 时间序列", "📊 分布图", "📦 箱线图", "📋 数据统计"])
 
                     with tab1:
                         st.subheader("📈 时间序列分析")
                         if time_col and len(df) > 1 and len(numeric_cols) > 0:
-                            min_date = df[time_col].min().date()
-                            max_date = df[time_col].max().date()
+                            min_date = df[time_col].iloc[0].date()
+                            max_date = df[time_col].iloc[-1].date()
                             start_date, end_date = st.date_input(
                                 "选择日期范围:",
                                 value=(min_date, max_date),
                                 min_value=min_date,
                                 max_value=max_date
                             )
-                            mask = (df[time_col].dt.date >= start_date) & (df[time_col].dt.date <= end_date)
-                            df_filtered = df.loc[mask]
+                            df_filtered = filter_by_date(cache, fp, df, time_col, start_date, end_date)
                             selected_cols = st.multiselect(
                                 "选择要显示的数值列:",
-                                options=list(numeric_cols),
-                                default=list(numeric_cols[:3]),
+                                options=numeric_cols,
+                                default=numeric_cols[:3],
                                 max_selections=5
                             )
+                            opt1, opt2 = st.columns(2)
+                            with opt1:
+                                max_points = st.number_input("每条曲线最多点数:", min_value=500, max_value=50000,
+                                                             value=2000, step=500)
+                            with opt2:
+                                ds_method = st.selectbox("降采样方法:", options=['minmax', 'lttb'],
+                                                         format_func=lambda m: {'minmax': '分桶最小/最大值', 'lttb': 'LTTB'}[m])
                             if selected_cols and not df_filtered.empty:
-                                fig = create_time_series_plot(df_filtered, time_col, selected_cols, selected_name)
+                                # 缩放后只对可见范围重新查询，范围足够小时即为全分辨率
+                                view_start = df_filtered[time_col].iloc[0].to_pydatetime()
+                                view_end = df_filtered[time_col].iloc[-1].to_pydatetime()
+                                if view_end > view_start:
+                                    view_start, view_end = st.slider(
+                                        "缩放时间范围:",
+                                        min_value=view_start,
+                                        max_value=view_end,
+                                        value=(view_start, view_end),
+                                        format="YYYY-MM-DD HH:mm"
+                                    )
+                                df_view = cache.get_or_compute(
+                                    ('view', fp, start_date, end_date, view_start, view_end),
+                                    lambda: slice_time_range(df_filtered, time_col, view_start,
+                                                             np.datetime64(view_end) + np.timedelta64(1, 'ns'))
+                                )
+                                fig = cache.get_or_compute(
+                                    ('ts_fig', fp, view_start, view_end, tuple(selected_cols), max_points, ds_method),
+                                    lambda: create_time_series_plot(df_view, time_col, selected_cols, selected_name,
+                                                                    max_points=max_points, method=ds_method)
+                                )
                                 st.plotly_chart(fig, use_container_width=True)
-                                st.info(f"📅 筛选时间范围: {df_filtered[time_col].min().strftime('%Y-%m-%d')} 至 {df_filtered[time_col].max().strftime('%Y-%m-%d')}")
+                                if len(df_view) > max_points:
+                                    st.caption(f"可见范围共 {len(df_view)} 点，已降采样至每条曲线约 {max_points} 点；缩小范围可查看全分辨率数据")
+                                st.info(f"📅 筛选时间范围: {df_filtered[time_col].iloc[0].strftime('%Y-%m-%d')} 至 {df_filtered[time_col].iloc[-1].strftime('%Y-%m-%d')}")
                             elif df_filtered.empty:
                                 st.warning("❌ 当前筛选时间范围无数据")
                         else:
@@ -173,50 +415,42 @@ def main():
                         if len(numeric_cols) > 0:
                             selected_col = st.selectbox(
                                 "选择要分析的列:",
-                                options=list(numeric_cols),
+                                options=numeric_cols,
                                 index=0
                             )
                             bins = st.slider("直方图分组数:", min_value=10, max_value=50, value=30)
-                            fig = go.Figure(data=[go.Histogram(
-                                x=df[selected_col].dropna(),
-                                nbinsx=bins,
-                                name=selected_col,
-                                hovertemplate=f'<b>{selected_col}</b><br>区间: %{{x}}<br>频次: %{{y}}<extra></extra>'
-                            )])
-                            fig.update_layout(
-                                title=f'{selected_col} 分布直方图',
-                                xaxis_title=selected_col,
-                                yaxis_title='频次',
-                                height=500
+                            fig = cache.get_or_compute(
+                                ('hist_fig', fp, selected_col, bins),
+                                lambda: create_histogram(df, selected_col, bins)
                             )
                             st.plotly_chart(fig, use_container_width=True)
 
                             col1, col2, col3, col4 = st.columns(4)
                             with col1:
-                                st.metric("均值", f"{df[selected_col].mean():.2f}")
+                                st.metric("均值", f"{stats['mean'][selected_col]:.2f}")
                             with col2:
-                                st.metric("标准差", f"{df[selected_col].std():.2f}")
+                                st.metric("标准差", f"{stats['std'][selected_col]:.2f}")
                             with col3:
-                                st.metric("最小值", f"{df[selected_col].min():.2f}")
+                                st.metric("最小值", f"{stats['min'][selected_col]:.2f}")
                             with col4:
-                                st.metric("最大值", f"{df[selected_col].max():.2f}")
+                                st.metric("最大值", f"{stats['max'][selected_col]:.2f}")
                         else:
                             st.warning("⚠️ 没有数值列")
 
                     with tab3:
                         st.subheader("📦 箱线图分析")
                         if len(numeric_cols) > 0:
-                            fig = create_box_plot(df, numeric_cols, selected_name)
+                            fig = cache.get_or_compute(
+                                ('box_fig', fp),
+                                lambda: create_box_plot(df, numeric_cols, selected_name)
+                            )
                             if fig:
                                 st.plotly_chart(fig, use_container_width=True)
                                 st.subheader("⚠️ 异常值检测")
                                 for col in numeric_cols[:3]:
-                                    Q1 = df[col].quantile(0.25)
-                                    Q3 = df[col].quantile(0.75)
-                                    IQR = Q3 - Q1
-                                    outliers = df[(df[col] < Q1 - 1.5 * IQR) | (df[col] > Q3 + 1.5 * IQR)]
-                                    if len(outliers) > 0:
-                                        st.write(f"**{col}**: 发现 {len(outliers)} 个异常值")
+                                    n_outliers = stats['outliers'][col]
+                                    if n_outliers > 0:
+                                        st.write(f"**{col}**: 发现 {n_outliers} 个异常值")
                                     else:
                                         st.write(f"**{col}**: 未发现异常值")
                         else:
@@ -229,19 +463,19 @@ def main():
                             st.markdown("**基本信息**")
                             st.write(f"- 总行数: {len(df)}")
                             st.write(f"- 总列数: {len(df.columns)}")
-                            st.write(f"- 缺失值总数: {df.isnull().sum().sum()}")
+                            st.write(f"- 缺失值总数: {stats['total_missing'] if stats else int(df.isnull().sum().sum())}")
                             if time_col:
-                                st.write(f"- 时间范围: {df[time_col].min().strftime('%Y-%m-%d')} 至 {df[time_col].max().strftime('%Y-%m-%d')}")
+                                st.write(f"- 时间范围: {df[time_col].iloc[0].strftime('%Y-%m-%d')} 至 {df[time_col].iloc[-1].strftime('%Y-%m-%d')}")
                         with col2:
                             st.markdown("**数值列统计**")
                             if len(numeric_cols) > 0:
                                 for col in numeric_cols:
                                     with st.expander(f"📊 {col}"):
-                                        st.write(f"- 均值: {df[col].mean():.2f}")
-                                        st.write(f"- 标准差: {df[col].std():.2f}")
-                                        st.write(f"- 最小值: {df[col].min():.2f}")
-                                        st.write(f"- 最大值: {df[col].max():.2f}")
-                                        st.write(f"- 缺失值: {df[col].isnull().sum()}")
+                                        st.write(f"- 均值: {stats['mean'][col]:.2f}")
+                                        st.write(f"- 标准差: {stats['std'][col]:.2f}")
+                                        st.write(f"- 最小值: {stats['min'][col]:.2f}")
+                                        st.write(f"- 最大值: {stats['max'][col]:.2f}")
+                                        st.write(f"- 缺失值: {stats['missing'][col]}")
                             else:
                                 st.write("无数值列")
                 except Exception as e:
@@ -258,8 +492,15 @@ def main():
     - 📊 分布图: 数值直方图和统计  
     - 📦 箱线图: 异常值检测和分布  
     - 📋 数据统计: 缺失值和基本汇总
+    - 🔗 跨业务关联（侧边栏切换视图）: 所有业务对齐后的异常共现与相关性
     """)
 
+    cache_stats = get_cache().stats()
+    st.sidebar.caption(
+        f"缓存: {cache_stats['items']} 项, {cache_stats['bytes'] // (1024 * 1024)}/{cache_stats['max_bytes'] // (1024 * 1024)}MB, "
+        f"命中 {cache_stats['hits']} / 未命中 {cache_stats['misses']}"
+    )
+
     st.sidebar.subheader("📁 可用文件")
     for info in available_files:
         st.sidebar.write(f"• {info['name']}")
@@ -0,0 +1,300 @@
+import os
+import time
+import pickle
+import argparse
+import threading
+from pathlib import Path
+import numpy as np
+import pandas as pd
+from merge import merge_csvs_in_folder, load_manifest
+from loader import load_arrays, align_to_grid
+from changepoint_demo import StreamingChangepointDetector
+from growth_rate import RollingGrowthScorer
+
+try:
+    from watchdog.observers import Observer
+    from watchdog.events import FileSystemEventHandler
+except ImportError:  # 未安装 watchdog 时退化为轮询
+    Observer = None
+    FileSystemEventHandler = object
+
+ALERT_COLUMNS = ['series', 'detector', 'ds', 'value', 'score', 'alerted_at', 'latency_s']
+
+
+class SeriesState:
+    """
+    单个业务的检测状态，整体 pickle 到 state 目录作为检查点
+
+    包含 FOCUS 变点检测器、滚动突增得分器、已处理到的最后时间戳，
+    以及突增得分的在线均值/方差（Welford），用于 z-score 报警。
+    """
+
+    def __init__(self, threshold=13.0, scale=None, interval_minutes=30, norm_window=288):
+        self.changepoint = StreamingChangepointDetector(threshold=threshold, scale=scale)
+        self.growth = RollingGrowthScorer(interval_minutes=interval_minutes, norm_window=norm_window)
+        self.last_time = None
+        self.score_n = 0
+        self.score_mean = 0.0
+        self.score_m2 = 0.0
+
+    def update_score_stats(self, scores):
+        for x in scores[~np.isnan(scores)].tolist():
+            self.score_n += 1
+            d = x - self.score_mean
+            self.score_mean += d / self.score_n
+            self.score_m2 += d * (x - self.score_mean)
+
+    def score_threshold(self, z_thresh):
+        if self.score_n < 2:
+            return np.inf
+        return self.score_mean + z_thresh * np.sqrt(self.score_m2 / (self.score_n - 1))
+
+
+class FolderEvents(FileSystemEventHandler):
+    """watchdog 事件回调：记录有新文件的业务文件夹并唤醒主循环"""
+
+    def __init__(self, wakeup):
+        self.wakeup = wakeup
+        self.dirty = set()
+        self.lock = threading.Lock()
+
+    def on_any_event(self, event):
+        path = Path(event.src_path)
+        if path.suffix == '.csv' and not path.name.endswith('_merged.csv'):
+            with self.lock:
+                self.dirty.add(path.parent)
+            self.wakeup.set()
+
+    def pop(self):
+        with self.lock:
+            dirty, self.dirty = self.dirty, set()
+        return dirty
+
+
+class Watcher:
+    """
+    监视 data/*/ 下新落地的CSV文件：增量合并新数据，并只把新数据送入有状态的检测器
+
+    参数:
+    data_path: 数据根目录
+    state_dir: 检查点和报警文件目录
+    poll_interval: 轮询间隔（秒）；安装了 watchdog 时新文件落地会立即唤醒
+    threshold: FOCUS 报警阈值
+    z_thresh: 突增得分 z-score 报警阈值
+    warmup_points: 没有检查点时用最近多少个历史点预热检测器（不报警）
+    """
+
+    def __init__(self, data_path="data", state_dir="state", poll_interval=5.0, threshold=13.0,
+                 z_thresh=6.0, warmup_points=288 * 7, freq='5min'):
+        self.data_path = Path(data_path)
+        self.state_dir = Path(state_dir)
+        self.state_dir.mkdir(parents=True, exist_ok=True)
+        self.poll_interval = poll_interval
+        self.threshold = threshold
+        self.z_thresh = z_thresh
+        self.warmup_points = warmup_points
+        self.freq = freq
+        self.states = {}
+        self.folder_mtimes = {}
+        self.alerts_path = self.state_dir / 'alerts.csv'
+        self.wakeup = threading.Event()
+        self.events = None
+
+    # === 检查点 ===
+    def _state_path(self, series):
+        return self.state_dir / f'{series}.pkl'
+
+    def load_state(self, folder):
+        series = folder.name
+        if series in self.states:
+            return self.states[series]
+        path = self._state_path(series)
+        if path.exists():
+            with open(path, 'rb') as fin:
+                state = pickle.load(fin)
+        else:
+            state = self.bootstrap(folder)
+        self.states[series] = state
+        return state
+
+    def save_state(self, series):
+        path = self._state_path(series)
+        tmp_path = path.with_suffix('.tmp')
+        with open(tmp_path, 'wb') as fout:
+            pickle.dump(self.states[series], fout, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, path)
+
+    def bootstrap(self, folder):
+        """没有检查点时，用已合并数据的最后 warmup_points 个点预热检测器，不回放全部历史"""
+        merged_path = folder / f'{folder.name}_merged.csv'
+        if not merged_path.exists():
+            return SeriesState(threshold=self.threshold)
+        arrays = load_arrays(merged_path)
+        counts = np.asarray(arrays['Count'], dtype=float)
+        non_zero = counts[counts > 0]
+        scale = (non_zero.min(), non_zero.max()) if len(non_zero) else None
+        state = SeriesState(threshold=self.threshold, scale=scale)
+        times = np.asarray(arrays['Time'][-self.warmup_points:])
+        values = counts[-self.warmup_points:]
+        if len(times):
+            self._feed(state, times, values)
+            # 预热阶段产生的变点不算报警
+            state.changepoint.changepoints.clear()
+        print(f"{folder.name}: 无检查点，使用最近 {len(times)} 个点预热")
+        return state
+
+    # === 检测 ===
+    def _feed(self, state, times, values):
+        """把新数据送入检测器，返回 (变点列表, 突增报警 DataFrame)"""
+        start = None
+        if state.last_time is not None:
+            start = state.last_time + pd.Timedelta(self.freq).value
+        grid_times, grid_values, _ = align_to_grid(times, values, self.freq, fill='nan', start=start)
+
+        observed = ~np.isnan(grid_values)
+        cps = state.changepoint.update(grid_times[observed], grid_values[observed])
+
+        _, _, scores = state.growth.update_many(grid_values)
+        threshold = state.score_threshold(self.z_thresh)
+        hits = np.flatnonzero(scores > threshold)
+        state.update_score_stats(scores)
+        spikes = pd.DataFrame({'ds': grid_times[hits], 'value': grid_values[hits], 'score': scores[hits]})
+
+        if len(grid_times):
+            state.last_time = int(grid_times[-1].astype('datetime64[ns]').astype('int64'))
+        return cps, spikes
+
+    def process_folder(self, folder):
+        """
+        增量合并一个文件夹，把比检查点更新的数据送入检测器，返回报警 DataFrame
+
+        送入检测器的数据取自合并后的文件（检查点之后的所有行），而不是本次合并新读入的行：
+        合并清单先于检查点写入，若两者之间进程退出，重启后这些行仍会被检测。
+        """
+        try:
+            return self._process_folder(folder)
+        except Exception:
+            # 内存中的状态可能已前进但未保存，丢弃后下次从磁盘检查点重新开始
+            self.states.pop(folder.name, None)
+            raise
+
+    def _process_folder(self, folder):
+        # 先加载（或用合并前的历史预热）状态，再合并新文件
+        state = self.load_state(folder)
+        if merge_csvs_in_folder(folder, incremental=True, verbose=False) is None:
+            return None
+        merged_path = folder / f'{folder.name}_merged.csv'
+        manifest = load_manifest(merged_path)
+        if manifest is None or manifest['rows'] == 0:
+            return None
+        if (state.last_time is not None and manifest['max_time'] is not None
+                and pd.Timestamp(manifest['max_time']).value <= state.last_time):
+            # 合并文件中没有比检查点更新的数据，不必读取
+            return None
+
+        # 合并文件按时间排序，二分查找检查点位置
+        arrays = load_arrays(merged_path)
+        all_times = np.asarray(arrays['Time'])
+        lo = 0 if state.last_time is None else int(np.searchsorted(all_times, state.last_time, side='right'))
+        times = all_times[lo:]
+        values = np.asarray(arrays['Count'][lo:], dtype=float)
+        if len(times) == 0:
+            return None
+
+        if state.last_time is None:
+            # 首次见到该业务：全部作为预热数据，不报警
+            non_zero = values[values > 0]
+            if len(non_zero):
+                state.changepoint.scale = (non_zero.min(), non_zero.max())
+            self._feed(state, times[-self.warmup_points:], values[-self.warmup_points:])
+            state.changepoint.changepoints.clear()
+            self.save_state(folder.name)
+            return None
+
+        cps, spikes = self._feed(state, times, values)
+        self.save_state(folder.name)
+
+        newest_file = max((f.stat().st_mtime for f in folder.glob('*.csv')), default=time.time())
+        now = time.time()
+        alerts = [spikes.assign(detector='growth')]
+        if cps:
+            alerts.append(pd.DataFrame({
+                'ds': [t for t, _, _ in cps],
+                'value': np.nan,
+                'score': [stat for _, _, stat in cps],
+                'detector': 'changepoint',
+            }))
+        alerts = pd.concat(alerts, ignore_index=True)
+        if alerts.empty:
+            return None
+        alerts['series'] = folder.name
+        alerts['alerted_at'] = pd.Timestamp.fromtimestamp(now)
+        alerts['latency_s'] = round(now - newest_file, 3)
+        return alerts[ALERT_COLUMNS]
+
+    def emit(self, alerts):
+        for row in alerts.itertuples(index=False):
+            print(f"🚨 [{row.series}] {row.detector} {row.ds} 得分 {row.score:.2f}（文件落地后 {row.latency_s:.1f} 秒）")
+        alerts.to_csv(self.alerts_path, mode='a', header=not self.alerts_path.exists(), index=False)
+
+    # === 主循环 ===
+    def changed_folders(self):
+        """返回目录修改时间有变化（即有文件新增/删除）的业务文件夹"""
+        changed = set(self.events.pop()) if self.events is not None else set()
+        for folder in self.data_path.iterdir():
+            if not folder.is_dir():
+                continue
+            mtime = folder.stat().st_mtime_ns
+            if self.folder_mtimes.get(folder) != mtime:
+                self.folder_mtimes[folder] = mtime
+                changed.add(folder)
+        return sorted(changed)
+
+    def run_once(self):
+        for folder in self.changed_folders():
+            try:
+                alerts = self.process_folder(folder)
+            except Exception as e:
+                print(f"处理 {folder.name} 时出错: {e}")
+                continue
+            if alerts is not None:
+                self.emit(alerts)
+
+    def run(self):
+        observer = None
+        if Observer is not None:
+            self.events = FolderEvents(self.wakeup)
+            observer = Observer()
+            observer.schedule(self.events, str(self.data_path), recursive=True)
+            observer.start()
+            print(f"使用 watchdog 监视 {self.data_path}")
+        else:
+            print(f"未安装 watchdog，每 {self.poll_interval} 秒轮询 {self.data_path}")
+        try:
+            while True:
+                self.run_once()
+                self.wakeup.wait(self.poll_interval)
+                self.wakeup.clear()
+        except KeyboardInterrupt:
+            print("\n监视已停止")
+        finally:
+            if observer is not None:
+                observer.stop()
+                observer.join()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="监视新落地的CSV文件，增量合并并实时检测")
+    parser.add_argument('--data', default='data', help="数据根目录")
+    parser.add_argument('--state-dir', default='state', help="检查点和报警文件目录")
+    parser.add_argument('--interval', type=float, default=5.0, help="轮询间隔（秒）")
+    parser.add_argument('--threshold', type=float, default=13.0, help="FOCUS 报警阈值")
+    parser.add_argument('--z-thresh', type=float, default=6.0, help="突增得分 z-score 报警阈值")
+    parser.add_argument('--once', action='store_true', help="只处理一轮后退出（适合 cron）")
+    args = parser.parse_args()
+
+    watcher = Watcher(args.data, args.state_dir, args.interval, args.threshold, args.z_thresh)
+    if args.once:
+        watcher.run_once()
+    else:
+        watcher.run()